@@ -24,7 +24,16 @@ def create_app():
     app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, os.getenv('UPLOAD_FOLDER', 'uploads'))
     app.config['JWT_COOKIE_CSRF_PROTECT'] = os.getenv('JWT_COOKIE_CSRF_PROTECT', 'False').lower() in ['true', '1', 't']
     app.config['MAX_CONTENT_LENGTH'] = 300 * 1024 * 1024
+    app.config['USE_X_SENDFILE'] = os.getenv('UPLOADS_SERVE_MODE', 'flask').lower() == 'x-sendfile'
     
+    # Request latency and MongoDB command metrics, served at /metrics
+    from .services.metrics import init_metrics
+    init_metrics(app)
+
+    # Local uploads go to UPLOAD_FOLDER
+    from .services.storage import init_storage
+    init_storage(app.config['UPLOAD_FOLDER'])
+
     jwt = JWTManager(app)
 
     cors_origin = os.getenv('CORS_ORIGIN')
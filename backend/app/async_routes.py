@@ -0,0 +1,201 @@
+# Native async versions of the I/O-bound endpoints, served by asgi.py next to the Flask app.
+# This module is imported after create_app(), it reuses helpers from routes.py.
+import os
+import asyncio
+import contextlib
+
+import httpx
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from .routes import _sse_event
+from .services import db as db_service
+from .services.rag import create_safe_namespace, get_rag_components, is_rag_ready, RagUnavailableError
+from .services.rag import aanswer_rulebook_query, get_async_index, close_async_index
+from .services.metrics import track_external, ASGIMetricsMiddleware
+
+
+BGG_API_KEY = os.getenv('BGG_API_KEY')
+
+# One pooled client for all the BGG proxy requests of the process
+bgg_client = httpx.AsyncClient(
+    timeout=15,
+    limits=httpx.Limits(max_connections=int(os.getenv('BGG_MAX_CONNECTIONS', '50')))
+)
+
+
+class AuthError(Exception):
+    pass
+
+
+def _current_user(request):
+    # Same checks as @jwt_required() (token locations, CSRF), run by flask_jwt_extended on the request headers
+    flask_app = request.app.state.flask_app
+    headers = [(name, value) for name, value in request.headers.items() if name.lower() != 'content-length']
+    try:
+        with flask_app.test_request_context(request.url.path, method=request.method, headers=headers):
+            verify_jwt_in_request()
+            return get_jwt_identity()
+    except Exception as e:
+        raise AuthError(str(e))
+
+
+async def _bgg_get(url, params=None):
+    headers = {}
+    if BGG_API_KEY:
+        headers["Authorization"] = f"Bearer {BGG_API_KEY}"
+    operation = url.rsplit('/', 1)[-1]
+    with track_external('bgg', operation):
+        resp = await bgg_client.get(url, headers=headers, params=params)
+    while resp.status_code == 202:
+        # BGG is still preparing the response, wait without holding a thread
+        await asyncio.sleep(2)
+        with track_external('bgg', operation):
+            resp = await bgg_client.get(url, headers=headers, params=params)
+    return resp
+
+async def bgg_search(request):
+    query = request.query_params.get('query', '')
+    resp = await _bgg_get('https://boardgamegeek.com/xmlapi2/search', params={'query': query})
+    return Response(resp.content, status_code=resp.status_code, media_type=resp.headers.get("Content-Type"))
+
+async def bgg_thing(request):
+    object_id = request.query_params.get('id', '')
+    resp = await _bgg_get('https://boardgamegeek.com/xmlapi2/thing', params={'id': object_id})
+    return Response(resp.content, status_code=resp.status_code, media_type=resp.headers.get("Content-Type"))
+
+
+def _stream_chat_response(answer_chunks, page_refs, context=None, on_complete=None):
+    # Async counterpart of routes._stream_chat_response, answer_chunks is an async iterable
+    async def generate():
+        yield _sse_event('page_refs', page_refs)
+        if context is not None:
+            yield _sse_event('context', context)
+        answer = []
+        try:
+            async for chunk in answer_chunks:
+                answer.append(chunk)
+                yield _sse_event('token', {'delta': chunk})
+        except Exception as e:
+            print(f"Error streaming rulebook chat: {str(e)}")
+            yield _sse_event('error', {'error': str(e)})
+            return
+        if on_complete is not None:
+            on_complete(''.join(answer))
+        yield _sse_event('done', {})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def _single_chunk(text):
+    yield text
+
+async def rulebook_chat(request):
+    try:
+        _current_user(request)
+    except AuthError as e:
+        return JSONResponse({'msg': str(e)}, status_code=401)
+
+    try:
+        data = await request.json()
+        query = data.get('query')
+        rulebook_id = data.get('rulebook_id')
+
+        if not query:
+            return JSONResponse({'error': 'No query provided'}, status_code=400)
+
+        if not rulebook_id:
+            return JSONResponse({'error': 'No rulebook ID provided'}, status_code=400)
+
+        try:
+            rulebook = await db_service.get_async_db()['rulebooks'].find_one({'_id': ObjectId(rulebook_id)})
+        except InvalidId:
+            rulebook = None
+
+        if not rulebook:
+            return JSONResponse({'error': 'Rulebook not found'}, status_code=404)
+
+        # Waiting for the warm-up blocks, so it is done in a thread
+        if is_rag_ready():
+            _, embedding_provider, llm_client = get_rag_components()
+        else:
+            _, embedding_provider, llm_client = await asyncio.to_thread(get_rag_components)
+        async_index = await get_async_index()
+
+        namespace = create_safe_namespace(rulebook.get('filename', ''))
+        include_context = data.get('include_context', False)
+        stream = data.get('stream', False)
+
+        result = await aanswer_rulebook_query(query, namespace, async_index, embedding_provider, llm_client, stream=stream)
+
+        if stream:
+            answer = result['answer']
+            return _stream_chat_response(
+                _single_chunk(answer) if isinstance(answer, str) else answer,
+                result['page_refs'],
+                result['context'] if include_context else None,
+                on_complete=result['on_complete']
+            )
+
+        response_payload = {'answer': result['answer'], 'page_refs': result['page_refs']}
+        if include_context:
+            response_payload['context'] = result['context']
+        return JSONResponse(response_payload)
+
+    except RagUnavailableError as e:
+        return JSONResponse({
+            'error': str(e),
+            'message': 'Rulebook chat is not available yet, please retry shortly'
+        }, status_code=503)
+    except Exception as e:
+        print(f"Error in rulebook chat: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+# Paths served by the async app, everything else goes to Flask
+ASYNC_PATHS = {'/bgg/search', '/bgg/thing', '/rulebook-chat'}
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await bgg_client.aclose()
+    await close_async_index()
+    if is_rag_ready():
+        _, _, llm_client = get_rag_components()
+        await llm_client.aclose()
+    if db_service.async_client is not None:
+        await db_service.async_client.close()
+
+def create_async_app(flask_app):
+    # Same CORS policy as create_app
+    cors_origin = os.getenv('CORS_ORIGIN')
+    if cors_origin:
+        cors = {'allow_origins': [origin.strip() for origin in cors_origin.split(',')]}
+    else:
+        cors = {'allow_origin_regex': '.*'}
+
+    app = Starlette(
+        routes=[
+            Route('/bgg/search', bgg_search, methods=['GET']),
+            Route('/bgg/thing', bgg_thing, methods=['GET']),
+            Route('/rulebook-chat', rulebook_chat, methods=['POST']),
+        ],
+        middleware=[
+            # Same request metrics as the Flask hooks, for the paths served here
+            Middleware(ASGIMetricsMiddleware),
+            Middleware(CORSMiddleware, allow_credentials=True, allow_methods=['*'], allow_headers=['*'], **cors)
+        ],
+        lifespan=lifespan
+    )
+    app.state.flask_app = flask_app
+    return app
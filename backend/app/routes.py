@@ -1,44 +1,93 @@
 from datetime import datetime, time, timedelta
 import traceback
 from dotenv import find_dotenv, load_dotenv
-from flask import Blueprint, Response, jsonify, render_template, request, send_from_directory
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, decode_token
+from flask import Blueprint, Response, jsonify, render_template, request, send_from_directory, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, decode_token, verify_jwt_in_request
 from jwt.exceptions import InvalidTokenError
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 import os
 import uuid
 from bson import ObjectId
 from flask import current_app
 import requests
 import json
+import re
+import hashlib
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from .services.db import players_collection, games_collection, matches_collection, wishlists_collection, rulebooks_collection
+from .services.db import players_collection, games_collection, matches_collection, wishlists_collection, rulebooks_collection, achievements_collection, get_pool_metrics
+from .services.db import games_analytics_collection, matches_analytics_collection, players_analytics_collection, wishlists_analytics_collection, rulebooks_analytics_collection
 from .services.bgg_import import import_games_from_bgg
 from .services.achievements_management import check_update_achievements
 from .services.achievements_setup import create_achievements
 
-from .services.s3 import S3Client
-from .services.rag import query_llm, query_index, display_search_results, initialize_pinecone, create_safe_namespace, index_single_pdf, clear_namespace
+from .services.storage import get_storage, resolve_urls, refresh_stored_urls
+from .services.images import schedule_match_image_processing, backfill_match_images
+from .services.rag import create_safe_namespace, index_single_pdf, clear_namespace, answer_rulebook_query
+from .services.rag import start_rag_warmup, get_rag_components, get_rag_status, RagUnavailableError
+from .services.keyword_index import keyword_search
+from .services.chunking import get_chunking_settings
+from .services.metrics import track_external, render_prometheus
+from .services.query_profiler import profiled_aggregate, list_slow_queries, QUERY_PROFILING_ENABLED, SLOW_QUERY_THRESHOLD_MS
 
 
 #embedding_model = initialize_embedding_model()
 #index = initialize_pinecone()
 
-if os.getenv('ENABLE_RAG') == 'True':
-    index, embedding_provider = initialize_pinecone()
+# The RAG stack (Pinecone, embedding model, LLM client) is initialized lazily on first use,
+# set RAG_EAGER_WARMUP=True to start warming it up in the background as soon as the app starts
+# (in each worker when gunicorn preloads the app, see gunicorn.conf.py)
+ENABLE_RAG = os.getenv('ENABLE_RAG') == 'True'
+if ENABLE_RAG and os.getenv('RAG_EAGER_WARMUP', 'False').lower() in ['true', '1', 't'] and os.getenv('RAG_WARMUP_AFTER_FORK') != 'True':
+    start_rag_warmup()
 
 STORAGE_TYPE = os.getenv('STORAGE_TYPE')#'local'#'s3'
 BGG_API_KEY = os.getenv('BGG_API_KEY')
 
-upload_folder = None
+# How local uploads are served: 'flask' streams them from the worker, 'x-accel' (nginx) and
+# 'x-sendfile' (apache, lighttpd) only send a header and let the reverse proxy stream the file
+UPLOADS_SERVE_MODE = os.getenv('UPLOADS_SERVE_MODE', 'flask').lower()
+UPLOADS_ACCEL_PREFIX = os.getenv('UPLOADS_ACCEL_PREFIX', '/protected-uploads').rstrip('/')
+# Uploaded filenames are unique (uuid-prefixed or content-addressed) and never overwritten, so they can be cached forever
+UPLOADS_CACHE_MAX_AGE = int(os.getenv('UPLOADS_CACHE_MAX_AGE', '31536000'))
 
-if STORAGE_TYPE in ['s3']:
-    minio_client = S3Client.get_client()
-elif STORAGE_TYPE in ['local']:
-    # Create the upload folder if it doesn't exist
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder)
+# Backend for the uploaded files (STORAGE_TYPE), connected in the background
+# so that the first request doesn't pay for it
+storage = get_storage(STORAGE_TYPE)
+storage.warm_up()
+
+
+# Uploads rulebooks to S3 in parallel with their indexing
+rulebook_upload_executor = ThreadPoolExecutor(max_workers=int(os.getenv('RULEBOOK_UPLOAD_WORKERS', '4')), thread_name_prefix='rulebook-upload')
+
+# Keys handed out by /upload-url, the only ones accepted when confirming a direct upload:
+# '<uploader tag>_<uuid>_<filename>', see _upload_owner
+UPLOAD_KEY_PATTERN = re.compile(r'^(?P<owner>[0-9a-f]{16})_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_(?P<filename>[^/\\]+)$')
+
+def _upload_owner(username):
+    # Tag of the player a direct upload key is issued to, so that nobody else can attach the object
+    return hashlib.sha256(username.encode('utf-8')).hexdigest()[:16]
+
+def _parse_upload_key(key, username):
+    # Return the original filename of a key issued to username by /upload-url, None for any other key
+    match = UPLOAD_KEY_PATTERN.match(key or '')
+    if match is None or match.group('owner') != _upload_owner(username):
+        return None
+    return match.group('filename')
+
+# Players allowed to run the maintenance routes (storage cleanup, migrations), none by default
+ADMIN_USERNAMES = {name.strip() for name in os.getenv('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+def admin_required(view):
+    # Like jwt_required, and the logged user must be listed in ADMIN_USERNAMES
+    @wraps(view)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if get_jwt_identity() not in ADMIN_USERNAMES:
+            return jsonify({'error': 'Admin privileges required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 
 bgg_bp = Blueprint('bgg', __name__)
@@ -47,11 +96,14 @@ def _bgg_get(url, params = None):
     headers = {}
     if BGG_API_KEY:
         headers["Authorization"] = f"Bearer {BGG_API_KEY}"
-    resp = requests.get(url, headers=headers, params=params, timeout=15)
+    operation = url.rsplit('/', 1)[-1]
+    with track_external('bgg', operation):
+        resp = requests.get(url, headers=headers, params=params, timeout=15)
     while resp.status_code == 202:
         time.sleep(2)
-        resp = requests.get(url, headers=headers, params=params, timeout=15)
-    return resp 
+        with track_external('bgg', operation):
+            resp = requests.get(url, headers=headers, params=params, timeout=15)
+    return resp
 
 @bgg_bp.route('/bgg/search', methods=['GET'])
 def bgg_search():
@@ -176,7 +228,7 @@ data_bp = Blueprint('games', __name__)
 @jwt_required()
 def get_games():
     try:
-        games = games_collection.find()
+        games = games_analytics_collection.find()
         
         games_data = []
 
@@ -212,7 +264,7 @@ def update_games():
 def get_players():
 
     try:
-        players = players_collection.find()
+        players = players_analytics_collection.find()
         
         players_data = []
 
@@ -247,17 +299,18 @@ def log_match():
         # Check if the file is empty
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
-        # Create a unique filename
-        unique_file = f"{uuid.uuid4()}_{file.filename}"
-        if STORAGE_TYPE in ['local']:
-            image_file_name = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_file)
-            file.save(image_file_name)
-        elif STORAGE_TYPE in ['s3']:
-             image_file_name = S3Client.put(
-                file,
-                unique_file,
-                content_type=file.content_type
-            )
+        image_file_name = storage.put(file, file.filename, content_type=file.content_type)
+    elif request.form.get('image_key') and storage.supports_direct_upload:
+        # The image was uploaded directly to the bucket with a presigned URL from /upload-url
+        image_key = request.form.get('image_key')
+        if _parse_upload_key(image_key, get_jwt_identity()) is None:
+            return jsonify({'error': 'Invalid image key'}), 400
+        uploaded = storage.head(image_key)
+        if uploaded is None:
+            return jsonify({'error': 'Uploaded image not found'}), 400
+        if not (uploaded['content_type'] or '').startswith('image/'):
+            return jsonify({'error': 'Uploaded file is not an image'}), 400
+        image_file_name = storage.reference(image_key)
 
     # Parse player data
     players = []
@@ -327,13 +380,18 @@ def log_match():
 
     if image_file_name is not None:
         match_data['image'] = {
-            'type' : STORAGE_TYPE,
-            'filename' : image_file_name
+            'type' : storage.type,
+            'filename' : image_file_name,
+            'url' : storage.url(image_file_name)
         }
 
     result = matches_collection.insert_one(match_data)
     match_id = result.inserted_id 
 
+    # Create the thumbnail and WebP variants in the background
+    if image_file_name is not None:
+        schedule_match_image_processing(match_id, match_data['image'])
+
     # Update players' stats
 
 
@@ -405,11 +463,45 @@ def log_match():
 
     return jsonify({'message': 'Match logged successfully'}), 201
 
+@data_bp.route('/upload-url', methods=['POST'])
+@jwt_required()
+def get_upload_url():
+    # Let the client upload a match image or a rulebook straight to the bucket,
+    # then pass the returned key to /logmatch (image_key) or /confirm-rulebook-upload
+    if not storage.supports_direct_upload:
+        return jsonify({'error': 'Direct uploads are only available with S3 storage'}), 400
+
+    data = request.get_json(silent=True) or {}
+    filename = os.path.basename(data.get('filename') or '')
+    content_type = data.get('content_type') or ''
+    kind = data.get('kind', 'image')
+
+    if filename == '':
+        return jsonify({'error': 'No filename provided'}), 400
+    if kind == 'image':
+        if not content_type.startswith('image/'):
+            return jsonify({'error': 'File must be an image'}), 400
+    elif kind == 'rulebook':
+        if not filename.lower().endswith('.pdf'):
+            return jsonify({'error': 'File must be PDF'}), 400
+        content_type = 'application/pdf'
+    else:
+        return jsonify({'error': 'Unknown upload kind'}), 400
+
+    try:
+        key = f"{_upload_owner(get_jwt_identity())}_{uuid.uuid4()}_{filename}"
+        presigned = storage.presigned_upload(key, content_type)
+        return jsonify({'key': key, 'url': presigned['url'], 'fields': presigned['fields']}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @data_bp.route('/wishlist', methods=['GET'])
 @jwt_required()
 def get_wishlist():
     try:
-        wishlists = wishlists_collection.find()
+        wishlists = wishlists_analytics_collection.find()
         
         wishlists_data = []
 
@@ -497,8 +589,23 @@ def remove_wishlist():
 @auth_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     try:
-        # Send the file from the upload folder
-        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+        if UPLOADS_SERVE_MODE == 'x-accel':
+            # Let nginx stream the file from its internal location
+            file_path = safe_join(current_app.config['UPLOAD_FOLDER'], filename)
+            if file_path is None or not os.path.isfile(file_path):
+                return jsonify({'error': 'File not found'}), 404
+            response = Response(mimetype=None)
+            response.headers['X-Accel-Redirect'] = f"{UPLOADS_ACCEL_PREFIX}/{filename}"
+            del response.headers['Content-Type']
+        else:
+            # Send the file from the upload folder, with ETag and range support
+            # (with UPLOADS_SERVE_MODE=x-sendfile Flask only sets the X-Sendfile header)
+            response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, max_age=UPLOADS_CACHE_MAX_AGE)
+
+        response.cache_control.public = True
+        response.cache_control.max_age = UPLOADS_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
     except Exception as e:
         return jsonify({'error': f"Failed to retrieve file: {str(e)}"}), 404
 
@@ -507,23 +614,34 @@ def uploaded_file(filename):
 def matchHistory():
     # Get all the matches from the database
     try:
-        matches = matches_collection.find()
+        matches = matches_analytics_collection.find()
         
         matches_data = []
+        images = []
 
         for match in matches:
             match['_id'] = str(match['_id'])
             if 'image' in match.keys():
-                if match['image']['type'] in ['s3']:
-                    match['image_url'] = S3Client.get_url_from_filename(match['image']['filename'])
-                elif match['image']['type'] in ['local']:
-                    filename = os.path.basename(match['image']['filename'])
-                    match['image_url'] = f"/uploads/{filename}"
+                image = match['image']
+                # The full size image is served as WebP once the variant is ready, the original until then.
+                # The list only shows a thumbnail when there is one, never the original.
+                if 'url' in image:
+                    match['image_url'] = image.get('webp_url') or image['url']
+                    if image.get('thumbnail_url'):
+                        match['thumbnail_url'] = image['thumbnail_url']
+                else:
+                    # Matches logged before the URLs were stored, until /migrate-file-urls is run
+                    images.append((match, 'image_url', {'type': image['type'], 'filename': image.get('webp') or image['filename']}))
+                    if image.get('thumbnail'):
+                        images.append((match, 'thumbnail_url', {'type': image['type'], 'filename': image['thumbnail']}))
 
                 del match['image']
                     
             matches_data.append(match)
 
+        for (match, field, _), url in zip(images, resolve_urls([file for _, _, file in images])):
+            match[field] = url
+
         # Sort matches by date in descending order
         matches_data.sort(key=lambda x: (x['date'], x['_id']), reverse=True)
 
@@ -544,22 +662,20 @@ def get_achievements():
         player_name = get_jwt_identity()
 
     # Find the player in the database
-    player = players_collection.find_one({'username': player_name})
+    player = players_analytics_collection.find_one({'username': player_name})
     if not player:
         return jsonify({'error': 'Player not found'}), 404
     # Get the achievements from the player
     achievements = player.get('achievements', [])
 
-    achievements_data = []
+    # The clients read the image URL from image.filename; older achievements without a stored URL are resolved here
+    missing = [achievement['image'] for achievement in achievements if 'url' not in achievement['image']]
+    resolved = iter(resolve_urls(missing))
 
+    achievements_data = []
     for achievement in achievements:
-        if achievement['image']['type'] in ['s3']:
-            achievement['image']['filename'] = S3Client.get_url_from_filename(achievement['image']['filename'])
-        elif achievement['image']['type'] in ['local']:
-            filename = os.path.basename(achievement['image']['filename'])
-            achievement['image']['filename'] = f"/uploads/{filename}"
-            
-        achievements_data.append(achievement)
+        url = achievement['image']['url'] if 'url' in achievement['image'] else next(resolved)
+        achievements_data.append({**achievement, 'image': {**achievement['image'], 'filename': url}})
    
     return jsonify(achievements_data), 200
 
@@ -569,7 +685,7 @@ def get_achievements():
 def getGamesWithRules():
 
     # Find games in the database
-    games = rulebooks_collection.find()
+    games = rulebooks_analytics_collection.find()
 
     game_ids = []
     for game in games:
@@ -689,7 +805,7 @@ def totHours():
             }
         ]
 
-        result = list(matches_collection.aggregate(pipeline))
+        result = profiled_aggregate(matches_analytics_collection, pipeline)
 
 
         if result:
@@ -755,9 +871,9 @@ def totMatches():
                 }
             ]
 
-            #result = list(matches_collection.aggregate(pipeline))
+            #result = list(matches_analytics_collection.aggregate(pipeline))
             
-            total_matches = len(list(matches_collection.aggregate(pipeline)))
+            total_matches = len(profiled_aggregate(matches_analytics_collection, pipeline))
     
             
     
@@ -799,7 +915,7 @@ def playerWins():
         except ValueError:
             return jsonify({'error': 'Invalid end_date format. Use YYYY-MM-DD'}), 400
 
-    player = players_collection.find_one({'username': player_name})
+    player = players_analytics_collection.find_one({'username': player_name})
     if start_date_str is None and end_date_str is None:
         # Read from player's collection
         return jsonify({
@@ -864,7 +980,7 @@ def playerWins():
             }
         ]
 
-        result = list(players_collection.aggregate(pipeline))
+        result = profiled_aggregate(players_analytics_collection, pipeline)
 
         if result:
             total_wins = result[0]["total_wins"]
@@ -906,7 +1022,7 @@ def playerWinRate():
         except ValueError:
             return jsonify({'error': 'Invalid end_date format. Use YYYY-MM-DD'}), 400
 
-    player = players_collection.find_one({'username': player_name})
+    player = players_analytics_collection.find_one({'username': player_name})
 
     if start_date_str is None and end_date_str is None:
         # Read from player's collection, prevent division by zero
@@ -1000,7 +1116,7 @@ def playerWinRate():
             }
         ]
 
-        result = list(players_collection.aggregate(pipeline))
+        result = profiled_aggregate(players_analytics_collection, pipeline)
 
         if result:
             winrate = result[0]["winrate"]
@@ -1029,7 +1145,7 @@ def playerLongWinstreak():
     if not player_name:
         player_name = get_jwt_identity()
 
-    player = players_collection.find_one({'username': player_name})
+    player = players_analytics_collection.find_one({'username': player_name})
 
     return jsonify({
         "type": "number",
@@ -1144,7 +1260,7 @@ def playerHighestWinRate():
     ]
 
 
-    result = list(players_collection.aggregate(pipeline))
+    result = profiled_aggregate(players_analytics_collection, pipeline)
 
     if result:
         return jsonify({
@@ -1206,12 +1322,12 @@ def playerGameWins():
         }
     ]
 
-    result = list(players_collection.aggregate(pipeline))
+    result = profiled_aggregate(players_analytics_collection, pipeline)
 
     if result:
         # Get the games' names from the game collection
-        best_game = games_collection.find_one({"bgg_id": result[0]["_id"]})
-        worst_game = games_collection.find_one({"bgg_id": result[-1]["_id"]})
+        best_game = games_analytics_collection.find_one({"bgg_id": result[0]["_id"]})
+        worst_game = games_analytics_collection.find_one({"bgg_id": result[-1]["_id"]})
         
         best_game_name = best_game["name"] if best_game else "Unknown"
         worst_game_name = worst_game["name"] if worst_game else "Unknown"
@@ -1342,11 +1458,11 @@ def gameCoopWinRate():
             }
         ]
 
-    result = list(games_collection.aggregate(pipeline))
+    result = profiled_aggregate(games_analytics_collection, pipeline)
 
     if result:
         for game in result:
-            game_data = games_collection.find_one({"bgg_id": game["game_id"]})
+            game_data = games_analytics_collection.find_one({"bgg_id": game["game_id"]})
             game["name"] = game_data["name"] if game_data else "Unknown"
             # Remove the game_id from the result
             del game["game_id"]
@@ -1388,13 +1504,13 @@ def gameNumMatch():
             }
         ]
     
-        result = list(games_collection.aggregate(pipeline))
+        result = profiled_aggregate(games_analytics_collection, pipeline)
     
         if result:
 
             # Get the games' names from the game collection
-            most_played = games_collection.find_one({"bgg_id": result[0]["_id"]})
-            least_played = games_collection.find_one({"bgg_id": result[-1]["_id"]})
+            most_played = games_analytics_collection.find_one({"bgg_id": result[0]["_id"]})
+            least_played = games_analytics_collection.find_one({"bgg_id": result[-1]["_id"]})
             
             most_played_name = most_played["name"] if most_played else "Unknown"
             least_played_name = least_played["name"] if least_played else "Unknown"
@@ -1478,12 +1594,12 @@ def gameAvgDuration():
             }
         ]
     
-    result = list(games_collection.aggregate(pipeline))
+    result = profiled_aggregate(games_analytics_collection, pipeline)
 
     if result:
         # Add game names to results
         for game in result:
-            game_data = games_collection.find_one({"bgg_id": game["_id"]})
+            game_data = games_analytics_collection.find_one({"bgg_id": game["_id"]})
             game["name"] = game_data["name"] if game_data else "Unknown"
 
         if game_name:
@@ -1562,7 +1678,7 @@ def gameBestValue():
         }
     ]
 
-    result = list(games_collection.aggregate(pipeline))
+    result = profiled_aggregate(games_analytics_collection, pipeline)
 
     if result:
         return jsonify({
@@ -1592,7 +1708,7 @@ def gameHighestScore():
             "description": "Missing game name"
         }), 200
     
-    game = games_collection.find_one({'name': game_name})
+    game = games_analytics_collection.find_one({'name': game_name})
 
     if not game:
         return jsonify({
@@ -1629,7 +1745,7 @@ def gameAvgScore():
             "description": "Missing game name"
         }), 200
     
-    game = games_collection.find_one({'name': game_name})
+    game = games_analytics_collection.find_one({'name': game_name})
 
     if not game:
         return jsonify({
@@ -1669,14 +1785,175 @@ def setupAchievements():
     create_achievements()
     return jsonify({'message': 'Achievements created successfully'}), 200
 
+@utility_bp.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the worker is up and serving requests
+    return jsonify({'status': 'ok'}), 200
+
+@utility_bp.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: the dependencies needed to serve requests are reachable
+    checks = {}
+    try:
+        players_collection.database.command('ping')
+        checks['mongo'] = {'ok': True, 'error': None}
+    except Exception as e:
+        checks['mongo'] = {'ok': False, 'error': str(e)}
+
+    checks['storage'] = storage.health_check()
+
+    # A RAG stack still warming up doesn't make the instance unready, the other routes work
+    rag = get_rag_status()
+    rag['enabled'] = ENABLE_RAG
+
+    ready = all(check['ok'] for check in checks.values())
+    return jsonify({'ready': ready, 'checks': checks, 'rag': rag}), 200 if ready else 503
+
+@utility_bp.route('/migrate-file-urls', methods=['POST'])
+@admin_required
+def migrate_file_urls():
+    # Recompute the file URLs stored on achievements, players, matches and rulebooks,
+    # needed after S3_ENDPOINT or STORAGE_PUBLIC_URL change
+    try:
+        updated = refresh_stored_urls()
+        return jsonify({'message': 'File URLs refreshed successfully', 'updated': updated}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@utility_bp.route('/backfill-image-derivatives', methods=['POST'])
+@admin_required
+def backfill_image_derivatives():
+    # Create the thumbnail and WebP variants of the match images logged before they existed,
+    # in the background; limit caps the number of matches scheduled by one call
+    try:
+        limit = request.args.get('limit', type=int)
+        scheduled = backfill_match_images(limit)
+        return jsonify({'message': 'Image derivatives scheduled', 'scheduled': scheduled}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@utility_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus scrape endpoint, protected by the METRICS_TOKEN bearer token when it is set
+    # and restricted to the admins otherwise
+    metrics_token = os.getenv('METRICS_TOKEN')
+    if metrics_token:
+        if request.headers.get('Authorization') != f'Bearer {metrics_token}':
+            return jsonify({'error': 'Unauthorized'}), 401
+    else:
+        verify_jwt_in_request()
+        if get_jwt_identity() not in ADMIN_USERNAMES:
+            return jsonify({'error': 'Admin privileges required'}), 403
+
+    pool = get_pool_metrics()
+    gauges = {
+        'meeplestats_db_pool_connections_open': ('Open MongoDB connections of the worker', pool['connections_open']),
+        'meeplestats_db_pool_connections_in_use': ('MongoDB connections checked out of the pool', pool['connections_in_use']),
+    }
+    counters = {
+        'meeplestats_db_pool_connections_created': ('MongoDB connections created since the worker started', pool['connections_created']),
+        'meeplestats_db_pool_checkouts': ('Connection checkouts since the worker started', pool['checkouts']),
+        'meeplestats_db_pool_checkout_failures': ('Failed connection checkouts since the worker started', pool['checkout_failures']),
+        'meeplestats_db_pool_checkout_wait_seconds': ('Time spent waiting for a pooled connection since the worker started', pool['checkout_wait_seconds']),
+    }
+    return Response(render_prometheus(gauges, counters), status=200, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@utility_bp.route('/slow-queries', methods=['GET'])
+@admin_required
+def slow_queries():
+    # Explain plans of the statistic pipelines slower than SLOW_QUERY_THRESHOLD_MS, newest first
+    name = request.args.get('name')
+    try:
+        # limit(0) would mean no limit
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        return jsonify({
+            'enabled': QUERY_PROFILING_ENABLED,
+            'threshold_ms': SLOW_QUERY_THRESHOLD_MS,
+            'queries': list_slow_queries(name, limit)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@utility_bp.route('/db-pool-stats', methods=['GET'])
+@jwt_required()
+def db_pool_stats():
+    # Connection pool counters of the worker process serving the request
+    return jsonify(get_pool_metrics()), 200
+
+@utility_bp.route('/storage-health', methods=['GET'])
+def storage_health():
+    health = storage.health_check()
+    health['storage_type'] = storage.type
+    return jsonify(health), 200 if health['ok'] else 503
+
+@utility_bp.route('/cleanup-storage', methods=['POST'])
+@admin_required
+def cleanup_storage():
+    # Delete the stored files no longer referenced by matches, achievements or rulebooks.
+    # Runs as a dry run unless dry_run=false is passed.
+    data = request.get_json(silent=True) or {}
+    dry_run = str(data.get('dry_run', request.args.get('dry_run', 'true'))).strip().lower() not in ['false', '0', 'no']
+    try:
+        # Skip recent objects, they may belong to a presigned upload not confirmed yet
+        min_age = timedelta(hours=float(data.get('min_age_hours', request.args.get('min_age_hours', 24))))
+    except ValueError:
+        return jsonify({'error': 'min_age_hours must be a number'}), 400
+
+    try:
+        # Compare by base name, local references are full paths and rulebooks only keep their URL
+        referenced = set()
+        for match in matches_collection.find({'image.type': storage.type}, {'image': 1}):
+            for field in ['filename', 'thumbnail', 'webp']:
+                if match['image'].get(field):
+                    referenced.add(os.path.basename(match['image'][field]))
+        for achievement in achievements_collection.find({}, {'image': 1, 'badges': 1}):
+            for file in [achievement.get('image')] + list((achievement.get('badges') or {}).values()):
+                if file and file.get('type') == storage.type:
+                    referenced.add(os.path.basename(file['filename']))
+        for rulebook in rulebooks_collection.find({}, {'file_url': 1}):
+            if rulebook.get('file_url'):
+                referenced.add(rulebook['file_url'].split('/')[-1])
+
+        cutoff = datetime.now().astimezone() - min_age
+        orphans = [
+            name for name, last_modified in storage.list_objects()
+            if os.path.basename(name) not in referenced and last_modified < cutoff
+        ]
+
+        failed = [] if dry_run else storage.delete_many(orphans)
+        return jsonify({
+            'dry_run': dry_run,
+            'orphans': orphans,
+            'deleted': 0 if dry_run else len(orphans) - len(failed),
+            'failed': failed
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 rulebooks_bp = Blueprint('rulebooks', __name__)
 
+@rulebooks_bp.before_request
+def warmup_rag():
+    # Start loading the RAG stack as soon as the rulebook pages are used, without blocking the request
+    if ENABLE_RAG:
+        start_rag_warmup()
+
+@rulebooks_bp.route('/rag-status', methods=['GET'])
+def rag_status():
+    status = get_rag_status()
+    status['enabled'] = ENABLE_RAG
+    return jsonify(status), 200
+
 @rulebooks_bp.route('/rulebooks', methods=['GET'])
 @jwt_required()
 def get_rulebooks():
     try:
         # Get all rulebooks from database
-        rulebooks = rulebooks_collection.find()
+        rulebooks = rulebooks_analytics_collection.find()
         
         rulebooks_data = []
         for rulebook in rulebooks:
@@ -1687,6 +1964,15 @@ def get_rulebooks():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _discard_rulebook_upload(index, filename, stored_name=None):
+    # A rulebook that could not be saved must not leave its vectors, keyword index or file behind
+    try:
+        clear_namespace(index, create_safe_namespace(os.path.basename(filename)))
+    except Exception as e:
+        print(f"Error clearing the namespace of {filename}: {str(e)}")
+    if stored_name is not None and not storage.delete(stored_name):
+        print(f"Error deleting the stored file {stored_name}")
+
 @rulebooks_bp.route('/upload-rulebook', methods=['POST'])
 @jwt_required()
 def upload_rulebook():
@@ -1711,47 +1997,178 @@ def upload_rulebook():
         # Get game information
         game_id = request.form.get('game_id')
         game_name = request.form.get('game_name')
+
+        # Get chunking settings, the server defaults are used for the missing ones
+        try:
+            chunking = get_chunking_settings(
+                request.form.get('chunk_strategy'),
+                request.form.get('chunk_size'),
+                request.form.get('chunk_overlap')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Create unique filename
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
+        # Wait for the RAG stack if it is still warming up
+        index, embedding_provider, _ = get_rag_components()
+
+        import tempfile
+        # Spool the request stream once to a temp file
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+            temp_file_path = temp_file.name
+            file.save(temp_file)
+
+        stored_name = None
+        try:
+            try:
+                # Store the spooled file while the same file is being indexed. Rulebooks are
+                # deleted one by one, so they never share a content-addressed file
+                with open(temp_file_path, 'rb') as pdf_stream:
+                    upload = rulebook_upload_executor.submit(storage.put, pdf_stream, file.filename, 'application/pdf', False)
+                    try:
+                        index_single_pdf(file.filename, index, embedding_provider, temp_file_path, chunking)
+                    finally:
+                        # Wait for the upload before closing the stream, and keep its key even if
+                        # indexing failed so that the stored file can be deleted
+                        wait([upload])
+                        if upload.exception() is None:
+                            stored_name = upload.result()
+                    # Raise the upload error, if any
+                    upload.result()
+                file_url = storage.url(stored_name)
+            finally:
+                # Clean up
+                os.remove(temp_file_path)
+
+            # Save rulebook info to database
+            rulebook_data = {
+                'filename': file.filename,
+                'file_url': file_url,
+                'game_id': game_id,
+                'game_name': game_name,
+                'uploaded_by': current_user,
+                'uploaded_at': datetime.now(),
+                'original_uploader': current_user,
+                # Stored so that re-indexing the rulebook gives the same chunks
+                'chunking': chunking
+            }
+
+            rulebooks_collection.insert_one(rulebook_data)
+        except Exception:
+            _discard_rulebook_upload(index, file.filename, stored_name)
+            raise
         
-        # Always use S3 for rulebooks
-        if STORAGE_TYPE == 's3':
-            # Save file to S3
-            S3Client.put(file, unique_filename, content_type='application/pdf')
-            file_url = S3Client.get_url_from_filename(unique_filename)
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                temp_file_path = temp_file.name
-                
-            # Download from S3 to temp file
-            S3Client.download(unique_filename, temp_file_path)
-            
-            index_single_pdf(file.filename, index, embedding_provider, temp_file_path)
+        return jsonify({'message': 'Rulebook uploaded successfully', 'file_url': file_url}), 200
+    except RagUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-            # Clean up
-            os.remove(temp_file_path)
-        else:
-            # Save file locally as fallback
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
-            file_url = f"/uploads/{unique_filename}"
-            index_single_pdf(file.filename, index, embedding_provider, file_path)
-            
-        # Save rulebook info to database
+@rulebooks_bp.route('/confirm-rulebook-upload', methods=['POST'])
+@jwt_required()
+def confirm_rulebook_upload():
+    # Index a rulebook that the client uploaded directly to the bucket with a presigned URL
+    try:
+        current_user = get_jwt_identity()
+
+        if not storage.supports_direct_upload:
+            return jsonify({'error': 'Direct uploads are only available with S3 storage'}), 400
+
+        data = request.get_json(silent=True) or {}
+        key = data.get('key') or ''
+        # The original filename, without the uploader tag and the uuid prefix
+        filename = _parse_upload_key(key, current_user)
+        if filename is None or not filename.lower().endswith('.pdf'):
+            return jsonify({'error': 'Invalid rulebook key'}), 400
+
+        try:
+            chunking = get_chunking_settings(
+                data.get('chunk_strategy'),
+                data.get('chunk_size'),
+                data.get('chunk_overlap')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not storage.exists(key):
+            return jsonify({'error': 'Uploaded rulebook not found'}), 400
+
+        index, embedding_provider, _ = get_rag_components()
+
+        with storage.local_copy(key, suffix='.pdf') as file_path:
+            if file_path is None:
+                return jsonify({'error': 'Uploaded rulebook not found'}), 400
+            try:
+                index_single_pdf(filename, index, embedding_provider, file_path, chunking)
+            except Exception:
+                _discard_rulebook_upload(index, filename)
+                raise
+
+        file_url = storage.url(key)
         rulebook_data = {
-            'filename': file.filename,
+            'filename': filename,
             'file_url': file_url,
-            'game_id': game_id,
-            'game_name': game_name,
+            'game_id': data.get('game_id'),
+            'game_name': data.get('game_name'),
             'uploaded_by': current_user,
             'uploaded_at': datetime.now(),
-            'original_uploader': current_user
+            'original_uploader': current_user,
+            'chunking': chunking
         }
-        
-        rulebooks_collection.insert_one(rulebook_data)
-        
+
+        try:
+            rulebooks_collection.insert_one(rulebook_data)
+        except Exception:
+            # The uploaded object is left to /cleanup-storage
+            _discard_rulebook_upload(index, filename)
+            raise
+
         return jsonify({'message': 'Rulebook uploaded successfully', 'file_url': file_url}), 200
+    except RagUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@rulebooks_bp.route('/rulebook/<rulebook_id>/reindex', methods=['POST'])
+@jwt_required()
+def reindex_rulebook(rulebook_id):
+    try:
+        # Get current user
+        current_user = get_jwt_identity()
+
+        rulebook = rulebooks_collection.find_one({'_id': ObjectId(rulebook_id)})
+
+        if not rulebook:
+            return jsonify({'error': 'Rulebook not found'}), 404
+
+        # Check if user is the one who uploaded the rulebook
+        if rulebook['uploaded_by'] != current_user:
+            return jsonify({'error': 'Unauthorized to re-index this rulebook'}), 403
+
+        # Reuse the stored chunking settings, optionally overridden by the request
+        data = request.get_json(silent=True) or {}
+        stored = rulebook.get('chunking') or {}
+        try:
+            chunking = get_chunking_settings(
+                data.get('chunk_strategy', stored.get('strategy')),
+                data.get('chunk_size', stored.get('chunk_size')),
+                data.get('chunk_overlap', stored.get('chunk_overlap'))
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        index, embedding_provider, _ = get_rag_components()
+
+        filename = rulebook['file_url'].split('/')[-1]
+        with storage.local_copy(filename, suffix='.pdf') as file_path:
+            if file_path is None:
+                return jsonify({'error': 'Rulebook file not found'}), 404
+            index_single_pdf(rulebook['filename'], index, embedding_provider, file_path, chunking)
+
+        rulebooks_collection.update_one({'_id': rulebook['_id']}, {'$set': {'chunking': chunking}})
+
+        return jsonify({'message': 'Rulebook re-indexed successfully', 'chunking': chunking}), 200
+    except RagUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1772,24 +2189,21 @@ def delete_rulebook(rulebook_id):
         if rulebook['uploaded_by'] != current_user:
             return jsonify({'error': 'Unauthorized to delete this rulebook'}), 403
             
+        index, _, _ = get_rag_components()
+
         # Delete from database
         rulebooks_collection.delete_one({'_id': ObjectId(rulebook_id)})
         
         clear_namespace(index, create_safe_namespace(rulebook['filename']))
 
-        # Delete the actual file based on storage type
-        if STORAGE_TYPE == 'local':
-            filename = os.path.basename(rulebook['file_url'])
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        elif STORAGE_TYPE == 's3':
-            file_url = rulebook['file_url']
-            if file_url:
-                filename = file_url.split('/')[-1]
-                S3Client.delete(filename)
+        # Delete the actual file
+        file_url = rulebook['file_url']
+        if file_url:
+            storage.delete(file_url.split('/')[-1])
                 
         return jsonify({'message': 'Rulebook deleted successfully'}), 200
+    except RagUnavailableError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1810,6 +2224,70 @@ def get_rulebook(rulebook_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@rulebooks_bp.route('/rulebook-search', methods=['POST'])
+@jwt_required()
+def rulebook_search():
+    # Keyword-only lookup in the rulebook's local BM25 index, no embedding, Pinecone or LLM calls
+    try:
+        data = request.json
+        query = data.get('query')
+        rulebook_id = data.get('rulebook_id')
+        top_k = int(data.get('top_k', 5))
+
+        if not query:
+            return jsonify({'error': 'No query provided'}), 400
+
+        if not rulebook_id:
+            return jsonify({'error': 'No rulebook ID provided'}), 400
+
+        rulebook = rulebooks_collection.find_one({'_id': ObjectId(rulebook_id)})
+
+        if not rulebook:
+            return jsonify({'error': 'Rulebook not found'}), 404
+
+        namespace = create_safe_namespace(rulebook.get('filename', ''))
+        matches = keyword_search(query, [namespace], top_k=top_k)
+
+        results = [{
+            'text': match['metadata']['text'],
+            'page': str(match['metadata']['page_label']),
+            'file': str(match['metadata']['file_name']),
+            'score': match['score']
+        } for match in matches]
+
+        return jsonify(results), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _sse_event(event, payload):
+    # Server-sent event with a JSON payload, so newlines in the tokens are escaped
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def _stream_chat_response(answer_chunks, page_refs, context=None, on_complete=None):
+    # Send page_refs (and context, if requested) first, then forward the answer tokens as they arrive
+    def generate():
+        yield _sse_event('page_refs', page_refs)
+        if context is not None:
+            yield _sse_event('context', context)
+        answer = []
+        try:
+            for chunk in answer_chunks:
+                answer.append(chunk)
+                yield _sse_event('token', {'delta': chunk})
+        except Exception as e:
+            print(f"Error streaming rulebook chat: {str(e)}")
+            yield _sse_event('error', {'error': str(e)})
+            return
+        if on_complete is not None:
+            on_complete(''.join(answer))
+        yield _sse_event('done', {})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @rulebooks_bp.route('/rulebook-chat', methods=['POST'])
 @jwt_required()
 def rulebook_chat():
@@ -1834,8 +2312,8 @@ def rulebook_chat():
         if not rulebook:
             return jsonify({'error': 'Rulebook not found'}), 404
         
-        # Import the RAG functionality
-        
+        # Get the RAG components, waiting for the warm-up if it is still running
+        index, embedding_provider, llm_client = get_rag_components()
         
         # Get the safe namespace for the rulebook (filename without extension)
         filename = rulebook.get('filename', '')
@@ -1845,98 +2323,42 @@ def rulebook_chat():
         #embedding_model = initialize_embedding_model()
         #index = initialize_pinecone()
         
-        # Query Pinecone
-        top_matches = query_index(query, [namespace], index, embedding_provider)
-        
-        # No matches found
-        if not top_matches:
-            response_payload = {
-                'answer': "I couldn't find any relevant information in this rulebook to answer your question. Please try rephrasing your query or check if this rulebook contains information about this topic.",
-                'page_refs': []
-            }
-            
-            # Include context only if requested
-            include_context = data.get('include_context', False)
-            if include_context:
-                response_payload['context'] = ""
-                
-            return jsonify(response_payload), 200
-        
-        # Process the results
-        context, page_refs = display_search_results(top_matches)
-        
-        # Ensure page_refs are properly serializable
-        serializable_page_refs = []
-        for ref in page_refs:
-            serializable_page_refs.append({
-                "page": str(ref["page"]),
-                "file": str(ref["file"])
-            })
-        
-        # Ensure context is a string
-        if not isinstance(context, str):
-            context = str(context)
-        
-        # Query the LLM
-        answer = query_llm(query, context, page_refs)
-        
-        # Ensure answer is a string
-        if not isinstance(answer, str):
-            answer = str(answer)
-        
+        include_context = data.get('include_context', False)
+        # Stream the answer over server-sent events instead of returning a single JSON body
+        stream = data.get('stream', False)
+
+        # Cache lookup, hybrid search and LLM call, shared with the async route
+        result = answer_rulebook_query(query, namespace, index, embedding_provider, llm_client, stream=stream)
+
+        if stream:
+            answer = result['answer']
+            return _stream_chat_response(
+                [answer] if isinstance(answer, str) else answer,
+                result['page_refs'],
+                result['context'] if include_context else None,
+                on_complete=result['on_complete']
+            )
+
         # Create a response payload with only JSON-serializable types
         response_payload = {
-            'answer': answer,
-            # Only include context if explicitly requested with include_context=true
-            'page_refs': serializable_page_refs
+            'answer': result['answer'],
+            'page_refs': result['page_refs']
         }
         
         # Include context only if requested
-        include_context = data.get('include_context', False)
         if include_context:
-            response_payload['context'] = context
-        
-        # Convert to JSON string and back to dict to ensure all objects are serializable
-        try:
-            import json
-            response_json = json.dumps(response_payload)
-            response_payload = json.loads(response_json)
-        except TypeError as e:
-            print(f"JSON serialization error: {str(e)}")
-            # Fallback response if serialization fails
-            response_payload = {
-                'answer': "I processed your query but encountered an error formatting the response. Please try again.",
-                'page_refs': []
-            }
-            if include_context:
-                response_payload['context'] = ""
+            response_payload['context'] = result['context']
         
         return jsonify(response_payload), 200
-        
+
+    except RagUnavailableError as e:
+        return jsonify({
+            'error': str(e),
+            'message': 'Rulebook chat is not available yet, please retry shortly'
+        }), 503
     except Exception as e:
         error_message = str(e)
         print(f"Error in rulebook chat: {error_message}")
-        
-        # Add more detailed debugging
-        import traceback
-        traceback.print_exc()
-        
-        # Try to identify the problematic object type
-        if "is not JSON serializable" in error_message:
-            try:
-                import inspect
-                print(f"Attempting to identify non-serializable object...")
-                if "page_refs" in locals():
-                    print(f"page_refs type: {type(page_refs)}")
-                    if page_refs and len(page_refs) > 0:
-                        print(f"First page_ref item type: {type(page_refs[0])}")
-                if "context" in locals():
-                    print(f"context type: {type(context)}")
-                if "answer" in locals():
-                    print(f"answer type: {type(answer)}")
-            except Exception as debug_error:
-                print(f"Error during debugging: {str(debug_error)}")
-        
         return jsonify({
             'error': error_message, 
             'message': 'An error occurred while processing your request'
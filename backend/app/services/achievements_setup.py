@@ -1,23 +1,14 @@
 import os
-import uuid
 
 from flask import current_app
-from werkzeug.datastructures import FileStorage
 
-from .s3 import S3Client
+from .storage import get_storage, with_url
 from .db import achievements_collection
 
 def create_achievements():
 
   STORAGE_TYPE = os.getenv('STORAGE_TYPE')#'local'#'s3'
 
-  upload_folder = None
-  if STORAGE_TYPE in ['local']:
-      # Create the upload folder if it doesn't exist
-      upload_folder = current_app.config['UPLOAD_FOLDER']
-      if not os.path.exists(upload_folder):
-          os.makedirs(upload_folder)
-
   achievements = [
     {
       "_id": "veteran",
@@ -147,30 +138,16 @@ def create_achievements():
 
 def process_file(file_path, storage_type):
   filename = os.path.basename(file_path)
-  unique_filename = f"{uuid.uuid4()}_{filename}"
-  
+  storage = get_storage(storage_type)
+
   # Build an absolute path from the project root.
   abs_path = os.path.join(current_app.root_path, file_path)
-  
-  # Create a FileStorage instance from the file
-  fs = FileStorage(stream=open(abs_path, 'rb'),
-                    filename=filename,
-                    content_type='image/png')
-  
-  if storage_type == 'local':
-      final_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-      with open(final_path, 'wb') as out_file:
-          # Write the file data from the FileStorage stream
-          out_file.write(fs.stream.read())
-      # Reset pointer if needed later
-      fs.stream.seek(0)
-  elif storage_type == 's3':
-      final_path = S3Client.put(
-          fs,
-          unique_filename,
-          content_type=fs.content_type
-      )
-  return {
-      'type': storage_type,
+
+  # Badge images are content-addressed, running the setup again doesn't store them twice
+  with open(abs_path, 'rb') as stream:
+      final_path = storage.put(stream, filename, content_type='image/png', dedup=True)
+  # The URL is resolved once here and copied into the players' achievements
+  return with_url({
+      'type': storage.type,
       'filename': final_path
-  }
\ No newline at end of file
+  })
@@ -5,6 +5,11 @@ import xml.etree.ElementTree as ET
 from tqdm import tqdm
 
 from .db import games_collection
+from .metrics import track_external
+
+def _bgg_request(url, headers, operation):
+    with track_external('bgg', operation):
+        return requests.get(url, headers=headers)
 
 def import_games_from_bgg(username):
     # Import the collection of games from the user's BGG collection - NO EXPANSIONS
@@ -13,12 +18,12 @@ def import_games_from_bgg(username):
     headers = {}
     if bgg_token:
         headers['Authorization'] = f'Bearer {bgg_token}'
-    response = requests.get(url_collection, headers=headers)
+    response = _bgg_request(url_collection, headers, 'collection')
 
     while response.status_code == 202:
         # request queued, retry in 2 seconds
         time.sleep(2)
-        response = requests.get(url_collection, headers=headers)
+        response = _bgg_request(url_collection, headers, 'collection')
 
     if response.status_code != 200:
         print("Error in collection request.")
@@ -28,12 +33,12 @@ def import_games_from_bgg(username):
     # Import the collection of expansions from the user's BGG collection
     url_collection_exp = f'https://boardgamegeek.com/xmlapi2/collection?username={username}&own=1&subtype=boardgameexpansion'
 
-    response = requests.get(url_collection_exp, headers=headers)
+    response = _bgg_request(url_collection_exp, headers, 'collection')
     
     while response.status_code == 202:
         # request queued, retry in 2 seconds
         time.sleep(2)
-        response = requests.get(url_collection_exp, headers=headers)
+        response = _bgg_request(url_collection_exp, headers, 'collection')
     
     if response.status_code != 200:
         print("Error in collection request.")
@@ -63,7 +68,7 @@ def parse_collection(xml, headers, expansions=False):
 
 def request_games(game_ids, headers, expansions):
     url_game = f'https://boardgamegeek.com/xmlapi2/thing?id={game_ids}'
-    response = requests.get(url_game, headers=headers)
+    response = _bgg_request(url_game, headers, 'thing')
     if response.status_code != 200:
         print("Error in game request.")
         return
@@ -0,0 +1,138 @@
+import os
+import re
+import bisect
+
+
+CHUNK_STRATEGIES = ["sentence", "token", "layout"]
+
+# un token è una parola o un segno di punteggiatura, un'approssimazione dei token del modello
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# righe brevi numerate ("3.1 Setup") o tutte maiuscole ("END OF THE GAME") sono considerate titoli
+HEADING_PATTERN = re.compile(r"^(\d+(\.\d+)*\.?\s+[^\W\d_a-z].*|[^\W\d_][^\Wa-z]*(\s+[^\Wa-z]+)*)$", re.UNICODE)
+
+
+def get_chunking_settings(strategy=None, chunk_size=None, chunk_overlap=None):
+    """Restituisce le impostazioni di chunking validate, con i default presi dalle variabili d'ambiente.
+
+    Raises:
+        ValueError: se la strategia o le dimensioni non sono valide
+    """
+    strategy = (strategy or os.getenv("RAG_CHUNK_STRATEGY", "sentence")).lower()
+    chunk_size = int(chunk_size or os.getenv("RAG_CHUNK_SIZE", "1024"))
+    chunk_overlap = int(chunk_overlap if chunk_overlap not in (None, "") else os.getenv("RAG_CHUNK_OVERLAP", "200"))
+
+    if strategy not in CHUNK_STRATEGIES:
+        raise ValueError(f"Unknown chunk strategy: {strategy}. Use one of {', '.join(CHUNK_STRATEGIES)}")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if chunk_overlap < 0 or chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be between 0 and chunk_size")
+
+    return {"strategy": strategy, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+
+def chunk_documents(documents, settings):
+    """Divide le pagine del pdf in chunk secondo la strategia scelta.
+
+    Returns:
+        list: chunk come dict con text, page_label, file_name, doc_index (pagina di inizio) e chunk_index
+    """
+    strategy = settings["strategy"]
+    if strategy == "sentence":
+        chunks = _sentence_chunks(documents, settings)
+    elif strategy == "token":
+        chunks = _token_chunks(documents, settings)
+    else:
+        chunks = _layout_chunks(documents, settings)
+
+    chunks = [chunk for chunk in chunks if chunk["text"].strip()]
+    for chunk_index, chunk in enumerate(chunks):
+        chunk["chunk_index"] = chunk_index
+    print(f"Split {len(documents)} pages into {len(chunks)} chunks with the '{strategy}' strategy")
+    return chunks
+
+
+def _sentence_chunks(documents, settings):
+    # un SentenceSplitter per pagina: i chunk non attraversano i confini delle pagine
+    from llama_index.core.node_parser import SentenceSplitter
+
+    parser = SentenceSplitter(chunk_size=settings["chunk_size"], chunk_overlap=settings["chunk_overlap"])
+    chunks = []
+    for doc_index, doc in enumerate(documents):
+        for node in parser.get_nodes_from_documents([doc]):
+            chunks.append(_chunk(node.text, documents, doc_index))
+    return chunks
+
+def _token_chunks(documents, settings):
+    # finestre fisse di token sull'intero documento, con sovrapposizione
+    text, page_starts = _join_pages(documents)
+    chunks = []
+    for start, end in _token_windows(text, 0, len(text), settings["chunk_size"], settings["chunk_overlap"]):
+        chunks.append(_chunk(text[start:end], documents, _page_at(page_starts, start)))
+    return chunks
+
+def _layout_chunks(documents, settings):
+    # sezioni delimitate dai titoli; le sezioni lunghe vengono divise in finestre, quelle brevi unite alla successiva
+    text, page_starts = _join_pages(documents)
+    boundaries = [0]
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if offset and 3 <= len(stripped) <= 80 and not stripped.endswith(".") and HEADING_PATTERN.match(stripped):
+            boundaries.append(offset)
+        offset += len(line)
+    boundaries.append(len(text))
+
+    sections = []
+    section_start = boundaries[0]
+    for boundary in boundaries[1:]:
+        if _count_tokens(text[section_start:boundary]) >= settings["chunk_size"] // 4 or boundary == len(text):
+            sections.append((section_start, boundary))
+            section_start = boundary
+
+    chunks = []
+    for start, end in sections:
+        for window_start, window_end in _token_windows(text, start, end, settings["chunk_size"], settings["chunk_overlap"]):
+            chunks.append(_chunk(text[window_start:window_end], documents, _page_at(page_starts, window_start)))
+    return chunks
+
+
+def _join_pages(documents):
+    """Unisce le pagine in un unico testo, ricordando l'offset di inizio di ogni pagina."""
+    parts = []
+    page_starts = []
+    offset = 0
+    for doc in documents:
+        page_starts.append(offset)
+        parts.append(doc.text)
+        offset += len(doc.text) + 2
+    return "\n\n".join(parts), page_starts
+
+def _page_at(page_starts, offset):
+    return max(0, bisect.bisect_right(page_starts, offset) - 1)
+
+def _token_windows(text, start, end, chunk_size, chunk_overlap):
+    """Restituisce gli intervalli (inizio, fine) di finestre di chunk_size token tra start ed end."""
+    spans = [(m.start() + start, m.end() + start) for m in TOKEN_PATTERN.finditer(text[start:end])]
+    if not spans:
+        return []
+    windows = []
+    step = chunk_size - chunk_overlap
+    for first in range(0, len(spans), step):
+        last = min(first + chunk_size, len(spans)) - 1
+        windows.append((spans[first][0], spans[last][1]))
+        if last == len(spans) - 1:
+            break
+    return windows
+
+def _count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+def _chunk(text, documents, doc_index):
+    doc = documents[doc_index]
+    return {
+        "text": text,
+        "page_label": doc.metadata.get("page_label", "unknown"),
+        "file_name": doc.metadata.get("file_name", "unknown"),
+        "doc_index": doc_index
+    }
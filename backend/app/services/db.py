@@ -1,21 +1,318 @@
-from pymongo import MongoClient
-from dotenv import load_dotenv
 import os
+import functools
+import threading
+import time
+import warnings
+
+from pymongo import MongoClient
+from pymongo import monitoring
+from pymongo import read_preferences
+
+# The MongoClient is created lazily, once per process: a client must not be shared
+# across fork(), so gunicorn workers forked from a preloaded master open their own
+# connection pools on first use instead of inheriting the master's.
+# The settings are read when the client is created, after create_app() has loaded the .env.
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in [None, ''] else default
+
+
+def client_options():
+    """Build the MongoClient keyword arguments from the environment."""
+    options = {
+        'maxPoolSize': _env_int('MONGO_MAX_POOL_SIZE', 50),
+        'minPoolSize': _env_int('MONGO_MIN_POOL_SIZE', 0),
+        'maxIdleTimeMS': _env_int('MONGO_MAX_IDLE_TIME_MS', 300000),
+        'maxConnecting': _env_int('MONGO_MAX_CONNECTING', 2),
+        'waitQueueTimeoutMS': _env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000),
+        'serverSelectionTimeoutMS': _env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'connectTimeoutMS': _env_int('MONGO_CONNECT_TIMEOUT_MS', 5000),
+        'socketTimeoutMS': _env_int('MONGO_SOCKET_TIMEOUT_MS', 30000),
+        'retryWrites': True,
+        'retryReads': True,
+    }
+    # zstd needs the zstandard package and snappy python-snappy, zlib is always available.
+    # The server picks the first compressor of the list it supports.
+    compressors = os.getenv('MONGO_COMPRESSORS', 'zstd,zlib').strip()
+    if compressors:
+        options['compressors'] = compressors
+        if 'zlib' in compressors:
+            options['zlibCompressionLevel'] = _env_int('MONGO_ZLIB_COMPRESSION_LEVEL', 1)
+    return options
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters of the current process, registered on the client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.checkout_wait_seconds = 0.0
+            self.max_checkout_wait_seconds = 0.0
+            self.pools_cleared = 0
+            self._waiting = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections_open': self.created - self.closed,
+                'connections_created': self.created,
+                'connections_closed': self.closed,
+                'connections_in_use': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'checkout_wait_seconds': round(self.checkout_wait_seconds, 6),
+                'max_checkout_wait_seconds': round(self.max_checkout_wait_seconds, 6),
+                'pools_cleared': self.pools_cleared,
+            }
+
+    def _waited(self):
+        # Checkout events are published on the requesting thread
+        started = self._waiting.pop(threading.get_ident(), None)
+        if started is None:
+            return
+        waited = time.perf_counter() - started
+        self.checkout_wait_seconds += waited
+        self.max_checkout_wait_seconds = max(self.max_checkout_wait_seconds, waited)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._waiting[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+            self._waited()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self._waited()
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+
+pool_metrics = PoolMetrics()
+
+# Client roles: 'primary' serves the writes and the reads that must see them (auth, match
+# logging), 'analytics' the statistic and list reads, which tolerate bounded staleness
+PRIMARY = 'primary'
+ANALYTICS = 'analytics'
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+# Set by configure_client() to replace the client built from the environment
+_client_factory = None
+# Extra event listeners added to the client, see add_event_listener()
+_event_listeners = []
+
+_READ_PREFERENCES = {
+    'primary': read_preferences.Primary,
+    'primarypreferred': read_preferences.PrimaryPreferred,
+    'secondary': read_preferences.Secondary,
+    'secondarypreferred': read_preferences.SecondaryPreferred,
+    'nearest': read_preferences.Nearest,
+}
 
-load_dotenv()
 
-# MongoDB connection
-MONGO_URI = os.getenv('MONGO_URI')
-DB_NAME = os.getenv('DB_NAME')
+def _create_client(role):
+    if _client_factory is not None:
+        return _client_factory()
+    uri = os.getenv('MONGO_URI')
+    if role == ANALYTICS:
+        uri = os.getenv('MONGO_ANALYTICS_URI')
+    return MongoClient(uri, event_listeners=[pool_metrics] + _event_listeners, **client_options())
 
-# Connectron to MongoDB
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+def get_client(role=PRIMARY):
+    """Return the MongoClient of the current process for a role, creating it on first use."""
+    global _clients, _clients_pid, _clients_lock
+    if role == ANALYTICS and (_client_factory is not None or not os.getenv('MONGO_ANALYTICS_URI')):
+        # Same deployment as the primary role: share its pool, the read preference is set per collection
+        role = PRIMARY
+
+    client = _clients.get(role)
+    if client is not None and _clients_pid == os.getpid():
+        return client
+
+    if _clients_pid is not None and _clients_pid != os.getpid():
+        # Forked child: the inherited lock may have been held at fork time and the
+        # inherited clients must not be used (or closed) here
+        _clients_lock = threading.Lock()
+        _clients = {}
+        _clients_pid = None
+        pool_metrics.reset()
+
+    with _clients_lock:
+        if role not in _clients:
+            _clients[role] = _create_client(role)
+            _clients_pid = os.getpid()
+        return _clients[role]
+
+def get_db(role=PRIMARY):
+    return get_client(role)[os.getenv('DB_NAME')]
+
+@functools.lru_cache(maxsize=None)
+def analytics_read_preference():
+    """Read preference of the analytics collections, from the environment.
+
+    MONGO_ANALYTICS_READ_PREFERENCE is a read preference mode, MONGO_MAX_STALENESS_SECONDS
+    bounds how far behind the primary a secondary may be to be selected (at least 90, -1 for
+    no bound) and MONGO_ANALYTICS_TAGS (e.g. 'nodeType:ANALYTICS') prefers tagged members.
+    """
+    mode = os.getenv('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred').strip().lower()
+    if mode not in _READ_PREFERENCES:
+        raise ValueError(f"Invalid MONGO_ANALYTICS_READ_PREFERENCE: {mode}")
+    if mode == 'primary':
+        return read_preferences.Primary()
+
+    max_staleness = _env_int('MONGO_MAX_STALENESS_SECONDS', -1)
+    if 0 <= max_staleness < 90:
+        # The servers reject a smaller bound
+        warnings.warn(f"MONGO_MAX_STALENESS_SECONDS={max_staleness} is below the minimum of 90 seconds, using 90")
+        max_staleness = 90
+
+    tag_sets = None
+    tags = os.getenv('MONGO_ANALYTICS_TAGS', '').strip()
+    if tags:
+        tag_set = dict(tag.split(':', 1) for tag in tags.split(','))
+        # Fall back to any eligible member when no tagged one is available
+        tag_sets = [tag_set, {}]
+
+    return _READ_PREFERENCES[mode](tag_sets=tag_sets, max_staleness=max_staleness)
+
+def configure_client(factory=None):
+    """Replace the client the collections are bound to, e.g. with mongomock in the benchmarks.
+
+    Args:
+        factory: Callable returning the client to use, None to go back to MONGO_URI
+    """
+    global _client_factory
+    close_client()
+    _client_factory = factory
+    analytics_read_preference.cache_clear()
+
+def add_event_listener(listener):
+    """Register a PyMongo event listener, applied to the clients created afterwards."""
+    if listener not in _event_listeners:
+        _event_listeners.append(listener)
+
+def close_client():
+    global _clients, _clients_pid
+    with _clients_lock:
+        if _clients_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients = {}
+        _clients_pid = None
+
+def get_pool_metrics():
+    metrics = pool_metrics.snapshot()
+    metrics['pid'] = os.getpid()
+    metrics['max_pool_size'] = client_options()['maxPoolSize']
+    return metrics
+
+
+class LazyCollection:
+    """Module-level collection handle resolved against the client of the current process.
+
+    Keeps `from .db import players_collection` working without creating the client at import.
+    """
+
+    def __init__(self, name, role=PRIMARY):
+        self._name = name
+        self._role = role
+
+    def _collection(self):
+        collection = get_db(self._role)[self._name]
+        if self._role == ANALYTICS:
+            collection = collection.with_options(read_preference=analytics_read_preference())
+        return collection
+
+    def __getattr__(self, attr):
+        return getattr(self._collection(), attr)
+
+    def __getitem__(self, name):
+        return self._collection()[name]
+
+    def __repr__(self):
+        return f"LazyCollection({self._name!r}, {self._role!r})"
+
+
+class LazyDatabase:
+    def __getattr__(self, attr):
+        return getattr(get_db(), attr)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+db = LazyDatabase()
 
 # Collections
-games_collection = db["games"]
-matches_collection = db["matches"]
-players_collection = db["players"]
-wishlists_collection = db["wishlists"]
-achievements_collection = db["achievements"]
-rulebooks_collection = db["rulebooks"]
\ No newline at end of file
+games_collection = LazyCollection("games")
+matches_collection = LazyCollection("matches")
+players_collection = LazyCollection("players")
+wishlists_collection = LazyCollection("wishlists")
+achievements_collection = LazyCollection("achievements")
+rulebooks_collection = LazyCollection("rulebooks")
+keyword_indexes_collection = LazyCollection("keyword_indexes")
+rag_index_versions_collection = LazyCollection("rag_index_versions")
+
+# Read-only views for the statistic and list endpoints, routed by analytics_read_preference()
+# to secondaries or a dedicated analytics node. Never use them for a read that must see a
+# write made in the same request.
+games_analytics_collection = LazyCollection("games", ANALYTICS)
+matches_analytics_collection = LazyCollection("matches", ANALYTICS)
+players_analytics_collection = LazyCollection("players", ANALYTICS)
+wishlists_analytics_collection = LazyCollection("wishlists", ANALYTICS)
+achievements_analytics_collection = LazyCollection("achievements", ANALYTICS)
+rulebooks_analytics_collection = LazyCollection("rulebooks", ANALYTICS)
+
+# Async client for the ASGI mode, created on first use inside the event loop
+async_client = None
+
+def get_async_db():
+    global async_client
+    if async_client is None:
+        from pymongo import AsyncMongoClient
+        # The command listeners count the queries of the async routes in their request metrics too
+        async_client = AsyncMongoClient(os.getenv('MONGO_URI'), event_listeners=list(_event_listeners), **client_options())
+    return async_client[os.getenv('DB_NAME')]
@@ -0,0 +1,154 @@
+"""Shared embedding server.
+
+Loads the local embedding model once and serves embedding requests to the
+backend workers over a local socket, so the model weights are not loaded
+again in every gunicorn worker. Concurrent requests are grouped into
+micro-batches before going through the model.
+
+Run it next to the backend with:
+
+    python -m app.services.embedding_server
+
+and set EMBEDDING_TYPE=remote on the workers. Messages are pickled, so both sides
+must share a non-empty EMBEDDING_SERVER_AUTHKEY, and TCP addresses are only accepted
+on the loopback interface.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener
+
+from dotenv import load_dotenv
+
+
+# Any client that authenticates can make the server unpickle its messages
+LOOPBACK_HOSTS = ("localhost", "127.0.0.1")
+
+
+def parse_address(address):
+    """Return a unix socket path, or a (host, port) tuple for 'host:port' loopback addresses."""
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError(f"EMBEDDING_SERVER_ADDRESS must be a unix socket path or a localhost address, got {address}")
+        return (host, int(port))
+    return address
+
+def get_authkey():
+    """Return the shared secret of the embedding server, which must be set."""
+    authkey = os.getenv("EMBEDDING_SERVER_AUTHKEY", "")
+    if not authkey:
+        raise ValueError("EMBEDDING_SERVER_AUTHKEY must be set to use the shared embedding server")
+    return authkey.encode()
+
+
+class EmbeddingBatcher:
+    def __init__(self, provider, max_batch_size=64, max_wait=0.005):
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """Queue texts for embedding, the returned future resolves to their vectors."""
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            # Collect the requests that arrive within max_wait, up to max_batch_size texts
+            while size < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=self.max_wait)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                embeddings = self.provider.embed_batch(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for item_texts, future in batch:
+                future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+def handle_connection(conn, batcher, dimension):
+    try:
+        while True:
+            try:
+                command, payload = conn.recv()
+            except EOFError:
+                break
+            try:
+                if command == "embed":
+                    conn.send(("ok", batcher.submit(payload).result()))
+                elif command == "dimension":
+                    conn.send(("ok", dimension))
+                else:
+                    conn.send(("error", f"Unknown command: {command}"))
+            except Exception as e:
+                conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def serve(address, authkey, provider, max_batch_size=64, max_wait=0.005):
+    if not authkey:
+        raise ValueError("The embedding server needs a non-empty authkey")
+    address = parse_address(address)
+
+    batcher = EmbeddingBatcher(provider, max_batch_size=max_batch_size, max_wait=max_wait)
+    dimension = provider.get_dimension()
+
+    if isinstance(address, str) and os.path.exists(address):
+        # Remove the socket left behind by a previous run
+        os.remove(address)
+
+    if isinstance(address, str):
+        # Create the socket accessible to its owner only, so that no other local user can
+        # connect in the meantime: only the user running the server and the workers can
+        previous_umask = os.umask(0o077)
+    try:
+        listener = Listener(address, authkey=authkey)
+    finally:
+        if isinstance(address, str):
+            os.umask(previous_umask)
+
+    with listener:
+        print(f"Embedding server listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Error accepting embedding client: {str(e)}")
+                continue
+            threading.Thread(target=handle_connection, args=(conn, batcher, dimension), daemon=True).start()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    authkey = get_authkey()
+
+    from .rag import LocalEmbeddingProvider
+
+    provider = LocalEmbeddingProvider(model_name=os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5"))
+    serve(
+        os.getenv("EMBEDDING_SERVER_ADDRESS", "/tmp/meeplestats-embeddings.sock"),
+        authkey,
+        provider,
+        max_batch_size=int(os.getenv("EMBEDDING_SERVER_BATCH_SIZE", "64")),
+        max_wait=float(os.getenv("EMBEDDING_SERVER_BATCH_WAIT_MS", "5")) / 1000
+    )
@@ -0,0 +1,115 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import get_storage
+
+
+# Longest side in pixels of the thumbnail shown in list views and of the full size WebP variant
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "400"))
+IMAGE_DISPLAY_SIZE = int(os.getenv("IMAGE_DISPLAY_SIZE", "1600"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+
+# Derivatives are generated in the background so that logging a match does not wait for them
+image_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMAGE_PROCESSING_WORKERS", "2")), thread_name_prefix="image-processing")
+
+
+def derivative_name(filename, variant):
+    """Return the name a derivative is stored under, next to the original.
+
+    'abc_photo.jpg' becomes 'abc_photo_thumb.webp' for the 'thumb' variant.
+    """
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}_{variant}.webp"
+
+def create_derivatives(data):
+    """Create the resized WebP variants of an image.
+
+    Args:
+        data: The bytes of the original image
+
+    Returns:
+        A dict mapping the variant name ('thumb', 'display') to the encoded WebP bytes
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        # Phone photos are often stored sideways with an EXIF orientation tag
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        derivatives = {}
+        for variant, size in (("thumb", IMAGE_THUMBNAIL_SIZE), ("display", IMAGE_DISPLAY_SIZE)):
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, format="WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+            derivatives[variant] = output.getvalue()
+        return derivatives
+
+def process_match_image(match_id, image):
+    """Generate the derivatives of a match image and record them on the match document.
+
+    Args:
+        match_id: The ObjectId of the match
+        image: The 'image' field of the match, with its storage 'type' and 'filename'
+    """
+    from .db import matches_collection
+
+    try:
+        storage = get_storage(image['type'])
+        original = storage.open(image['filename'])
+        if original is None:
+            print(f"Original image {image['filename']} not found, skipping derivatives")
+            return
+        try:
+            data = original.read()
+        finally:
+            original.close()
+
+        variants = {}
+        for variant, derivative in create_derivatives(data).items():
+            name = derivative_name(os.path.basename(image['filename']), variant)
+            variants[variant] = storage.save(io.BytesIO(derivative), name, content_type="image/webp")
+
+        matches_collection.update_one(
+            {'_id': match_id},
+            {'$set': {
+                'image.thumbnail': variants['thumb'],
+                'image.thumbnail_url': storage.url(variants['thumb']),
+                'image.webp': variants['display'],
+                'image.webp_url': storage.url(variants['display'])
+            }}
+        )
+        print(f"Created image derivatives for match {match_id}")
+    except Exception as e:
+        # The original is still served when the derivatives are missing
+        print(f"Error creating image derivatives for match {match_id}: {str(e)}")
+
+def schedule_match_image_processing(match_id, image):
+    return image_executor.submit(process_match_image, match_id, dict(image))
+
+def backfill_match_images(limit=None):
+    """Schedule the derivatives of the match images that have none yet.
+
+    Args:
+        limit: Maximum number of matches to schedule, all of them by default
+
+    Returns:
+        The number of matches scheduled
+    """
+    from .db import matches_collection
+
+    cursor = matches_collection.find(
+        {'image.filename': {'$exists': True}, 'image.thumbnail': {'$exists': False}},
+        {'image': 1}
+    )
+    if limit:
+        cursor = cursor.limit(limit)
+
+    scheduled = 0
+    for match in cursor:
+        schedule_match_image_processing(match['_id'], match['image'])
+        scheduled += 1
+    return scheduled
@@ -0,0 +1,162 @@
+import os
+import re
+import math
+import time
+import heapq
+import threading
+from collections import Counter
+
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# secondi dopo i quali un indice in memoria viene riconfrontato con quello salvato su MongoDB
+KEYWORD_INDEX_REFRESH = float(os.getenv("KEYWORD_INDEX_REFRESH", "60"))
+
+
+def tokenize(text):
+    """Divide il testo in token minuscoli (parole e numeri), riducendo i plurali inglesi in -s."""
+    return [_normalize_token(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+def _normalize_token(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+# Indice invertito BM25 dei chunk di un rulebook
+class KeywordIndex:
+    def __init__(self, docs, postings, doc_lengths, version=None, k1=1.5, b=0.75):
+        # docs: lista di {"id", "text", "page_label", "file_name"}
+        # postings: termine -> lista di [indice del doc, frequenza del termine]
+        self.docs = docs
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+        self.version = version
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, records):
+        """Costruisce l'indice a partire dai record preparati per Pinecone."""
+        docs = []
+        postings = {}
+        doc_lengths = []
+        for doc_idx, record in enumerate(records):
+            metadata = record["metadata"]
+            tokens = tokenize(metadata["text"])
+            docs.append({
+                "id": record["id"],
+                "text": metadata["text"],
+                "page_label": metadata.get("page_label", "unknown"),
+                "file_name": metadata.get("file_name", "unknown")
+            })
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append([doc_idx, tf])
+        return cls(docs, postings, doc_lengths, version=str(time.time()))
+
+    def search(self, query, top_k=3):
+        """Restituisce i top_k chunk per punteggio BM25, nello stesso formato dei match di Pinecone."""
+        if not self.docs:
+            return []
+        n_docs = len(self.docs)
+        scores = {}
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (n_docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc_idx, tf in term_postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / self.avg_doc_length)
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        matches = []
+        for doc_idx, score in best:
+            doc = self.docs[doc_idx]
+            matches.append({
+                "id": doc["id"],
+                "score": score,
+                "metadata": {
+                    "text": doc["text"],
+                    "page_label": doc["page_label"],
+                    "file_name": doc["file_name"]
+                }
+            })
+        return matches
+
+    def to_document(self, namespace):
+        return {
+            "_id": namespace,
+            "version": self.version,
+            "docs": self.docs,
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths
+        }
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(document["docs"], document["postings"], document["doc_lengths"], version=document.get("version"))
+
+
+# indici caricati in memoria: namespace -> (indice, istante dell'ultimo controllo)
+_loaded_indexes = {}
+_loaded_lock = threading.Lock()
+
+
+def save_keyword_index(namespace, keyword_index):
+    """Salva l'indice su MongoDB (un documento per namespace) e lo tiene in memoria."""
+    from .db import keyword_indexes_collection
+
+    keyword_indexes_collection.replace_one({"_id": namespace}, keyword_index.to_document(namespace), upsert=True)
+    with _loaded_lock:
+        _loaded_indexes[namespace] = (keyword_index, time.time())
+    print(f"Saved keyword index for namespace {namespace} ({len(keyword_index.postings)} terms)")
+
+def load_keyword_index(namespace):
+    """Restituisce l'indice del namespace, dalla memoria se ancora valido, altrimenti da MongoDB."""
+    from .db import keyword_indexes_collection
+
+    with _loaded_lock:
+        cached = _loaded_indexes.get(namespace)
+    now = time.time()
+    if cached is not None and now - cached[1] < KEYWORD_INDEX_REFRESH:
+        return cached[0]
+
+    if cached is not None:
+        # controllo solo la versione, per accorgermi di re-indicizzazioni fatte da altri worker
+        stored = keyword_indexes_collection.find_one({"_id": namespace}, {"version": 1})
+        if stored is not None and stored.get("version") == cached[0].version:
+            with _loaded_lock:
+                _loaded_indexes[namespace] = (cached[0], now)
+            return cached[0]
+
+    document = keyword_indexes_collection.find_one({"_id": namespace})
+    if document is None:
+        with _loaded_lock:
+            _loaded_indexes.pop(namespace, None)
+        return None
+    keyword_index = KeywordIndex.from_document(document)
+    with _loaded_lock:
+        _loaded_indexes[namespace] = (keyword_index, now)
+    return keyword_index
+
+def delete_keyword_index(namespace):
+    from .db import keyword_indexes_collection
+
+    keyword_indexes_collection.delete_one({"_id": namespace})
+    with _loaded_lock:
+        _loaded_indexes.pop(namespace, None)
+
+def keyword_search(query, target_namespaces, top_k=3):
+    """Ricerca solo per parole chiave su uno o più namespace, senza chiamate a Pinecone."""
+    all_matches = []
+    for namespace in target_namespaces:
+        keyword_index = load_keyword_index(namespace)
+        if keyword_index is None:
+            continue
+        for match in keyword_index.search(query, top_k=top_k):
+            match["namespace"] = namespace
+            all_matches.append(match)
+    return heapq.nlargest(top_k, all_matches, key=lambda x: x["score"])
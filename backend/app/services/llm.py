@@ -0,0 +1,185 @@
+import os
+import time
+import asyncio
+import threading
+
+import httpx
+
+from .metrics import observe_external
+
+
+# Client LLM condiviso: un solo client OpenRouter per processo con connessioni HTTP riutilizzate
+class LLMClientManager:
+    def __init__(self, model, api_key, max_tokens=4096, context_window=32768, timeout=60.0,
+                 max_retries=2, max_concurrency=8, max_connections=20):
+        from llama_index.llms.openrouter import OpenRouter
+
+        # configuro la chiave api fake di openai per evitare errori tra openAI sdk e openrouter, una volta sola
+        os.environ.setdefault("OPENAI_API_KEY", "dummy_value")
+
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.http_client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        # usato dalle chiamate async (achat, astream_chat) della modalità ASGI
+        self.async_http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.llm = OpenRouter(
+            api_key=api_key,
+            max_tokens=max_tokens,
+            context_window=context_window,
+            model=model,
+            timeout=timeout,
+            max_retries=max_retries,
+            http_client=self.http_client,
+            async_http_client=self.async_http_client
+        )
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphore = asyncio.Semaphore(max_concurrency)
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "calls": 0,
+            "errors": 0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+            "total_time_to_first_token": 0.0,
+            "streamed_calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+        print(f"Initialized LLM client for model: {model}")
+
+    def chat(self, messages):
+        """Esegue una chiamata chat bloccante, rispettando il limite di concorrenza."""
+        with self._semaphore:
+            start = time.perf_counter()
+            try:
+                resp = self.llm.chat(messages)
+            except Exception:
+                self._record(time.perf_counter() - start, error=True)
+                raise
+            prompt_tokens, completion_tokens = _token_usage(getattr(resp, "raw", None))
+            self._record(time.perf_counter() - start, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            return resp
+
+    def stream_chat(self, messages):
+        """Esegue una chiamata chat in streaming, restituendo i chunk man mano che arrivano."""
+        with self._semaphore:
+            start = time.perf_counter()
+            first_token_at = None
+            last_chunk = None
+            try:
+                for chunk in self.llm.stream_chat(messages):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    last_chunk = chunk
+                    yield chunk
+            except Exception:
+                self._record(time.perf_counter() - start, error=True)
+                raise
+            prompt_tokens, completion_tokens = _token_usage(getattr(last_chunk, "raw", None))
+            self._record(
+                time.perf_counter() - start,
+                time_to_first_token=(first_token_at - start) if first_token_at is not None else None,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens
+            )
+
+    async def achat(self, messages):
+        """Versione async di chat: attende la risposta senza occupare un thread."""
+        async with self._async_semaphore:
+            start = time.perf_counter()
+            try:
+                resp = await self.llm.achat(messages)
+            except Exception:
+                self._record(time.perf_counter() - start, error=True)
+                raise
+            prompt_tokens, completion_tokens = _token_usage(getattr(resp, "raw", None))
+            self._record(time.perf_counter() - start, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            return resp
+
+    async def astream_chat(self, messages):
+        """Versione async di stream_chat."""
+        async with self._async_semaphore:
+            start = time.perf_counter()
+            first_token_at = None
+            last_chunk = None
+            try:
+                async for chunk in await self.llm.astream_chat(messages):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    last_chunk = chunk
+                    yield chunk
+            except Exception:
+                self._record(time.perf_counter() - start, error=True)
+                raise
+            prompt_tokens, completion_tokens = _token_usage(getattr(last_chunk, "raw", None))
+            self._record(
+                time.perf_counter() - start,
+                time_to_first_token=(first_token_at - start) if first_token_at is not None else None,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens
+            )
+
+    def get_metrics(self):
+        """Restituisce le metriche aggregate delle chiamate all'LLM."""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        calls = metrics["calls"]
+        metrics["avg_latency"] = metrics["total_latency"] / calls if calls else 0.0
+        streamed = metrics["streamed_calls"]
+        metrics["avg_time_to_first_token"] = metrics["total_time_to_first_token"] / streamed if streamed else 0.0
+        return metrics
+
+    def close(self):
+        self.http_client.close()
+
+    async def aclose(self):
+        await self.async_http_client.aclose()
+
+    def _record(self, latency, error=False, time_to_first_token=None, prompt_tokens=0, completion_tokens=0):
+        with self._metrics_lock:
+            self._metrics["calls"] += 1
+            self._metrics["total_latency"] += latency
+            self._metrics["max_latency"] = max(self._metrics["max_latency"], latency)
+            if error:
+                self._metrics["errors"] += 1
+            if time_to_first_token is not None:
+                self._metrics["streamed_calls"] += 1
+                self._metrics["total_time_to_first_token"] += time_to_first_token
+            self._metrics["prompt_tokens"] += prompt_tokens
+            self._metrics["completion_tokens"] += completion_tokens
+        # anche nelle metriche Prometheus di /metrics
+        observe_external("llm", "stream_chat" if time_to_first_token is not None else "chat", latency, error=error)
+        print(f"LLM call took {latency:.2f}s (prompt tokens: {prompt_tokens}, completion tokens: {completion_tokens})")
+
+
+def _token_usage(raw):
+    """Estrae i token di prompt e di completamento dalla risposta grezza, se presenti."""
+    if raw is None:
+        return 0, 0
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if not usage:
+        return 0, 0
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+def initialize_llm():
+    """Inizializza il client LLM condiviso a partire dalle variabili d'ambiente."""
+    return LLMClientManager(
+        model=os.getenv("LLM_MODEL"),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_tokens=int(os.getenv("LLM_MAX_TOKENS", "4096")),
+        context_window=int(os.getenv("LLM_CONTEXT_WINDOW", "32768")),
+        timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+    )
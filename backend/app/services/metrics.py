@@ -0,0 +1,336 @@
+"""Request-level performance metrics, exposed in the Prometheus text format at /metrics.
+
+Flask before/after request hooks (ASGIMetricsMiddleware for the async routes) time every
+request, and a PyMongo CommandListener counts the database round trips each request makes. External calls (BGG, Pinecone,
+the LLM) are timed with track_external().
+
+The metrics are kept in memory by each process: with several gunicorn workers every
+scrape reports the worker that served it, whose pid is included.
+"""
+import os
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+from pymongo import monitoring
+
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() in ['true', '1', 't']
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            # Counts are per bucket here and made cumulative on export
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: {'counts': list(data['counts']), 'sum': data['sum']} for labels, data in self._series.items()}
+        for label_values, data in sorted(series.items()):
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data['counts']):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, 'le': _format_bound(bound)}, cumulative
+            yield f"{self.name}_sum", labels, data['sum']
+            yield f"{self.name}_count", labels, cumulative
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+
+class Counter:
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}_total", dict(zip(self.labels, label_values)), value
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+request_latency = Histogram(
+    'meeplestats_request_duration_seconds', 'Time spent serving a request',
+    ('method', 'endpoint', 'status'), LATENCY_BUCKETS)
+request_db_commands = Histogram(
+    'meeplestats_request_db_commands', 'MongoDB commands (round trips) issued by a request',
+    ('endpoint',), COUNT_BUCKETS)
+request_db_time = Histogram(
+    'meeplestats_request_db_seconds', 'Time a request spent waiting on MongoDB',
+    ('endpoint',), LATENCY_BUCKETS)
+response_bytes = Histogram(
+    'meeplestats_response_bytes', 'Size of the serialized response body, streamed responses excluded',
+    ('endpoint',), BYTES_BUCKETS)
+db_commands = Counter(
+    'meeplestats_db_commands', 'MongoDB commands by name, all requests and background work included',
+    ('command', 'outcome'))
+external_latency = Histogram(
+    'meeplestats_external_call_duration_seconds', 'Duration of calls to external services',
+    ('service', 'operation'), LATENCY_BUCKETS)
+external_errors = Counter(
+    'meeplestats_external_call_errors', 'Failed calls to external services',
+    ('service', 'operation'))
+
+METRICS = [request_latency, request_db_commands, request_db_time, response_bytes, db_commands, external_latency, external_errors]
+
+class RequestStats:
+    """Counters of the request being served.
+
+    The threads a request fans out to (parallel Pinecone queries) run in a copy of its
+    context and update the same counters, so the updates are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self.external_seconds = 0.0
+
+    def add(self, field, amount):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+
+# Counters of the request being served, set by the before_request hook. Commands run by
+# background threads (image processing, warm-ups) have no request and are only counted globally.
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+# Set inside external_span(), whose wall-clock time is counted instead of the calls it contains
+_in_external_span = contextvars.ContextVar('in_external_span', default=False)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Counts the MongoDB commands and the time spent on them, per request and by command name."""
+
+    def started(self, event):
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add('db_commands', 1)
+
+    def succeeded(self, event):
+        self._finished(event, 'success')
+
+    def failed(self, event):
+        self._finished(event, 'failure')
+
+    def _finished(self, event, outcome):
+        db_commands.inc(event.command_name, outcome)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add('db_seconds', event.duration_micros / 1e6)
+
+
+command_metrics = CommandMetrics()
+
+
+@contextlib.contextmanager
+def track_external(service, operation):
+    """Time a call to an external service.
+
+        with track_external('bgg', 'search'):
+            resp = requests.get(...)
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        observe_external(service, operation, time.perf_counter() - start, error=error)
+
+def observe_external(service, operation, seconds, error=False):
+    """Record an external call timed by the caller, e.g. the LLM client."""
+    if not METRICS_ENABLED:
+        return
+    external_latency.observe(seconds, service, operation)
+    if error:
+        external_errors.inc(service, operation)
+    stats = _request_stats.get()
+    if stats is not None and not _in_external_span.get():
+        stats.add('external_seconds', seconds)
+
+@contextlib.contextmanager
+def external_span():
+    """Count the wall-clock time of a block of parallel external calls once in the request's time.
+
+    The calls made inside the block, e.g. one Pinecone query per namespace, still feed the
+    latency histograms, but summing them would overstate the time the request waited.
+    """
+    stats = _request_stats.get()
+    token = _in_external_span.set(True)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _in_external_span.reset(token)
+        if METRICS_ENABLED and stats is not None:
+            stats.add('external_seconds', time.perf_counter() - start)
+
+
+def _endpoint():
+    from flask import request
+    # The route pattern, not the path, to keep the number of series bounded
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _before_request():
+    from flask import g
+    g.metrics_start = time.perf_counter()
+    g.metrics_token = _request_stats.set(RequestStats())
+
+def _after_request(response):
+    from flask import g, request
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+
+    endpoint = _endpoint()
+    stats = _request_stats.get()
+    request_latency.observe(time.perf_counter() - start, request.method, endpoint, str(response.status_code))
+    if stats is not None:
+        request_db_commands.observe(stats.db_commands, endpoint)
+        request_db_time.observe(stats.db_seconds, endpoint)
+        response.headers['Server-Timing'] = (
+            f"db;dur={stats.db_seconds * 1000:.1f};desc=\"{stats.db_commands} commands\", "
+            f"ext;dur={stats.external_seconds * 1000:.1f}"
+        )
+    if not response.is_streamed and response.content_length is not None:
+        response_bytes.observe(response.content_length, endpoint)
+    return response
+
+def _teardown_request(exc):
+    from flask import g
+    # Also run when a view raised and the after_request hooks were skipped,
+    # so the counters of this request never leak into the next one of the thread
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        _request_stats.reset(token)
+
+class ASGIMetricsMiddleware:
+    """ASGI counterpart of the Flask request hooks, for the routes served by the async app.
+
+    The path is used as the endpoint label, the async app only serves fixed paths.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = [500]
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                # Streamed responses send their headers before the body, the timings cover the work done until then
+                message = {**message, 'headers': list(message.get('headers', [])) + [(b'server-timing', (
+                    f"db;dur={stats.db_seconds * 1000:.1f};desc=\"{stats.db_commands} commands\", "
+                    f"ext;dur={stats.external_seconds * 1000:.1f}"
+                ).encode('latin-1'))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            endpoint = scope['path']
+            request_latency.observe(time.perf_counter() - start, scope['method'], endpoint, str(status[0]))
+            request_db_commands.observe(stats.db_commands, endpoint)
+            request_db_time.observe(stats.db_seconds, endpoint)
+            _request_stats.reset(token)
+
+def init_metrics(app):
+    """Register the request hooks on the app and the command listener on the MongoDB clients."""
+    if not METRICS_ENABLED:
+        return
+    from .db import add_event_listener
+    add_event_listener(command_metrics)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels.keys(), escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus(extra_gauges=None, extra_counters=None):
+    """Render all metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Args:
+        extra_gauges: Optional {name: (description, value)} of gauges sampled at scrape time
+        extra_counters: Optional {name: (description, value)} of monotonic totals sampled at scrape time,
+            exported with the _total suffix
+    """
+    lines = []
+    for metric in METRICS:
+        kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+        name = metric.name if kind == 'histogram' else f"{metric.name}_total"
+        lines.append(f"# HELP {name} {metric.description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in metric.samples():
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+    gauges = {'meeplestats_process_pid': ('Process id of the worker that served the scrape', os.getpid())}
+    gauges.update(extra_gauges or {})
+    for name, (description, value) in gauges.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(value)}")
+    for name, (description, value) in (extra_counters or {}).items():
+        lines.append(f"# HELP {name}_total {description}")
+        lines.append(f"# TYPE {name}_total counter")
+        lines.append(f"{name}_total {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+def reset_metrics():
+    for metric in METRICS:
+        metric.reset()
@@ -0,0 +1,179 @@
+"""Slow-query profiler for the aggregation pipelines of the statistic endpoints.
+
+Off by default. When QUERY_PROFILING_ENABLED is set, every pipeline run through
+profiled_aggregate() is timed, and the ones slower than SLOW_QUERY_THRESHOLD_MS are
+explained with the 'executionStats' verbosity in the background. The plan summary
+(documents and keys examined, plan stages, per-stage timings) is kept in the capped
+'slow_queries' collection, listed by GET /slow-queries.
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import CollectionInvalid
+
+
+QUERY_PROFILING_ENABLED = os.getenv('QUERY_PROFILING_ENABLED', 'False').lower() in ['true', '1', 't']
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200'))
+# Explaining runs the pipeline again: each endpoint is explained at most once per interval
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))
+SLOW_QUERY_COLLECTION_SIZE_MB = int(os.getenv('SLOW_QUERY_COLLECTION_SIZE_MB', '16'))
+SLOW_QUERY_COLLECTION = 'slow_queries'
+# Raw explain output kept with each entry, truncated to this many characters
+SLOW_QUERY_MAX_EXPLAIN_CHARS = 100000
+
+explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-profiler")
+
+_last_explained = {}
+_last_explained_lock = threading.Lock()
+_collection_ready = False
+
+
+def profiled_aggregate(collection, pipeline, name=None):
+    """Run an aggregation pipeline and return its results as a list, profiling it when enabled.
+
+    Args:
+        collection: The collection to aggregate on
+        pipeline: The aggregation pipeline
+        name: Label of the query, the Flask endpoint by default
+    """
+    if not QUERY_PROFILING_ENABLED:
+        return list(collection.aggregate(pipeline))
+
+    start = time.perf_counter()
+    result = list(collection.aggregate(pipeline))
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    if duration_ms >= SLOW_QUERY_THRESHOLD_MS:
+        name = name or _endpoint_name()
+        key = (name, collection.name)
+        now = time.monotonic()
+        with _last_explained_lock:
+            if now - _last_explained.get(key, float('-inf')) < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return result
+            _last_explained[key] = now
+        explain_executor.submit(record_slow_query, collection, pipeline, name, duration_ms, len(result))
+    return result
+
+def _endpoint_name():
+    from flask import has_request_context, request
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    return 'unknown'
+
+
+def explain_pipeline(collection, pipeline):
+    """Return the 'executionStats' explain output of an aggregation pipeline."""
+    return collection.database.command(
+        {
+            'explain': {'aggregate': collection.name, 'pipeline': pipeline, 'cursor': {}},
+            'verbosity': 'executionStats'
+        },
+        read_preference=collection.read_preference
+    )
+
+def summarize_explain(explain):
+    """Extract the figures worth comparing from an explain output.
+
+    Pipelines fully executed by the query layer have their executionStats at the top level,
+    the others have a 'stages' list whose first stage is the $cursor of the initial query.
+    """
+    summary = {
+        'docs_examined': 0,
+        'keys_examined': 0,
+        'n_returned': None,
+        'execution_time_ms': None,
+        'plan_stages': [],
+        'stage_timings': []
+    }
+
+    cursor_stats = []
+    if 'stages' in explain:
+        for stage in explain['stages']:
+            stage_name = next((key for key in stage if key.startswith('$')), None)
+            if stage_name == '$cursor':
+                cursor_stats.append(stage['$cursor'])
+            summary['stage_timings'].append({
+                'stage': stage_name,
+                'n_returned': stage.get('nReturned'),
+                'execution_time_ms_estimate': stage.get('executionTimeMillisEstimate')
+            })
+    else:
+        cursor_stats.append(explain)
+
+    for stats in cursor_stats:
+        execution_stats = stats.get('executionStats', {})
+        summary['docs_examined'] += execution_stats.get('totalDocsExamined', 0)
+        summary['keys_examined'] += execution_stats.get('totalKeysExamined', 0)
+        if execution_stats.get('executionTimeMillis') is not None:
+            summary['execution_time_ms'] = execution_stats['executionTimeMillis']
+        if summary['n_returned'] is None:
+            summary['n_returned'] = execution_stats.get('nReturned')
+        winning_plan = stats.get('queryPlanner', {}).get('winningPlan', {})
+        # Newer servers wrap the classic plan in queryPlan
+        summary['plan_stages'].extend(_plan_stages(winning_plan.get('queryPlan', winning_plan)))
+
+    return summary
+
+def _plan_stages(plan):
+    # Flatten a winning plan tree into its stage names, e.g. ['FETCH', 'IXSCAN']
+    if not plan:
+        return []
+    stages = [plan['stage']] if 'stage' in plan else []
+    if 'inputStage' in plan:
+        stages.extend(_plan_stages(plan['inputStage']))
+    for child in plan.get('inputStages', []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def get_slow_query_collection():
+    """Return the capped collection of the profiled queries, creating it on first use."""
+    global _collection_ready
+    from .db import get_db
+
+    db = get_db()
+    if not _collection_ready:
+        try:
+            db.create_collection(SLOW_QUERY_COLLECTION, capped=True, size=SLOW_QUERY_COLLECTION_SIZE_MB * 1024 * 1024)
+        except CollectionInvalid:
+            # Already created, by this or another worker
+            pass
+        _collection_ready = True
+    return db[SLOW_QUERY_COLLECTION]
+
+def record_slow_query(collection, pipeline, name, duration_ms, result_count):
+    entry = {
+        'name': name,
+        'collection': collection.name,
+        'duration_ms': round(duration_ms, 1),
+        'threshold_ms': SLOW_QUERY_THRESHOLD_MS,
+        'result_count': result_count,
+        # Pipelines are stored as JSON text, their '$' keys are not valid field names
+        'pipeline': json.dumps(pipeline, default=str),
+        'timestamp': datetime.now(timezone.utc)
+    }
+    try:
+        explain = explain_pipeline(collection, pipeline)
+        entry.update(summarize_explain(explain))
+        entry['explain'] = json.dumps(explain, default=str)[:SLOW_QUERY_MAX_EXPLAIN_CHARS]
+    except Exception as e:
+        entry['error'] = str(e)
+
+    try:
+        get_slow_query_collection().insert_one(entry)
+        print(f"Slow query {name} on {collection.name}: {entry['duration_ms']}ms, {entry.get('docs_examined')} docs examined")
+    except Exception as e:
+        print(f"Error recording slow query {name}: {str(e)}")
+
+def list_slow_queries(name=None, limit=50):
+    """Return the most recent profiled queries, newest first."""
+    query = {'name': name} if name else {}
+    entries = []
+    for entry in get_slow_query_collection().find(query).sort('$natural', -1).limit(limit):
+        entry['_id'] = str(entry['_id'])
+        entries.append(entry)
+    return entries
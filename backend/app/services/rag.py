@@ -1,15 +1,61 @@
-from llama_index.core import SimpleDirectoryReader
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.llms.openrouter import OpenRouter
-from llama_index.core.llms import ChatMessage
-from pinecone import Pinecone
+# llama_index e pinecone sono importati solo quando servono, per non appesantire l'avvio dei worker
 import os
+import re
+import heapq
+import asyncio
 import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from abc import ABC, abstractmethod
 
+from .rag_cache import embedding_cache, answer_cache, get_index_version, invalidate_answers
+from .llm import initialize_llm
+from .chunking import chunk_documents, get_chunking_settings
+from .keyword_index import KeywordIndex, save_keyword_index, delete_keyword_index, keyword_search
+from .metrics import track_external, external_span
+
 load_dotenv()
 
+# deadline (in secondi) per ogni query su un namespace e pool condiviso per le query in parallelo
+RAG_QUERY_TIMEOUT = float(os.getenv("RAG_QUERY_TIMEOUT", "10"))
+_query_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_QUERY_WORKERS", "8")), thread_name_prefix="rag-query")
+
+# messaggio restituito da query_llm in caso di errore, le risposte che lo contengono non vanno in cache
+LLM_ERROR_MESSAGE = "I encountered an error while processing your query."
+# risposta della chat quando la ricerca non trova chunk rilevanti
+NO_MATCH_ANSWER = "I couldn't find any relevant information in this rulebook to answer your question. Please try rephrasing your query or check if this rulebook contains information about this topic."
+
+# ricerca ibrida: fusione dei risultati vettoriali e BM25 con reciprocal-rank fusion
+RAG_HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "True").lower() in ["true", "1", "t"]
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+# budget di token per il contesto inviato all'LLM e soglia oltre la quale due chunk sono considerati duplicati.
+# Senza RAG_CONTEXT_TOKEN_BUDGET il budget è (numero di chunk recuperati) x RAG_CHUNK_SIZE, cioè entrano tutti
+# i chunk recuperati; un budget più basso rende la chiamata all'LLM più economica e veloce ma scarta i chunk meno rilevanti
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET") or 0)
+RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.8"))
+_tokenizer = None
+
+# tempo massimo (in secondi) di attesa dell'inizializzazione del RAG da parte di una richiesta
+RAG_INIT_TIMEOUT = float(os.getenv("RAG_INIT_TIMEOUT", "120"))
+
+# stato dell'inizializzazione lazy del sottosistema RAG
+_rag_lock = threading.Lock()
+_rag_ready = threading.Event()
+_rag_components = None
+_rag_error = None
+_warmup_thread = None
+
+# client async dell'indice Pinecone, usato dalla modalità ASGI
+_async_index = None
+_async_index_lock = asyncio.Lock()
+
+
+class RagUnavailableError(RuntimeError):
+    """Il sottosistema RAG non è (ancora) disponibile."""
+
 
 # Abstract Embedding Provider
 class EmbeddingProvider(ABC):
@@ -23,6 +69,10 @@ class EmbeddingProvider(ABC):
         """Return the dimension of the embedding vector"""
         pass
 
+    def embed_batch(self, texts):
+        """Embed a list of texts, providers that support batching should override this"""
+        return [self.embed(text) for text in texts]
+
 # Local Embedding Provider using fastembed
 class LocalEmbeddingProvider(EmbeddingProvider):
     def __init__(self, model_name="BAAI/bge-small-en-v1.5"):
@@ -37,6 +87,10 @@ class LocalEmbeddingProvider(EmbeddingProvider):
     def embed(self, text):
         embeddings = list(self.model.embed(text))
         return embeddings[0].tolist()
+
+    def embed_batch(self, texts):
+        # fastembed runs the whole list through the ONNX model in batches
+        return [embedding.tolist() for embedding in self.model.embed(list(texts))]
     
     def get_dimension(self):
         # For BAAI/bge-small-en-v1.5 it's 384
@@ -68,6 +122,51 @@ class GeminiEmbeddingProvider(EmbeddingProvider):
         # Gemini embeddings are typically 768-dimensional
         return 768
 
+# Remote Embedding Provider, talks to the shared embedding server (see embedding_server.py)
+class RemoteEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, address, authkey):
+        from .embedding_server import parse_address
+        if not authkey:
+            raise ValueError("EMBEDDING_SERVER_AUTHKEY is required when EMBEDDING_TYPE is set to 'remote'")
+        self.address = parse_address(address)
+        self.authkey = authkey
+        # One connection per thread, requests on a connection are strictly request/response
+        self._local = threading.local()
+        self._dimension = None
+        print(f"Using shared embedding server at {address}")
+
+    def _request(self, message):
+        from multiprocessing.connection import Client
+        conn = getattr(self._local, "conn", None)
+        for attempt in range(2):
+            if conn is None:
+                conn = Client(self.address, authkey=self.authkey)
+                self._local.conn = conn
+            try:
+                conn.send(message)
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # The server was restarted, reconnect once
+                conn.close()
+                conn = self._local.conn = None
+                if attempt == 1:
+                    raise
+        if status != "ok":
+            raise ValueError(result)
+        return result
+
+    def embed(self, text):
+        return self._request(("embed", [text]))[0]
+
+    def embed_batch(self, texts):
+        return self._request(("embed", list(texts)))
+
+    def get_dimension(self):
+        if self._dimension is None:
+            self._dimension = self._request(("dimension", None))
+        return self._dimension
+
 # Factory function to create the appropriate embedding provider
 def create_embedding_provider():
     embedding_type = os.getenv("EMBEDDING_TYPE", "local").lower()
@@ -80,8 +179,12 @@ def create_embedding_provider():
         if not gemini_api_key:
             raise ValueError("GEMINI_API_KEY is required when EMBEDDING_TYPE is set to 'gemini'")
         return GeminiEmbeddingProvider(api_key=gemini_api_key)
+    elif embedding_type == "remote":
+        from .embedding_server import get_authkey
+        address = os.getenv("EMBEDDING_SERVER_ADDRESS", "/tmp/meeplestats-embeddings.sock")
+        return RemoteEmbeddingProvider(address, get_authkey())
     else:
-        raise ValueError(f"Unknown EMBEDDING_TYPE: {embedding_type}. Use 'local' or 'gemini'")
+        raise ValueError(f"Unknown EMBEDDING_TYPE: {embedding_type}. Use 'local', 'gemini' or 'remote'")
 
 
 
@@ -96,6 +199,8 @@ def initialize_embedding_provider():
 
 def initialize_pinecone():
     """Inizializza la connessione a Pinecone e crea/connette all'indice."""
+    from pinecone import Pinecone
+
     pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
     
     index_name = os.getenv("PINECONE_INDEX_NAME")
@@ -117,6 +222,57 @@ def initialize_pinecone():
     
     return index, embedding_provider
 
+def _warmup_rag():
+    """Inizializza Pinecone, il modello di embedding e il client LLM (eseguita nel thread di warm-up)."""
+    global _rag_components, _rag_error
+    try:
+        index, embedding_provider = initialize_pinecone()
+        llm_client = initialize_llm()
+        _rag_components = (index, embedding_provider, llm_client)
+        _rag_error = None
+        _rag_ready.set()
+        print("RAG subsystem ready")
+    except Exception as e:
+        _rag_error = str(e)
+        print(f"Error initializing RAG subsystem: {_rag_error}")
+
+def start_rag_warmup():
+    """Avvia in background l'inizializzazione del RAG, se non è già pronta o in corso."""
+    global _warmup_thread
+    with _rag_lock:
+        if _rag_ready.is_set():
+            return _warmup_thread
+        if _warmup_thread is None or not _warmup_thread.is_alive():
+            _warmup_thread = threading.Thread(target=_warmup_rag, name="rag-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+def reset_after_fork():
+    """Scarta lo stato ereditato dal processo master dopo un fork (gunicorn con preload_app)."""
+    global _rag_lock, _rag_ready, _rag_components, _rag_error, _warmup_thread
+    _rag_lock = threading.Lock()
+    _rag_ready = threading.Event()
+    _rag_components = None
+    _rag_error = None
+    _warmup_thread = None
+
+def is_rag_ready():
+    return _rag_ready.is_set()
+
+def get_rag_status():
+    return {'ready': _rag_ready.is_set(), 'error': _rag_error}
+
+def get_rag_components(timeout=None):
+    """Restituisce (index, embedding_provider, llm_client), attendendo il warm-up se necessario."""
+    if os.getenv("ENABLE_RAG") != "True":
+        raise RagUnavailableError("RAG is disabled")
+    if not _rag_ready.is_set():
+        warmup_thread = start_rag_warmup()
+        warmup_thread.join(RAG_INIT_TIMEOUT if timeout is None else timeout)
+    if not _rag_ready.is_set():
+        raise RagUnavailableError(_rag_error or "RAG subsystem is still initializing")
+    return _rag_components
+
 def get_namespaces(index):
     """Ottiene la lista dei namespace disponibili."""
     index_stats = index.describe_index_stats()
@@ -135,6 +291,8 @@ def load_document(file_path):
         print(f"Error: PDF file '{file_path}' not found.")
         return None
         
+    from llama_index.core import SimpleDirectoryReader
+
     print(f"Loading PDF: {file_path}")
     reader = SimpleDirectoryReader(input_files=[file_path])
     documents = reader.load_data()
@@ -148,46 +306,48 @@ def load_document(file_path):
 #    print(f"Loaded {len(documents)} documents for indexing")
 #    return documents
 
-def process_document_chunk(doc, safe_namespace, i, embedding_provider):
-    """Elabora un singolo documento (pagina del pdf) in chunks e crea i record per Pinecone."""
+def process_chunks(chunks, safe_namespace, embedding_provider, batch_size=64):
+    """Crea gli embedding dei chunk e i record per Pinecone."""
     records = []
-    page_number = doc.metadata.get('page_label', 'unknown')
-    
-    # divido il doc (pagina del pdf) in chunks
-    parser = SentenceSplitter()
-    nodes = parser.get_nodes_from_documents([doc])
-    
-    print(f"Processing page {i+1}, split into {len(nodes)} chunks")
-    
-    # creo vettore per ogni chunk di una pagina specifica
-    for j, node in enumerate(nodes):
-        # Skip empty nodes or nodes with only whitespace
-        if not node.text or not node.text.strip():
-            print(f"Skipping empty chunk on page {i+1}, chunk {j}")
-            continue
-            
-        # creo un id deterministico basato sul contenuto del chunk per evitare duplicati
-        content_hash = hashlib.md5(node.text.encode()).hexdigest()
-        record_id = f"{safe_namespace}_doc_{i}_chunk_{j}_{content_hash[:8]}"
-        
-        # creo embedding per il testo del chunk
+
+    for batch_start in range(0, len(chunks), batch_size):
+        batch = chunks[batch_start:batch_start + batch_size]
+
+        # calcolo gli embedding di tutto il batch con una sola chiamata
         try:
-            embedding = embedding_provider.embed(node.text)
-
-            # aggiungo al record (unità di informazione per pinecone) l'embedding e i metadati (id univoco, embedding, testo del chunk, pagina e nome del pdf)
-            records.append({
-                "id": record_id,
-                "values": embedding,
-                "metadata": {
-                    "text": node.text,
-                    "page_label": page_number,
-                    "file_name": doc.metadata.get('file_name', 'unknown')
-                }
-            })
+            embeddings = iter(embedding_provider.embed_batch([chunk["text"] for chunk in batch]))
         except ValueError as e:
-            print(f"Error embedding chunk on page {i+1}, chunk {j}: {str(e)}")
-            continue
-    
+            print(f"Error embedding chunks {batch_start}-{batch_start + len(batch)} in batch, falling back to single chunks: {str(e)}")
+            embeddings = None
+
+        # creo un vettore per ogni chunk
+        for chunk in batch:
+            i, j = chunk["doc_index"], chunk["chunk_index"]
+
+            # creo un id deterministico basato sul contenuto del chunk per evitare duplicati
+            content_hash = hashlib.md5(chunk["text"].encode()).hexdigest()
+            record_id = f"{safe_namespace}_doc_{i}_chunk_{j}_{content_hash[:8]}"
+
+            # creo embedding per il testo del chunk
+            try:
+                embedding = next(embeddings) if embeddings is not None else embedding_provider.embed(chunk["text"])
+
+                # aggiungo al record (unità di informazione per pinecone) l'embedding e i metadati (id univoco, embedding, testo del chunk, pagina e nome del pdf)
+                records.append({
+                    "id": record_id,
+                    "values": embedding,
+                    "metadata": {
+                        "text": chunk["text"],
+                        "page_label": chunk["page_label"],
+                        "file_name": chunk["file_name"],
+                        "doc_index": i,
+                        "chunk_index": j
+                    }
+                })
+            except ValueError as e:
+                print(f"Error embedding chunk {j} (page {i+1}): {str(e)}")
+                continue
+
     return records
 
 def upsert_records_in_batches(index, records, namespace, batch_size=100):
@@ -199,11 +359,15 @@ def upsert_records_in_batches(index, records, namespace, batch_size=100):
     
     for i in range(0, len(records), batch_size):
         batch = records[i:i+batch_size]
-        index.upsert(vectors=batch, namespace=namespace)
+        with track_external("pinecone", "upsert"):
+            index.upsert(vectors=batch, namespace=namespace)
         print(f"Upserted batch {i//batch_size + 1}/{(len(records)-1)//batch_size + 1}")
 
-def index_single_pdf(file_path, index, embedding_provider, unique_file_name):
+def index_single_pdf(file_path, index, embedding_provider, unique_file_name, chunking=None):
     """Indicizza un singolo file PDF in un namespace specifico.
+
+    Args:
+        chunking: impostazioni di chunking (vedi chunking.get_chunking_settings), i default se None
     
     Returns:
         bool: True se l'indicizzazione è riuscita, False altrimenti
@@ -221,19 +385,29 @@ def index_single_pdf(file_path, index, embedding_provider, unique_file_name):
         index.delete(delete_all=True, namespace=safe_namespace)
         print(f"Cleared namespace {safe_namespace}")
     
+    # le risposte in cache per questo rulebook non sono più valide
+    invalidate_answers(safe_namespace)
+
     # carico il pdf
     documents = load_document(unique_file_name)
     if not documents:
         return False
     
-    # elaboro i docs per questo namespace (corrispondono alle pagine del pdf)
-    all_records = []
-    for i, doc in enumerate(documents):
-        records = process_document_chunk(doc, safe_namespace, i, embedding_provider)
-        all_records.extend(records)
+    # divido i docs (le pagine del pdf) in chunk con la strategia scelta e creo i record
+    chunks = chunk_documents(documents, chunking or get_chunking_settings())
+    all_records = process_chunks(chunks, safe_namespace, embedding_provider)
     
     # inserisco i vettori in pinecone in batch
     upsert_records_in_batches(index, all_records, safe_namespace)
+
+    # costruisco l'indice per parole chiave dagli stessi chunk, un errore qui non blocca l'indicizzazione
+    try:
+        save_keyword_index(safe_namespace, KeywordIndex.build(all_records))
+    except Exception as e:
+        print(f"Error building keyword index for {safe_namespace}: {str(e)}")
+
+    # scarto anche le risposte calcolate sull'indice parziale durante l'indicizzazione
+    invalidate_answers(safe_namespace)
     
     print(f"Successfully indexed {pdf_name} into namespace '{safe_namespace}'")
     
@@ -294,122 +468,327 @@ def index_single_pdf(file_path, index, embedding_provider, unique_file_name):
 #    
 #    return indexed_count > 0
 
-def query_index(query, target_namespaces, index, embedding_provider, top_k=3):
+def _query_namespace(index, query_embedding, namespace, top_k):
+    """Esegue la query su un singolo namespace e marca i match con il namespace di provenienza."""
+    print(f"Querying namespace: {namespace}")
+    with track_external("pinecone", "query"):
+        results = index.query(
+            vector=query_embedding,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=namespace
+        )
+
+    # aggiungo il namespace a ogni match per il tracciamento
+    for match in results["matches"]:
+        match["namespace"] = namespace
+
+    return results["matches"]
+
+def embed_query(query, embedding_provider):
+    """Restituisce l'embedding della query, riusando quello in cache se la stessa domanda è già stata fatta."""
+    query_embedding = embedding_cache.get(query)
+    if query_embedding is None:
+        query_embedding = embedding_provider.embed(query)
+        embedding_cache.put(query, query_embedding)
+    return query_embedding
+
+def query_index(query, target_namespaces, index, embedding_provider, top_k=3, max_results=5, query_embedding=None):
     """Esegue query su uno o più namespace e restituisce i risultati."""
     print(f"\nQuerying the index with: {query}")
     # fastembed ritorna un generatore di embeddings, converto in lista
     #embeddings = list(embedding_model.embed(query))
     #query_embedding = embeddings[0].tolist()
-    query_embedding = embedding_provider.embed(query)
-    
-    # interrogo ogni namespace
+    if query_embedding is None:
+        query_embedding = embed_query(query, embedding_provider)
+
+    # con un solo namespace evito il passaggio dal pool di thread
+    if len(target_namespaces) == 1:
+        matches = _query_namespace(index, query_embedding, target_namespaces[0], top_k)
+        return heapq.nlargest(max_results, matches, key=lambda x: x.get("score", 0))
+
+    # interrogo i namespace in parallelo, così il costo è circa quello di una sola round trip.
+    # Ogni thread gira in una copia del contesto, così i tempi finiscono nelle metriche della richiesta;
+    # nel tempo della richiesta conta la durata dell'intero fan-out, non la somma delle query
+    with external_span():
+        futures = {
+            _query_executor.submit(contextvars.copy_context().run, _query_namespace, index, query_embedding, namespace, top_k): namespace
+            for namespace in target_namespaces
+        }
+        done, not_done = wait(futures, timeout=RAG_QUERY_TIMEOUT)
+
     all_matches = []
-    for namespace in target_namespaces:
-        print(f"Querying namespace: {namespace}")
-        results = index.query(
+    for future in done:
+        try:
+            all_matches.extend(future.result())
+        except Exception as e:
+            print(f"Error querying namespace {futures[future]}: {str(e)}")
+
+    # i namespace che superano la deadline vengono scartati, la risposta usa quelli arrivati in tempo
+    for future in not_done:
+        future.cancel()
+        print(f"Query on namespace {futures[future]} exceeded the {RAG_QUERY_TIMEOUT}s deadline, skipping")
+
+    # prendo i migliori risultati combinati per punteggio senza ordinare tutti i match
+    top_matches = heapq.nlargest(max_results, all_matches, key=lambda x: x.get("score", 0))
+
+    return top_matches
+
+def hybrid_query_index(query, target_namespaces, index, embedding_provider, top_k=3, max_results=5, query_embedding=None):
+    """Combina la ricerca vettoriale e quella BM25 con reciprocal-rank fusion."""
+    vector_matches = query_index(query, target_namespaces, index, embedding_provider, top_k=top_k,
+                                 max_results=top_k * len(target_namespaces), query_embedding=query_embedding)
+    if not RAG_HYBRID_SEARCH:
+        return vector_matches[:max_results]
+
+    try:
+        keyword_matches = keyword_search(query, target_namespaces, top_k=top_k * len(target_namespaces))
+    except Exception as e:
+        print(f"Error in keyword search, using vector results only: {str(e)}")
+        return vector_matches[:max_results]
+
+    return _fuse_rankings(vector_matches, keyword_matches, max_results)
+
+def _fuse_rankings(vector_matches, keyword_matches, max_results):
+    """Reciprocal-rank fusion: ogni lista contribuisce 1 / (k + rank) al punteggio di un chunk."""
+    fused = {}
+    for ranking in (vector_matches, keyword_matches):
+        for rank, match in enumerate(ranking, start=1):
+            match_id = match.get("id")
+            if match_id not in fused:
+                fused[match_id] = {
+                    "id": match_id,
+                    "score": 0.0,
+                    "metadata": match.get("metadata", {}),
+                    "namespace": match.get("namespace", "unknown")
+                }
+            fused[match_id]["score"] += 1.0 / (RAG_RRF_K + rank)
+
+    return heapq.nlargest(max_results, fused.values(), key=lambda x: x["score"])
+
+async def get_async_index():
+    """Restituisce il client async dell'indice Pinecone, creandolo alla prima chiamata."""
+    global _async_index
+    async with _async_index_lock:
+        if _async_index is None:
+            from pinecone import Pinecone
+
+            pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+            # describe_index è bloccante, ma viene chiamata una sola volta
+            description = await asyncio.to_thread(pc.describe_index, os.getenv("PINECONE_INDEX_NAME"))
+            _async_index = pc.IndexAsyncio(host=description.host)
+    return _async_index
+
+async def close_async_index():
+    global _async_index
+    if _async_index is not None:
+        await _async_index.close()
+        _async_index = None
+
+async def aembed_query(query, embedding_provider):
+    """Versione async di embed_query: il modello gira in un thread, la cache viene letta subito."""
+    query_embedding = embedding_cache.get(query)
+    if query_embedding is None:
+        query_embedding = await asyncio.to_thread(embedding_provider.embed, query)
+        embedding_cache.put(query, query_embedding)
+    return query_embedding
+
+async def _aquery_namespace(async_index, query_embedding, namespace, top_k):
+    with track_external("pinecone", "query"):
+        results = await async_index.query(
             vector=query_embedding,
             top_k=top_k,
             include_metadata=True,
             namespace=namespace
         )
-        
-        # aggiungo il namespace a ogni match per il tracciamento
-        for match in results["matches"]:
-            match["namespace"] = namespace
-        
-        all_matches.extend(results["matches"])
-    
-    # ordino i risultati combinati per punteggio e prendo i primi 5
-    all_matches.sort(key=lambda x: x.get("score", 0), reverse=True)
-    top_matches = all_matches[:5]
-    
-    return top_matches
+    for match in results["matches"]:
+        match["namespace"] = namespace
+    return results["matches"]
+
+async def aquery_index(query, target_namespaces, async_index, embedding_provider, top_k=3, max_results=5, query_embedding=None):
+    """Versione async di query_index: i namespace sono interrogati in parallelo sull'event loop, senza thread."""
+    if query_embedding is None:
+        query_embedding = await aembed_query(query, embedding_provider)
+
+    with external_span():
+        tasks = {
+            asyncio.ensure_future(_aquery_namespace(async_index, query_embedding, namespace, top_k)): namespace
+            for namespace in target_namespaces
+        }
+        done, not_done = await asyncio.wait(tasks, timeout=RAG_QUERY_TIMEOUT)
+
+    all_matches = []
+    for task in done:
+        try:
+            all_matches.extend(task.result())
+        except Exception as e:
+            print(f"Error querying namespace {tasks[task]}: {str(e)}")
+
+    for task in not_done:
+        task.cancel()
+        print(f"Query on namespace {tasks[task]} exceeded the {RAG_QUERY_TIMEOUT}s deadline, skipping")
+
+    return heapq.nlargest(max_results, all_matches, key=lambda x: x.get("score", 0))
+
+async def ahybrid_query_index(query, target_namespaces, async_index, embedding_provider, top_k=3, max_results=5, query_embedding=None):
+    """Versione async di hybrid_query_index."""
+    vector_matches = await aquery_index(query, target_namespaces, async_index, embedding_provider, top_k=top_k,
+                                        max_results=top_k * len(target_namespaces), query_embedding=query_embedding)
+    if not RAG_HYBRID_SEARCH:
+        return vector_matches[:max_results]
+
+    try:
+        # BM25 lavora in memoria, la lettura dell'indice da MongoDB avviene solo al refresh
+        keyword_matches = await asyncio.to_thread(keyword_search, query, target_namespaces, top_k * len(target_namespaces))
+    except Exception as e:
+        print(f"Error in keyword search, using vector results only: {str(e)}")
+        return vector_matches[:max_results]
+
+    return _fuse_rankings(vector_matches, keyword_matches, max_results)
+
+def count_tokens(text):
+    """Conta i token del testo con il tokenizer di tiktoken, o li stima (circa 4 caratteri per token) se non disponibile."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base").encode
+        except Exception:
+            _tokenizer = lambda value: range((len(value) + 3) // 4)
+    return len(_tokenizer(text))
+
+def _chunk_position(match):
+    """Restituisce (pagina del pdf, indice del chunk) del match, dai metadati o dall'id del record."""
+    metadata = match.get("metadata", {})
+    if "doc_index" in metadata and "chunk_index" in metadata:
+        return int(metadata["doc_index"]), int(metadata["chunk_index"])
+    found = re.search(r"_doc_(\d+)_chunk_(\d+)_", str(match.get("id", "")))
+    if found:
+        return int(found.group(1)), int(found.group(2))
+    return None, None
+
+def _is_near_duplicate(words, kept_words):
+    """Un chunk è quasi duplicato se la maggior parte delle sue parole è già contenuta in un chunk scelto."""
+    if not words:
+        return True
+    for other in kept_words:
+        if len(words & other) / len(words) >= RAG_DEDUP_THRESHOLD:
+            return True
+    return False
 
-def display_search_results(matches):
+def _merge_overlapping(first, second, min_overlap=21):
+    """Unisce due chunk consecutivi rimuovendo la parte in comune (finestre sovrapposte dello splitter)."""
+    # la sovrapposizione inizia dove compare in first l'inizio di second: verifico solo quelle posizioni,
+    # dalla prima (sovrapposizione più lunga) in poi, invece di provare tutte le lunghezze possibili
+    probe = second[:min_overlap]
+    if len(probe) < min_overlap:
+        return f"{first} {second}"
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first[:start] + second
+        start = first.find(probe, start + 1)
+    return f"{first} {second}"
+
+def assemble_context(matches, token_budget=None):
+    """Seleziona i chunk entro il budget di token, scarta i quasi duplicati e unisce i chunk adiacenti della stessa pagina.
+
+    Returns:
+        tuple: (contesto da passare all'LLM, riferimenti alle pagine)
+    """
+    if token_budget is None:
+        token_budget = RAG_CONTEXT_TOKEN_BUDGET or len(matches) * get_chunking_settings()["chunk_size"]
+
+    # scelgo i chunk in ordine di rilevanza finché c'è budget
+    selected = []
+    kept_words = []
+    used_tokens = 0
+    for rank, match in enumerate(matches):
+        metadata = match.get("metadata", {})
+        text = metadata.get("text", "").strip()
+        words = set(text.lower().split())
+        if _is_near_duplicate(words, kept_words):
+            continue
+        tokens = count_tokens(text)
+        if selected and used_tokens + tokens > token_budget:
+            continue
+        kept_words.append(words)
+        used_tokens += tokens
+        doc_index, chunk_index = _chunk_position(match)
+        selected.append({
+            "rank": rank,
+            "text": text,
+            "page": str(metadata.get("page_label", "unknown")),
+            "file": str(metadata.get("file_name", "unknown")),
+            "doc_index": doc_index,
+            "chunk_index": chunk_index
+        })
+
+    # ordino per file, pagina e posizione nel documento, così i chunk adiacenti sono vicini
+    # e ognuno va confrontato solo con il precedente
+    selected.sort(key=lambda c: (c["file"], c["page"],
+                                 c["doc_index"] if c["doc_index"] is not None else 0,
+                                 c["chunk_index"] if c["chunk_index"] is not None else c["rank"]))
+
+    # raggruppo per file e pagina, mantenendo l'ordine di rilevanza del chunk migliore del gruppo
+    groups = {}
+    for chunk in selected:
+        groups.setdefault((chunk["file"], chunk["page"]), []).append(chunk)
+
+    context_blocks = []
+    page_refs = []
+    for (file_name, page), chunks in sorted(groups.items(), key=lambda item: min(c["rank"] for c in item[1])):
+        # i chunk della stessa pagina vengono uniti nell'ordine del documento
+        text = chunks[0]["text"]
+        for previous, chunk in zip(chunks, chunks[1:]):
+            adjacent = previous["chunk_index"] is not None and chunk["chunk_index"] == previous["chunk_index"] + 1
+            text = _merge_overlapping(text, chunk["text"]) if adjacent else f"{text}\n{chunk['text']}"
+        context_blocks.append(f"[Page {page}] {text}")
+        page_refs.append({"page": page, "file": file_name})
+
+    return "\n\n".join(context_blocks), page_refs
+
+def display_search_results(matches, token_budget=None):
     """Visualizza i risultati della ricerca, ovvero i chunks rilevanti recuperati con i punteggi relativi."""
     if not matches:
         print("No matching results found.")
         return "", []
-        
-    page_refs = []
-    context_with_pages = []
     
     try:
-        for i, match in enumerate(matches):
-            score = match.get("score", 0.0)
-            namespace = match.get("namespace", "unknown")
-            metadata = match.get("metadata", {})
-            text = metadata.get("text", "")
-            page_number = metadata.get("page_label", "unknown")
-            file_name = metadata.get("file_name", "unknown")
-            
-            # estraggo i metadati
-            page_refs.append({"page": str(page_number), "file": str(file_name)})
-            
-            # formatto il contesto con il numero di pagina
-            page_info = f"[Page {page_number}]"
-            context_with_pages.append(f"{page_info} {text}")
-        
-        context = "\n\n".join(context_with_pages)
-        
+        context, page_refs = assemble_context(matches, token_budget)
+        print(f"Assembled context from {len(matches)} matches into {len(page_refs)} page blocks ({count_tokens(context)} tokens)")
         return context, page_refs
     except Exception as e:
         print(f"Error formatting search results: {str(e)}")
         return "", []
 
-def query_llm(query, context, page_refs):
-    """Invia la query al modello LLM con il contesto recuperato."""
-    try:
-        # configuro la chiave api fake di openai per evitare errori tra openAI sdk e openrouter
-        os.environ["OPENAI_API_KEY"] = "dummy_value"
-        
-        llm_model = os.getenv("LLM_MODEL")
-        llm = OpenRouter(
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            max_tokens=4096,
-            context_window=32768,
-            model=llm_model
-        )
-        
-        prompt = f"""You are an expert in board game rules and gameplay mechanics, with deep knowledge of strategy games.
-
-Using the context provided, answer the query in a clear, formal, and detailed manner. Your answer MUST:
-- Be written in the same language as the query
-- Adhere strictly to the official game rules
-- Provide clarifications if the context is ambiguous or insufficient
-- Avoid speculation beyond the provided rules
-- Avoid reiterating the obvious and focus on resolving ambiguity with precise rule-based reasoning
-- Include the page number references where the information was found in your answer
-
----
-
-Query:
-{query}
+def build_prompt(query, context):
+    """Costruisce il prompt per il modello LLM a partire dalla query e dal contesto recuperato."""
+    return f"""You are an expert on board game rules. Answer the query using only the rulebook context below.
+- Reply in the language of the query
+- Follow the official rules strictly, without speculating
+- Say so if the context is ambiguous or insufficient
+- Cite the page numbers you used
 
----
+Query: {query}
 
 Context:
 {context}
 
----
-
 Answer:"""
+
+def query_llm(query, context, page_refs, llm_client):
+    """Invia la query al modello LLM con il contesto recuperato."""
+    from llama_index.core.llms import ChatMessage
+
+    try:
+        prompt = build_prompt(query, context)
         
         message = ChatMessage(role="user", content=prompt)
-        resp = llm.chat([message])
+        resp = llm_client.chat([message])
         print("LLM Response:\n", resp)
         
-        # prendo il testo della risposta
-        if hasattr(resp, 'message'):
-            response_text = resp.message
-        elif isinstance(resp, str):
-            response_text = resp
-        else:
-            # converto l'intera risposta in stringa
-            response_text = str(resp)
-            # estraggo il testo dopo "assistant:" se presente nella stringa
-            if "assistant:" in response_text:
-                response_text = response_text.split("assistant:", 1)[1].strip()
+        response_text = _response_text(resp)
         
         serializable_page_refs = []
         for ref in page_refs:
@@ -427,11 +806,141 @@ Answer:"""
         return response_text
     except Exception as e:
         print(f"Error querying LLM: {str(e)}")
-        return f"I encountered an error while processing your query. Error: {str(e)}"
+        return f"{LLM_ERROR_MESSAGE} Error: {str(e)}"
+
+def _response_text(resp):
+    """Estrae il testo della risposta dell'LLM."""
+    if hasattr(resp, 'message'):
+        return resp.message
+    elif isinstance(resp, str):
+        return resp
+    # converto l'intera risposta in stringa
+    response_text = str(resp)
+    # estraggo il testo dopo "assistant:" se presente nella stringa
+    if "assistant:" in response_text:
+        response_text = response_text.split("assistant:", 1)[1].strip()
+    return response_text
+
+async def aquery_llm(query, context, llm_client):
+    """Versione async di query_llm."""
+    from llama_index.core.llms import ChatMessage
+
+    try:
+        message = ChatMessage(role="user", content=build_prompt(query, context))
+        return _response_text(await llm_client.achat([message]))
+    except Exception as e:
+        print(f"Error querying LLM: {str(e)}")
+        return f"{LLM_ERROR_MESSAGE} Error: {str(e)}"
+
+async def astream_llm(query, context, llm_client):
+    """Versione async di stream_llm."""
+    from llama_index.core.llms import ChatMessage
+
+    streamed = False
+    try:
+        message = ChatMessage(role="user", content=build_prompt(query, context))
+        async for chunk in llm_client.astream_chat([message]):
+            if chunk.delta:
+                streamed = True
+                yield chunk.delta
+    except Exception as e:
+        print(f"Error streaming from LLM: {str(e)}")
+        # dopo una risposta parziale l'errore viene rilanciato, così la risposta troncata non finisce in cache
+        if streamed:
+            raise
+        yield f"{LLM_ERROR_MESSAGE} Error: {str(e)}"
+
+def stream_llm(query, context, llm_client):
+    """Invia la query al modello LLM in streaming, restituendo i token man mano che arrivano."""
+    from llama_index.core.llms import ChatMessage
+
+    streamed = False
+    try:
+        message = ChatMessage(role="user", content=build_prompt(query, context))
+        for chunk in llm_client.stream_chat([message]):
+            if chunk.delta:
+                streamed = True
+                yield chunk.delta
+    except Exception as e:
+        print(f"Error streaming from LLM: {str(e)}")
+        # dopo una risposta parziale l'errore viene rilanciato, così la risposta troncata non finisce in cache
+        if streamed:
+            raise
+        yield f"{LLM_ERROR_MESSAGE} Error: {str(e)}"
+
+def _chat_result(answer, page_refs, context, on_complete=None):
+    return {"answer": answer, "page_refs": page_refs, "context": context, "on_complete": on_complete}
+
+def _cached_chat_answer(namespace, query, query_embedding):
+    """Restituisce (risposta in cache o None, versione dell'indice del namespace letta prima di calcolare la risposta)."""
+    index_version = get_index_version(namespace)
+    return answer_cache.lookup(namespace, query, query_embedding, version=index_version), index_version
+
+def _chat_context(namespace, query, query_embedding, top_matches, index_version):
+    """Costruisce contesto e riferimenti alle pagine dai match, e la funzione che salva la risposta in cache."""
+    context, page_refs = display_search_results(top_matches)
+    page_refs = [{"page": str(ref["page"]), "file": str(ref["file"])} for ref in page_refs]
+    context = str(context)
+
+    def cache_answer(answer):
+        # la risposta va in cache solo se la chiamata all'LLM è riuscita
+        if answer and not answer.startswith(LLM_ERROR_MESSAGE):
+            answer_cache.store(namespace, query, query_embedding, answer, page_refs, context, version=index_version)
+
+    return context, page_refs, cache_answer
+
+def answer_rulebook_query(query, namespace, index, embedding_provider, llm_client, stream=False):
+    """Risponde a una domanda su un rulebook: cache delle risposte, ricerca ibrida e LLM.
+
+    Returns:
+        dict: answer (il testo, o un generatore dei token se stream e la risposta non è in cache),
+        page_refs, context e on_complete, da chiamare con la risposta completa alla fine dello streaming
+    """
+    # l'embedding della query serve sia per la cache delle risposte sia per Pinecone
+    query_embedding = embed_query(query, embedding_provider)
+
+    # domande uguali (o equivalenti) hanno la risposta dalla cache, senza chiamare Pinecone o l'LLM
+    cached, index_version = _cached_chat_answer(namespace, query, query_embedding)
+    if cached is not None:
+        return _chat_result(cached["answer"], cached["page_refs"], cached["context"])
+
+    top_matches = hybrid_query_index(query, [namespace], index, embedding_provider, query_embedding=query_embedding)
+    if not top_matches:
+        return _chat_result(NO_MATCH_ANSWER, [], "")
+
+    context, page_refs, cache_answer = _chat_context(namespace, query, query_embedding, top_matches, index_version)
+    if stream:
+        return _chat_result(stream_llm(query, context, llm_client), page_refs, context, on_complete=cache_answer)
+
+    answer = str(query_llm(query, context, page_refs, llm_client))
+    cache_answer(answer)
+    return _chat_result(answer, page_refs, context)
+
+async def aanswer_rulebook_query(query, namespace, async_index, embedding_provider, llm_client, stream=False):
+    """Versione async di answer_rulebook_query, con l'indice Pinecone async (modalità ASGI)."""
+    query_embedding = await aembed_query(query, embedding_provider)
+
+    cached, index_version = await asyncio.to_thread(_cached_chat_answer, namespace, query, query_embedding)
+    if cached is not None:
+        return _chat_result(cached["answer"], cached["page_refs"], cached["context"])
+
+    top_matches = await ahybrid_query_index(query, [namespace], async_index, embedding_provider, query_embedding=query_embedding)
+    if not top_matches:
+        return _chat_result(NO_MATCH_ANSWER, [], "")
+
+    context, page_refs, cache_answer = _chat_context(namespace, query, query_embedding, top_matches, index_version)
+    if stream:
+        return _chat_result(astream_llm(query, context, llm_client), page_refs, context, on_complete=cache_answer)
+
+    answer = str(await aquery_llm(query, context, llm_client))
+    cache_answer(answer)
+    return _chat_result(answer, page_refs, context)
 
 def clear_namespace(index, namespace):
     """Cancella un namespace specifico."""
     index.delete(delete_all=True, namespace=namespace)
+    invalidate_answers(namespace)
+    delete_keyword_index(namespace)
     print(f"Cleared namespace {namespace}")
 
 def clear_all_namespaces(index):
@@ -455,6 +964,8 @@ def clear_all_namespaces(index):
         print(f"Clearing namespace: {namespace}")
         try:
             index.delete(delete_all=True, namespace=namespace)
+            invalidate_answers(namespace)
+            delete_keyword_index(namespace)
             cleared_count += 1
         except Exception as e:
             print(f"Error clearing namespace {namespace}: {str(e)}")
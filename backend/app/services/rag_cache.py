@@ -0,0 +1,161 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import OrderedDict
+
+
+# Cache LRU testo della query -> embedding
+class EmbeddingCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text):
+        with self._lock:
+            embedding = self._entries.get(text)
+            if embedding is not None:
+                self._entries.move_to_end(text)
+            return embedding
+
+    def put(self, text, embedding):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[text] = embedding
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Cache delle risposte per namespace: match esatto sulla query normalizzata o per similarità dell'embedding.
+# Ogni worker ha la sua cache, le voci sono legate alla versione dell'indice del namespace salvata su
+# MongoDB (vedi get_index_version), così una re-indicizzazione fatta da un worker le invalida in tutti.
+class AnswerCache:
+    def __init__(self, ttl=86400, max_entries_per_namespace=128, similarity_threshold=0.95):
+        self.ttl = ttl
+        self.max_entries_per_namespace = max_entries_per_namespace
+        self.similarity_threshold = similarity_threshold
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, namespace, query, embedding=None, version=0):
+        """Restituisce la voce in cache per la query, oppure None.
+
+        Args:
+            version: versione corrente dell'indice del namespace, le voci di versioni precedenti vengono scartate
+        """
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entries = self._entries(namespace, version)
+            if not entries:
+                return None
+
+            # elimino le voci scadute
+            for expired_key in [k for k, entry in entries.items() if entry["expires_at"] <= now]:
+                del entries[expired_key]
+
+            entry = entries.get(key)
+            if entry is not None:
+                entries.move_to_end(key)
+                return entry
+
+            if embedding is None or self.similarity_threshold >= 1:
+                return None
+
+            # cerco una domanda semanticamente equivalente già risposta
+            best_entry, best_score = None, self.similarity_threshold
+            query_norm = _norm(embedding)
+            for candidate in entries.values():
+                score = _cosine(embedding, query_norm, candidate["embedding"], candidate["embedding_norm"])
+                if score >= best_score:
+                    best_entry, best_score = candidate, score
+            return best_entry
+
+    def store(self, namespace, query, embedding, answer, page_refs, context="", version=0):
+        """Salva una risposta, version è la versione dell'indice letta prima di calcolarla."""
+        key = normalize_query(query)
+        with self._lock:
+            current = self._namespaces.get(namespace)
+            if current is not None and current[0] > version:
+                # l'indice è stato aggiornato mentre la risposta veniva calcolata
+                return
+            entries = self._entries(namespace, version)
+            if entries is None:
+                entries = OrderedDict()
+                self._namespaces[namespace] = (version, entries)
+            entries[key] = {
+                "answer": answer,
+                "page_refs": page_refs,
+                "context": context,
+                "embedding": embedding,
+                "embedding_norm": _norm(embedding) if embedding is not None else 0.0,
+                "expires_at": time.time() + self.ttl,
+            }
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_namespace:
+                entries.popitem(last=False)
+
+    def _entries(self, namespace, version):
+        # voci del namespace per questa versione dell'indice, quelle di una versione diversa vengono scartate
+        current = self._namespaces.get(namespace)
+        if current is None:
+            return None
+        if current[0] != version:
+            if current[0] < version:
+                del self._namespaces[namespace]
+            return None
+        return current[1]
+
+    def invalidate(self, namespace):
+        """Svuota la cache di un namespace solo in questo processo, vedi invalidate_answers."""
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+
+    def clear(self):
+        with self._lock:
+            self._namespaces.clear()
+
+
+def normalize_query(query):
+    """Normalizza la query: minuscolo, spazi compattati e senza punteggiatura finale."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!.;: ")
+
+def _norm(vector):
+    return math.sqrt(sum(v * v for v in vector))
+
+def _cosine(a, a_norm, b, b_norm):
+    if b is None or not a_norm or not b_norm or len(a) != len(b):
+        return 0.0
+    return sum(x * y for x, y in zip(a, b)) / (a_norm * b_norm)
+
+
+def get_index_version(namespace):
+    """Restituisce la versione dell'indice del namespace, condivisa da tutti i worker tramite MongoDB."""
+    from .db import rag_index_versions_collection
+
+    document = rag_index_versions_collection.find_one({"_id": namespace}, {"version": 1})
+    return document.get("version", 0) if document else 0
+
+def invalidate_answers(namespace):
+    """Invalida le risposte in cache del namespace in tutti i worker (rulebook re-indicizzato o cancellato)."""
+    from .db import rag_index_versions_collection
+
+    rag_index_versions_collection.update_one({"_id": namespace}, {"$inc": {"version": 1}}, upsert=True)
+    answer_cache.invalidate(namespace)
+
+
+embedding_cache = EmbeddingCache(max_size=int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", "1024")))
+answer_cache = AnswerCache(
+    ttl=int(os.getenv("RAG_ANSWER_CACHE_TTL", "86400")),
+    max_entries_per_namespace=int(os.getenv("RAG_ANSWER_CACHE_SIZE", "128")),
+    similarity_threshold=float(os.getenv("RAG_ANSWER_CACHE_SIMILARITY", "0.95")),
+)
@@ -1,36 +1,113 @@
 import os
+import time
+import threading
 import boto3
 import botocore
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 
 S3_ENDPOINT = os.getenv("S3_ENDPOINT")
 S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
 S3_SECRET_KEY = os.getenv("S3_SECRET_KEY")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 
+MB = 1024 * 1024
+
+# Multipart settings for server-side transfers: files above the threshold are sent in parallel parts
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8")) * MB,
+    multipart_chunksize=int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8")) * MB,
+    max_concurrency=int(os.getenv("S3_MAX_CONCURRENCY", "10")),
+    use_threads=True
+)
+
+# Connection pool shared by all the threads of a worker: it should cover the request threads
+# plus the parallel multipart transfers, or requests end up waiting for a free connection
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50")),
+    connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("S3_READ_TIMEOUT", "60")),
+    retries={"max_attempts": int(os.getenv("S3_MAX_RETRIES", "5")), "mode": "standard"},
+    tcp_keepalive=True
+)
+
+# delete_objects accepts at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+
+# Presigned direct uploads from the browser
+S3_PRESIGNED_EXPIRES = int(os.getenv("S3_PRESIGNED_EXPIRES", "900"))
+S3_PRESIGNED_MAX_SIZE = int(os.getenv("S3_PRESIGNED_MAX_SIZE_MB", "300")) * MB
+
 class S3Client:
     client = None
+    _lock = threading.Lock()
 
     def get_client():
         if S3Client.client is not None:
             return S3Client.client
-        S3Client.client = boto3.client(
-            "s3",
-            endpoint_url=f"{S3_ENDPOINT}",
-            aws_access_key_id=S3_ACCESS_KEY,
-            aws_secret_access_key=S3_SECRET_KEY,
-        )
+        with S3Client._lock:
+            # Another thread may have created the client while this one was waiting
+            if S3Client.client is not None:
+                return S3Client.client
 
-        try:
-            S3Client.client.head_bucket(Bucket=S3_BUCKET_NAME)
-        except botocore.exceptions.ClientError as e:
-            error_code = e.response["Error"]["Code"]
-            if error_code == "404":
-                S3Client.client.create_bucket(Bucket=S3_BUCKET_NAME)
+            client = boto3.client(
+                "s3",
+                endpoint_url=f"{S3_ENDPOINT}",
+                aws_access_key_id=S3_ACCESS_KEY,
+                aws_secret_access_key=S3_SECRET_KEY,
+                config=S3_CLIENT_CONFIG
+            )
+
+            try:
+                client.head_bucket(Bucket=S3_BUCKET_NAME)
+            except botocore.exceptions.ClientError as e:
+                error_code = e.response["Error"]["Code"]
+                if error_code == "404":
+                    client.create_bucket(Bucket=S3_BUCKET_NAME)
+
+            # Published only once the bucket is known to exist
+            S3Client.client = client
         return S3Client.client
+
+    def reset():
+        """Forget the client, e.g. in a worker forked from a process that already created it."""
+        S3Client._lock = threading.Lock()
+        S3Client.client = None
+
+    def warm_up():
+        """Create the client and open the first connection in a background thread.
+        
+        Returns:
+            The started thread
+        """
+        def run():
+            try:
+                S3Client.get_client()
+                print("S3 client ready")
+            except Exception as e:
+                print(f"Error warming up S3 client: {str(e)}")
+
+        thread = threading.Thread(target=run, name="s3-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def health_check():
+        """Check that the bucket is reachable.
+        
+        Returns:
+            A dict with 'ok', the round trip 'latency_ms' and the 'error' if the check failed
+        """
+        start = time.perf_counter()
+        try:
+            client = S3Client.get_client()
+            client.head_bucket(Bucket=S3_BUCKET_NAME)
+            return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 1), "error": None}
+        except Exception as e:
+            return {"ok": False, "latency_ms": round((time.perf_counter() - start) * 1000, 1), "error": str(e)}
     
     def put(file, file_name, content_type="application/octet-stream"):
         client = S3Client.get_client()
-        client.upload_fileobj(file, S3_BUCKET_NAME, file_name, ExtraArgs={"ContentType": content_type})
+        client.upload_fileobj(file, S3_BUCKET_NAME, file_name, ExtraArgs={"ContentType": content_type}, Config=TRANSFER_CONFIG)
         return file_name
         #return f"{S3_ENDPOINT}/{S3_BUCKET_NAME}/{file_name}"
     
@@ -66,8 +143,98 @@ class S3Client:
         """
         try:
             client = S3Client.get_client()
-            client.download_file(S3_BUCKET_NAME, file_name, local_path)
+            client.download_file(S3_BUCKET_NAME, file_name, local_path, Config=TRANSFER_CONFIG)
             return True
         except Exception as e:
             print(f"Error downloading file from S3: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    def get_object(file_name):
+        """Open an object of the S3 bucket for streaming reads.
+        
+        Args:
+            file_name: The key/name of the file in the S3 bucket
+            
+        Returns:
+            The streaming body of the object, raises a ClientError if it does not exist
+        """
+        client = S3Client.get_client()
+        return client.get_object(Bucket=S3_BUCKET_NAME, Key=file_name)["Body"]
+
+    def generate_presigned_upload(file_name, content_type, expires_in=S3_PRESIGNED_EXPIRES, max_size=S3_PRESIGNED_MAX_SIZE):
+        """Create a presigned POST that lets a client upload a file directly to the bucket.
+        
+        Args:
+            file_name: The key the file will be stored under
+            content_type: The content type the client must upload
+            expires_in: Seconds the presigned POST stays valid
+            max_size: Maximum accepted size in bytes
+            
+        Returns:
+            A dict with the 'url' to POST to and the form 'fields' to send along with the file
+        """
+        client = S3Client.get_client()
+        return client.generate_presigned_post(
+            S3_BUCKET_NAME,
+            file_name,
+            Fields={"Content-Type": content_type},
+            Conditions=[
+                {"Content-Type": content_type},
+                ["content-length-range", 1, max_size]
+            ],
+            ExpiresIn=expires_in
+        )
+
+    def head(file_name):
+        """Get the metadata of an object in the S3 bucket.
+        
+        Args:
+            file_name: The key/name of the file in the S3 bucket
+            
+        Returns:
+            A dict with the object's 'size' and 'content_type', or None if it does not exist
+        """
+        try:
+            client = S3Client.get_client()
+            response = client.head_object(Bucket=S3_BUCKET_NAME, Key=file_name)
+            return {"size": response["ContentLength"], "content_type": response.get("ContentType")}
+        except botocore.exceptions.ClientError:
+            return None
+
+    def delete_many(file_names):
+        """Delete several objects from the S3 bucket with batched delete_objects calls.
+        
+        Args:
+            file_names: The keys/names of the files in the S3 bucket
+            
+        Returns:
+            The list of keys that could not be deleted
+        """
+        client = S3Client.get_client()
+        file_names = list(file_names)
+        failed = []
+        for start in range(0, len(file_names), DELETE_BATCH_SIZE):
+            batch = file_names[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = client.delete_objects(
+                    Bucket=S3_BUCKET_NAME,
+                    Delete={"Objects": [{"Key": name} for name in batch], "Quiet": True}
+                )
+                # In quiet mode only the failures are listed
+                failed.extend(error["Key"] for error in response.get("Errors", []))
+            except Exception as e:
+                print(f"Error deleting files from S3: {str(e)}")
+                failed.extend(batch)
+        return failed
+
+    def list_objects():
+        """List all the objects in the S3 bucket.
+        
+        Returns:
+            A generator of (key, last_modified) tuples
+        """
+        client = S3Client.get_client()
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=S3_BUCKET_NAME):
+            for obj in page.get("Contents", []):
+                yield obj["Key"], obj["LastModified"]
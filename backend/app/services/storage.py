@@ -0,0 +1,439 @@
+import io
+import os
+import uuid
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import botocore
+
+from .s3 import S3Client
+
+
+# Read size used when hashing and copying streams
+CHUNK_SIZE = 1024 * 1024
+
+# With content-addressed names identical files (badges, re-uploaded photos) are stored once
+STORAGE_DEDUP = os.getenv("STORAGE_DEDUP", "True").lower() in ["true", "1", "t"]
+# Base URL of a CDN in front of the bucket, replaces the S3 endpoint in the file URLs
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "").rstrip("/")
+
+
+# Common interface for the backends storing the uploaded files
+class StorageBackend(ABC):
+    # stored in the 'type' field of the file references saved on the documents
+    type = None
+    # whether clients can upload directly with presigned_upload
+    supports_direct_upload = False
+
+    def __init__(self, dedup=STORAGE_DEDUP):
+        self.dedup = dedup
+
+    @abstractmethod
+    def save(self, stream, name, content_type="application/octet-stream"):
+        """Store a file-like object under the given name.
+
+        Returns:
+            The reference to store on the documents
+        """
+        pass
+
+    @abstractmethod
+    def open(self, name):
+        """Open a stored file for streaming reads.
+
+        Returns:
+            A readable file-like object, or None if the file does not exist
+        """
+        pass
+
+    @abstractmethod
+    def head(self, name):
+        """Get the metadata of a stored file.
+
+        Returns:
+            A dict with 'size' and 'content_type', or None if the file does not exist
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, name):
+        """Delete a stored file, returns True on success."""
+        pass
+
+    @abstractmethod
+    def url(self, name):
+        """Return the URL clients use to fetch a stored file."""
+        pass
+
+    @abstractmethod
+    def list_objects(self):
+        """Return a generator of (name, last_modified) tuples for all the stored files."""
+        pass
+
+    @abstractmethod
+    def health_check(self):
+        """Return a dict with 'ok' and the 'error' if the storage is not usable."""
+        pass
+
+    def put(self, stream, filename, content_type="application/octet-stream", dedup=None):
+        """Store an uploaded file under a new unique name.
+
+        Args:
+            stream: A readable file-like object
+            filename: The original filename, kept in the name for readability
+            content_type: The content type of the file
+            dedup: Name the file after the hash of its content and skip the write if it
+                is already stored, defaults to the backend setting
+
+        Returns:
+            The reference to store on the documents
+        """
+        dedup = self.dedup if dedup is None else dedup
+        filename = os.path.basename(filename or "file")
+        if not dedup:
+            return self.save(stream, f"{uuid.uuid4()}_{filename}", content_type)
+
+        # Hash while spooling, so the stream is read only once
+        digest = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE) as spooled:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                spooled.write(chunk)
+
+            _, extension = os.path.splitext(filename)
+            name = f"{digest.hexdigest()}{extension.lower()}"
+            if self.exists(name):
+                return self.reference(name)
+            spooled.seek(0)
+            return self.save(spooled, name, content_type)
+
+    def reference(self, name):
+        """Return the reference stored on the documents for a name."""
+        return name
+
+    def exists(self, name):
+        return self.head(name) is not None
+
+    def delete_many(self, names):
+        """Delete several stored files.
+
+        Returns:
+            The list of names that could not be deleted
+        """
+        return [name for name in names if not self.delete(name)]
+
+    def urls(self, names):
+        """Resolve the URLs of several stored files at once, in the same order."""
+        return [self.url(name) if name else None for name in names]
+
+    def download(self, name, local_path):
+        """Copy a stored file to a local path, returns False if it does not exist."""
+        stream = self.open(name)
+        if stream is None:
+            return False
+        try:
+            with open(local_path, "wb") as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        finally:
+            stream.close()
+        return True
+
+    @contextmanager
+    def local_copy(self, name, suffix=""):
+        """Give a local path to a stored file for the duration of the block.
+
+        Yields:
+            The local path, or None if the file does not exist
+        """
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file_path = temp_file.name
+        try:
+            yield temp_file_path if self.download(name, temp_file_path) else None
+        finally:
+            os.remove(temp_file_path)
+
+    def presigned_upload(self, name, content_type):
+        """Create a presigned upload letting a client store the file directly, see supports_direct_upload.
+
+        Returns:
+            A dict with the 'url' to POST to and the form 'fields' to send along with the file
+
+        Raises:
+            ValueError: if the backend does not support direct uploads
+        """
+        raise ValueError(f"Direct uploads are not supported by {self.type} storage")
+
+    def warm_up(self):
+        pass
+
+
+class LocalStorage(StorageBackend):
+    type = "local"
+
+    def __init__(self, upload_folder, dedup=STORAGE_DEDUP):
+        super().__init__(dedup)
+        self.upload_folder = upload_folder
+        # Create the upload folder if it doesn't exist
+        os.makedirs(upload_folder, exist_ok=True)
+
+    def _path(self, name):
+        # The documents store the full path, older ones possibly from another folder
+        return os.path.join(self.upload_folder, os.path.basename(name))
+
+    def reference(self, name):
+        return self._path(name)
+
+    def save(self, stream, name, content_type="application/octet-stream"):
+        path = self._path(name)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        return path
+
+    def open(self, name):
+        path = self._path(name)
+        if not os.path.isfile(path):
+            return None
+        return open(path, "rb")
+
+    def head(self, name):
+        path = self._path(name)
+        if not os.path.isfile(path):
+            return None
+        return {"size": os.path.getsize(path), "content_type": mimetypes.guess_type(path)[0]}
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+            return True
+        except OSError as e:
+            print(f"Error deleting local file: {str(e)}")
+            return False
+
+    def url(self, name):
+        return f"/uploads/{os.path.basename(name)}"
+
+    def list_objects(self):
+        for entry in os.scandir(self.upload_folder):
+            if entry.is_file():
+                yield entry.name, datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc)
+
+    def health_check(self):
+        writable = os.path.isdir(self.upload_folder) and os.access(self.upload_folder, os.W_OK)
+        return {"ok": writable, "error": None if writable else "Upload folder is not writable"}
+
+    @contextmanager
+    def local_copy(self, name, suffix=""):
+        # The file is already on disk, no copy needed
+        path = self._path(name)
+        yield path if os.path.isfile(path) else None
+
+
+class S3Storage(StorageBackend):
+    type = "s3"
+    supports_direct_upload = True
+
+    def __init__(self, public_url=STORAGE_PUBLIC_URL, dedup=STORAGE_DEDUP):
+        super().__init__(dedup)
+        self.public_url = public_url
+
+    def save(self, stream, name, content_type="application/octet-stream"):
+        return S3Client.put(stream, name, content_type=content_type)
+
+    def open(self, name):
+        try:
+            return S3Client.get_object(name)
+        except botocore.exceptions.ClientError:
+            return None
+
+    def head(self, name):
+        return S3Client.head(name)
+
+    def delete(self, name):
+        return S3Client.delete(name)
+
+    def delete_many(self, names):
+        return S3Client.delete_many(names)
+
+    def url(self, name):
+        if self.public_url:
+            return f"{self.public_url}/{name}"
+        return S3Client.get_url_from_filename(name)
+
+    def download(self, name, local_path):
+        return S3Client.download(name, local_path)
+
+    def list_objects(self):
+        return S3Client.list_objects()
+
+    def health_check(self):
+        return S3Client.health_check()
+
+    def presigned_upload(self, name, content_type):
+        return S3Client.generate_presigned_upload(name, content_type)
+
+    def warm_up(self):
+        S3Client.warm_up()
+
+
+class MemoryStorage(StorageBackend):
+    """Keeps the files in a dict, for tests and benchmarks."""
+    type = "memory"
+
+    def __init__(self, dedup=STORAGE_DEDUP):
+        super().__init__(dedup)
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def save(self, stream, name, content_type="application/octet-stream"):
+        data = stream.read()
+        with self._lock:
+            self.files[name] = (data, content_type, datetime.now(timezone.utc))
+        return name
+
+    def open(self, name):
+        with self._lock:
+            stored = self.files.get(name)
+        return io.BytesIO(stored[0]) if stored is not None else None
+
+    def head(self, name):
+        with self._lock:
+            stored = self.files.get(name)
+        return {"size": len(stored[0]), "content_type": stored[1]} if stored is not None else None
+
+    def delete(self, name):
+        with self._lock:
+            return self.files.pop(name, None) is not None
+
+    def url(self, name):
+        return f"memory://{name}"
+
+    def list_objects(self):
+        with self._lock:
+            items = [(name, stored[2]) for name, stored in self.files.items()]
+        return iter(items)
+
+    def health_check(self):
+        return {"ok": True, "error": None}
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+_upload_folder = None
+
+
+def init_storage(upload_folder):
+    """Set the folder used by the local backend, called once when the app is created."""
+    global _upload_folder
+    _upload_folder = upload_folder
+
+def create_storage_backend(storage_type):
+    """Create a storage backend of the given type."""
+    if storage_type == "local":
+        if _upload_folder is None:
+            raise ValueError("Local storage used before init_storage")
+        return LocalStorage(_upload_folder)
+    elif storage_type == "s3":
+        return S3Storage()
+    elif storage_type == "memory":
+        return MemoryStorage()
+    else:
+        raise ValueError(f"Unsupported storage type: {storage_type}")
+
+def get_storage(storage_type=None):
+    """Return the shared backend for a storage type, STORAGE_TYPE by default.
+
+    Documents keep the type of the backend their files were stored with, so
+    files saved before a change of STORAGE_TYPE are still resolved.
+    """
+    storage_type = storage_type or os.getenv("STORAGE_TYPE", "local")
+    backend = _backends.get(storage_type)
+    if backend is not None:
+        return backend
+    with _backends_lock:
+        if storage_type not in _backends:
+            _backends[storage_type] = create_storage_backend(storage_type)
+        return _backends[storage_type]
+
+def resolve_urls(files):
+    """Resolve the URLs of several file references in one pass.
+
+    Args:
+        files: A list of {'type', 'filename'} references, None entries are allowed
+
+    Returns:
+        The list of URLs, in the same order
+    """
+    urls = [None] * len(files)
+    by_type = {}
+    for position, file in enumerate(files):
+        if file and file.get("filename"):
+            by_type.setdefault(file["type"], []).append(position)
+    for storage_type, positions in by_type.items():
+        resolved = get_storage(storage_type).urls([files[position]["filename"] for position in positions])
+        for position, url in zip(positions, resolved):
+            urls[position] = url
+    return urls
+
+def resolve_url(file):
+    return resolve_urls([file])[0]
+
+def with_url(file):
+    """Return a copy of a file reference with its resolved 'url', computed once when the file is stored."""
+    if not file or not file.get("filename"):
+        return file
+    return dict(file, url=resolve_url(file))
+
+def refresh_stored_urls():
+    """Recompute the URLs stored on the documents, after a change of S3_ENDPOINT or STORAGE_PUBLIC_URL.
+
+    Returns:
+        A dict with the number of updated documents per collection
+    """
+    from pymongo import UpdateOne
+    from .db import achievements_collection, players_collection, matches_collection, rulebooks_collection
+
+    updates = {"achievements": [], "players": [], "matches": [], "rulebooks": []}
+
+    for achievement in achievements_collection.find({}, {"image": 1, "badges": 1}):
+        fields = {}
+        if achievement.get("image"):
+            fields["image"] = with_url(achievement["image"])
+        if achievement.get("badges"):
+            fields["badges"] = {level: with_url(badge) for level, badge in achievement["badges"].items()}
+        if fields:
+            updates["achievements"].append(UpdateOne({"_id": achievement["_id"]}, {"$set": fields}))
+
+    for player in players_collection.find({"achievements.0": {"$exists": True}}, {"achievements": 1}):
+        achievements = [dict(achievement, image=with_url(achievement.get("image"))) for achievement in player["achievements"]]
+        updates["players"].append(UpdateOne({"_id": player["_id"]}, {"$set": {"achievements": achievements}}))
+
+    for match in matches_collection.find({"image": {"$exists": True}}, {"image": 1}):
+        image = match["image"]
+        fields = {"image.url": resolve_url(image)}
+        for variant in ["thumbnail", "webp"]:
+            if image.get(variant):
+                fields[f"image.{variant}_url"] = resolve_url({"type": image["type"], "filename": image[variant]})
+        updates["matches"].append(UpdateOne({"_id": match["_id"]}, {"$set": fields}))
+
+    # Rulebooks keep only their URL, stored with the current backend
+    storage = get_storage()
+    for rulebook in rulebooks_collection.find({"file_url": {"$nin": [None, ""]}}, {"file_url": 1}):
+        file_url = storage.url(rulebook["file_url"].split("/")[-1])
+        updates["rulebooks"].append(UpdateOne({"_id": rulebook["_id"]}, {"$set": {"file_url": file_url}}))
+
+    collections = {
+        "achievements": achievements_collection,
+        "players": players_collection,
+        "matches": matches_collection,
+        "rulebooks": rulebooks_collection
+    }
+    counts = {}
+    for name, operations in updates.items():
+        counts[name] = collections[name].bulk_write(operations, ordered=False).modified_count if operations else 0
+    return counts
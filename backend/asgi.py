@@ -0,0 +1,31 @@
+"""ASGI entry point.
+
+Serves the I/O-bound endpoints (BGG proxy, rulebook chat) natively async,
+so a single process can keep hundreds of them in flight, and every other
+route through the existing Flask app running in a thread pool:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The WSGI mode (flask run / gunicorn run:app) keeps working unchanged.
+"""
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+
+flask_app = create_app()
+
+# Imported after create_app, which loads the environment and the Flask routes
+from app.async_routes import create_async_app, ASYNC_PATHS
+
+async_app = create_async_app(flask_app)
+# Threads running the Flask (sync) routes
+wsgi_app = WSGIMiddleware(flask_app, workers=int(os.getenv('ASGI_WSGI_THREADS', '16')))
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan' or (scope['type'] == 'http' and scope['path'] in ASYNC_PATHS):
+        await async_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
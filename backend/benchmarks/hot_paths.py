@@ -0,0 +1,200 @@
+"""Micro-benchmarks of the per-match hot paths at increasing history sizes.
+
+Times check_update_achievements() and a full /logmatch request, which recomputes the
+game's average_score over all of game['matches'], for players and a game that already
+have 100, 1k and 10k matches. Runs on mongomock (pip install mongomock) with in-memory
+storage, so no database or network is needed.
+
+    cd backend
+    python -m benchmarks.hot_paths --output hot_paths.json
+    python -m benchmarks.hot_paths --baseline hot_paths.json
+
+The per-call time growing about 10x for 10x the history means the path is O(n) in the
+history size. The run fails (exit code 1) when the growth of a benchmark between two
+consecutive sizes exceeds --max-growth, or --max-regression times the growth recorded in
+the --baseline report, so a path getting more expensive per match is caught before deploying.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+# Isolated settings, set before the app modules read them
+os.environ["STORAGE_TYPE"] = "memory"
+os.environ["ENABLE_RAG"] = "False"
+os.environ["QUERY_PROFILING_ENABLED"] = "False"
+os.environ.setdefault("DB_NAME", "meeplestats_benchmark")
+
+from app.services import db as db_service
+from benchmarks.synthetic_data import make_players, make_games, make_matches
+
+DEFAULT_SIZES = [100, 1000, 10000]
+
+
+def create_flask_app():
+    # Only the data blueprint, create_app() would load the .env over the settings above
+    from flask import Flask
+    from flask_jwt_extended import JWTManager
+    from app.services.storage import init_storage
+
+    backend_app = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+    flask_app = Flask("app", root_path=backend_app)
+    flask_app.config["JWT_SECRET_KEY"] = "benchmark-secret-key-of-sufficient-length"
+    flask_app.config["JWT_TOKEN_LOCATION"] = ["headers"]
+    JWTManager(flask_app)
+    init_storage(os.path.join(backend_app, "uploads"))
+
+    from app.routes import data_bp
+    flask_app.register_blueprint(data_bp)
+    return flask_app
+
+def seed(history_size, flask_app, rng):
+    """Reset the database and create 2 players and 1 game sharing history_size matches."""
+    from app.services.achievements_setup import create_achievements
+
+    db_service.get_client().drop_database(os.environ["DB_NAME"])
+    players = make_players(2, "benchmark")
+    games = make_games(1, rng, coop_ratio=0)
+    matches = make_matches(history_size, players, games, rng)
+    db_service.players_collection.insert_many(players)
+    db_service.games_collection.insert_many(games)
+    db_service.matches_collection.insert_many(matches)
+    with flask_app.app_context():
+        create_achievements()
+    return players, games[0], matches[-1]
+
+def _log_match_form(players, game, rng):
+    form = {
+        "date": time.strftime("%Y-%m-%d"),
+        "duration": "60",
+        "game": game["name"],
+        "game_id": game["bgg_id"],
+        "note": "",
+    }
+    for index, player in enumerate(players):
+        form[f"players[{index}][id]"] = str(player["_id"])
+        form[f"players[{index}][name]"] = player["username"]
+        form[f"players[{index}][score]"] = str(rng.randint(20, 120))
+    return form
+
+
+def _measure(call, repeat, warmup):
+    for _ in range(warmup):
+        call()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min_ms": round(min(timings) * 1000, 3),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        "stddev_ms": round(statistics.stdev(timings) * 1000, 3) if len(timings) > 1 else 0.0,
+        "rounds": repeat,
+    }
+
+def run(sizes, repeat, warmup, seed_value=42):
+    from flask_jwt_extended import create_access_token
+    from app.services.achievements_management import check_update_achievements
+
+    flask_app = create_flask_app()
+    client = flask_app.test_client()
+    rng = random.Random(seed_value)
+    results = {"check_update_achievements": {}, "log_match": {}}
+
+    for size in sizes:
+        players, game, last_match = seed(size, flask_app, rng)
+        player_ids = [str(player["_id"]) for player in players]
+        results["check_update_achievements"][str(size)] = _measure(
+            lambda: check_update_achievements(player_ids, last_match), repeat, warmup)
+
+        with flask_app.app_context():
+            headers = {"Authorization": f"Bearer {create_access_token(identity=players[0]['username'])}"}
+
+        def log_match():
+            resp = client.post("/logmatch", data=_log_match_form(players, game, rng), headers=headers)
+            if resp.status_code != 201:
+                raise RuntimeError(f"/logmatch returned {resp.status_code}: {resp.get_data(as_text=True)}")
+        # Each call adds a match, negligible next to the seeded history
+        results["log_match"][str(size)] = _measure(log_match, repeat, warmup)
+        print(f"{size} matches: " + ", ".join(f"{name} {timings[str(size)]['median_ms']}ms" for name, timings in results.items()), file=sys.stderr)
+
+    return results
+
+def growth(results):
+    """Ratio of the median time between consecutive sizes, normalized to a 10x history step."""
+    factors = {}
+    for name, timings in results.items():
+        sizes = sorted(int(size) for size in timings)
+        factors[name] = {}
+        for small, large in zip(sizes, sizes[1:]):
+            ratio = timings[str(large)]["median_ms"] / timings[str(small)]["median_ms"]
+            # e.g. a 100 -> 1000 step is already 10x; other steps are rescaled in log space
+            factors[name][f"{small}->{large}"] = round(ratio ** (1 / math.log10(large / small)), 2)
+    return factors
+
+def check(factors, max_growth, baseline=None, max_regression=None):
+    failures = []
+    for name, steps in factors.items():
+        for step, factor in steps.items():
+            if max_growth is not None and factor > max_growth:
+                failures.append(f"{name} {step}: grows {factor}x per 10x history, limit {max_growth}x")
+            previous = (baseline or {}).get(name, {}).get(step)
+            if previous and max_regression is not None and factor > previous * max_regression:
+                failures.append(f"{name} {step}: grows {factor}x per 10x history, baseline {previous}x (limit {max_regression}x of it)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark the achievement evaluation and match logging hot paths")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="comma-separated history sizes")
+    parser.add_argument("--repeat", type=int, default=10, help="measured rounds per size")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured rounds per size")
+    parser.add_argument("--max-growth", type=float, default=25.0,
+                        help="max time growth per 10x history: 10 is linear, an O(n^2) path grows about 100x; "
+                             "the margin absorbs mongomock's own overhead")
+    parser.add_argument("--baseline", help="previous JSON report to compare the growth factors against")
+    parser.add_argument("--max-regression", type=float, default=1.5, help="max growth factor relative to the baseline")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        import mongomock
+    except ImportError:
+        print("mongomock is required: pip install mongomock", file=sys.stderr)
+        return 2
+    db_service.configure_client(lambda: mongomock.MongoClient())
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    results = run(sizes, args.repeat, args.warmup)
+    factors = growth(results)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["growth_per_10x"]
+    failures = check(factors, args.max_growth, baseline, args.max_regression)
+
+    report = {
+        "settings": {"sizes": sizes, "repeat": args.repeat, "max_growth": args.max_growth},
+        "results": results,
+        "growth_per_10x": factors,
+        "failures": failures,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
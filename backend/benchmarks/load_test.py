@@ -0,0 +1,245 @@
+"""Load driver for the MeepleStats HTTP endpoints.
+
+Runs every endpoint in turn at a fixed concurrency against a running backend and reports
+p50/p95/p99 latency, error count and throughput per endpoint, as JSON for later comparison.
+Fill the database with benchmarks.synthetic_data first.
+
+    cd backend
+    python -m benchmarks.synthetic_data --players 50 --games 200 --matches 20000 --reset
+    python -m benchmarks.load_test --base-url http://localhost:5000 --concurrency 8 --requests 200 \\
+        --output after.json --compare before.json
+
+The read endpoints (/games, /matchHistory, every statistic route) are run first, then
+/logmatch, which writes: run the generator again with --reset to start from the same data.
+"""
+import argparse
+import itertools
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+
+# (name, path, query parameters built from the fixtures)
+READ_ENDPOINTS = [
+    ("games", "/games", lambda f: {}),
+    ("matchHistory", "/matchHistory", lambda f: {}),
+    ("totHours", "/totHours", lambda f: {}),
+    ("totMatches", "/totMatches", lambda f: {}),
+    ("playerWins", "/playerWins", lambda f: {"username": f.username()}),
+    ("playerWinRate", "/playerWinRate", lambda f: {"username": f.username()}),
+    ("playerLongWinstreak", "/playerLongWinstreak", lambda f: {"username": f.username()}),
+    ("playerHighestWinRate", "/playerHighestWinRate", lambda f: {"year": datetime.now().year}),
+    ("playerGameWins", "/playerGameWins", lambda f: {"username": f.username()}),
+    ("gameCoopWinRate", "/gameCoopWinRate", lambda f: {}),
+    ("gameNumMatch", "/gameNumMatch", lambda f: {}),
+    ("gameAvgDuration", "/gameAvgDuration", lambda f: {}),
+    ("gameBestValue", "/gameBestValue", lambda f: {}),
+    ("gameHighestScore", "/gameHighestScore", lambda f: {"game_name": f.game_name()}),
+    ("gameAvgScore", "/gameAvgScore", lambda f: {"game_name": f.game_name()}),
+]
+
+
+class Fixtures:
+    """Players and games read from the backend, used to build realistic requests."""
+
+    def __init__(self, players, games, seed):
+        self.players = players
+        self.games = [game for game in games if game.get("type", "base") == "base"]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def username(self):
+        with self._lock:
+            return self._rng.choice(self.players)["username"]
+
+    def game_name(self):
+        with self._lock:
+            return self._rng.choice(self.games)["name"]
+
+    def match_form(self):
+        # Same form fields as the frontend's match logging
+        with self._lock:
+            game = self._rng.choice(self.games)
+            seated = self._rng.sample(self.players, self._rng.randint(2, min(5, len(self.players))))
+            form = {
+                "date": datetime.now().strftime("%Y-%m-%d"),
+                "duration": str(self._rng.randint(20, 150)),
+                "game": game["name"],
+                "game_id": game["bgg_id"],
+                "note": "load test",
+                "isWin": str(self._rng.random() < 0.5).lower(),
+                "isTeamMatch": "false",
+            }
+            for index, player in enumerate(seated):
+                form[f"players[{index}][id]"] = player["_id"]
+                form[f"players[{index}][name]"] = player["username"]
+                form[f"players[{index}][score]"] = str(self._rng.randint(20, 120))
+        return form
+
+
+def login(base_url, username, password, cookie_name):
+    """Return a session authenticated as the given user."""
+    session = requests.Session()
+    resp = session.post(f"{base_url}/login", json={"username": username, "password": password}, timeout=30)
+    resp.raise_for_status()
+    token = resp.json().get("jwt_token")
+    if token:
+        # JWT_STORAGE=localstorage
+        session.headers["Authorization"] = f"Bearer {token}"
+    else:
+        # JWT_STORAGE=cookie: the cookie is marked secure, set it again so it is sent over plain HTTP too
+        token = resp.cookies.get("jwt_token")
+        if not token:
+            raise RuntimeError("Login returned neither a token nor a jwt_token cookie")
+        session.cookies.set(cookie_name, token)
+    return session
+
+def load_fixtures(session, base_url, seed):
+    players = session.get(f"{base_url}/players", timeout=60).json()
+    games = session.get(f"{base_url}/games", timeout=60).json()
+    if len(players) < 2 or not games:
+        raise RuntimeError("The database needs at least 2 players and 1 game, run benchmarks.synthetic_data first")
+    return Fixtures(players, games, seed)
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def _summary(latencies, errors, wall_seconds):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+def run_endpoint(session, send, requests_count, concurrency, warmup):
+    """Send requests_count requests with concurrency workers and summarize their latency.
+
+    Args:
+        send: Callable sending one request with the session and returning the response
+    """
+    for _ in range(warmup):
+        send(session)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def worker():
+        nonlocal errors
+        while next(counter) < requests_count:
+            start = time.perf_counter()
+            try:
+                ok = send(session).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return _summary(latencies, errors, time.perf_counter() - start)
+
+
+def compare(report, baseline):
+    """Print the p50/p95/p99 change of every endpoint against a previous report."""
+    print(f"{'endpoint':<22} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous is None:
+            continue
+        cells = []
+        for key in ["p50_ms", "p95_ms", "p99_ms"]:
+            change = (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+            cells.append(f"{current[key]:>9.1f} ({change:+5.1f}%)")
+        print(f"{name:<22} " + " ".join(cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the MeepleStats endpoints")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--username", default="bench_player_0")
+    parser.add_argument("--password", default="benchmark")
+    parser.add_argument("--cookie-name", default="jwt_token", help="JWT_ACCESS_COOKIE_NAME of the backend, with JWT_STORAGE=cookie")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured requests per endpoint")
+    parser.add_argument("--log-match-requests", type=int, help="requests for /logmatch, defaults to --requests, 0 to skip")
+    parser.add_argument("--endpoints", help="comma-separated subset of the endpoint names to run")
+    parser.add_argument("--setup-achievements", action="store_true", help="call /setupAchievements first, so /logmatch evaluates them")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    base_url = args.base_url.rstrip("/")
+    session = login(base_url, args.username, args.password, args.cookie_name)
+    # One connection per worker thread
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if args.setup_achievements:
+        session.get(f"{base_url}/setupAchievements", timeout=300).raise_for_status()
+    fixtures = load_fixtures(session, base_url, args.seed)
+
+    selected = set(args.endpoints.split(",")) if args.endpoints else None
+    endpoints = {}
+    for name, path, params in READ_ENDPOINTS:
+        if selected and name not in selected:
+            continue
+        send = lambda s, path=path, params=params: s.get(f"{base_url}{path}", params=params(fixtures), timeout=120)
+        endpoints[name] = run_endpoint(session, send, args.requests, args.concurrency, args.warmup)
+        print(f"{name}: {endpoints[name]}", file=sys.stderr)
+
+    log_match_requests = args.requests if args.log_match_requests is None else args.log_match_requests
+    if log_match_requests and (not selected or "logmatch" in selected):
+        send = lambda s: s.post(f"{base_url}/logmatch", data=fixtures.match_form(), timeout=120)
+        endpoints["logmatch"] = run_endpoint(session, send, log_match_requests, args.concurrency, 0)
+        print(f"logmatch: {endpoints['logmatch']}", file=sys.stderr)
+
+    report = {
+        "settings": {
+            "base_url": base_url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "players": len(fixtures.players),
+            "games": len(fixtures.games),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "endpoints": endpoints,
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Offline benchmark for the rulebook RAG pipeline.
+
+Indexes sample PDFs into an in-memory stand-in for Pinecone, replays a set
+of questions with their expected pages and reports indexing throughput,
+per-stage query latency and recall@k. The LLM is stubbed, and with
+--embedding hash no model download or network access is needed.
+
+    cd backend
+    python -m benchmarks.rag_benchmark --pdf-dir rulebooks/ --questions benchmarks/rag_questions.example.json
+
+The questions file is a JSON list of
+{"pdf": "file.pdf", "question": "...", "expected_pages": ["3", "4"]}.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+from app.services import rag
+from app.services import keyword_index
+from app.services.chunking import CHUNK_STRATEGIES, get_chunking_settings
+
+
+class InMemoryVectorIndex:
+    """Stand-in for a Pinecone index, implementing the calls made by rag.py."""
+
+    def __init__(self):
+        self.namespaces = {}
+
+    def upsert(self, vectors, namespace):
+        records = self.namespaces.setdefault(namespace, {})
+        for vector in vectors:
+            records[vector["id"]] = (vector["values"], _norm(vector["values"]), vector["metadata"])
+
+    def query(self, vector, top_k, include_metadata=True, namespace=""):
+        query_norm = _norm(vector)
+        scored = []
+        for record_id, (values, norm, metadata) in self.namespaces.get(namespace, {}).items():
+            score = sum(a * b for a, b in zip(vector, values)) / (query_norm * norm) if query_norm and norm else 0.0
+            scored.append({"id": record_id, "score": score, "metadata": metadata})
+        scored.sort(key=lambda match: match["score"], reverse=True)
+        return {"matches": scored[:top_k]}
+
+    def describe_index_stats(self, namespace=None):
+        return {"namespaces": {name: {"vector_count": len(records)} for name, records in self.namespaces.items()}}
+
+    def delete(self, delete_all=False, namespace=""):
+        self.namespaces.pop(namespace, None)
+
+
+class HashEmbeddingProvider(rag.EmbeddingProvider):
+    """Deterministic bag-of-words embeddings, good enough to compare settings fully offline."""
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+
+    def embed(self, text):
+        vector = [0.0] * self.dimension
+        for token in keyword_index.tokenize(text):
+            digest = hashlib.md5(token.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0 if digest[4] % 2 else -1.0
+        return vector
+
+    def get_dimension(self):
+        return self.dimension
+
+
+class StubLLMClient:
+    """Answers instantly, so the benchmark measures only retrieval and context assembly."""
+
+    class _Response:
+        def __init__(self, text):
+            self.message = text
+
+    def chat(self, messages):
+        return self._Response("stub answer")
+
+    def stream_chat(self, messages):
+        yield from ()
+
+
+def _norm(vector):
+    return math.sqrt(sum(v * v for v in vector))
+
+def _use_in_memory_keyword_indexes():
+    # Keep the BM25 indexes in memory instead of MongoDB
+    stored = {}
+
+    def save(namespace, index):
+        stored[namespace] = index
+
+    rag.save_keyword_index = save
+    rag.delete_keyword_index = lambda namespace: stored.pop(namespace, None)
+    keyword_index.load_keyword_index = stored.get
+    # Re-indexing bumps the answer cache version stored in MongoDB, the benchmark never reads cached answers
+    rag.invalidate_answers = lambda namespace: None
+    rag.get_index_version = lambda namespace: 0
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def _summary(values):
+    return {
+        "mean_ms": round(statistics.mean(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(_percentile(values, 50) * 1000, 3),
+        "p95_ms": round(_percentile(values, 95) * 1000, 3),
+    }
+
+
+def run_indexing(pdf_paths, index, embedding_provider, chunking):
+    results = []
+    for pdf_path in pdf_paths:
+        start = time.perf_counter()
+        rag.index_single_pdf(pdf_path, index, embedding_provider, pdf_path, chunking)
+        elapsed = time.perf_counter() - start
+
+        namespace = rag.create_safe_namespace(pdf_path)
+        records = index.namespaces.get(namespace, {})
+        pages = {metadata.get("doc_index", metadata.get("page_label")) for _, _, metadata in records.values()}
+        results.append({
+            "pdf": os.path.basename(pdf_path),
+            "seconds": round(elapsed, 3),
+            "pages": len(pages),
+            "chunks": len(records),
+            "pages_per_second": round(len(pages) / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_second": round(len(records) / elapsed, 2) if elapsed else 0.0,
+        })
+    return results
+
+def run_queries(questions, index, embedding_provider, llm_client, top_k):
+    timings = {"embed": [], "search": [], "assemble": [], "llm": []}
+    recalls = []
+    for item in questions:
+        namespace = rag.create_safe_namespace(item["pdf"])
+        # measure the real embedding cost, not the cache
+        rag.embedding_cache.clear()
+
+        start = time.perf_counter()
+        query_embedding = rag.embed_query(item["question"], embedding_provider)
+        timings["embed"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        matches = rag.hybrid_query_index(item["question"], [namespace], index, embedding_provider,
+                                         top_k=top_k, max_results=top_k, query_embedding=query_embedding)
+        timings["search"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        context, page_refs = rag.display_search_results(matches)
+        timings["assemble"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        rag.query_llm(item["question"], context, page_refs, llm_client)
+        timings["llm"].append(time.perf_counter() - start)
+
+        expected = {str(page) for page in item.get("expected_pages", [])}
+        if expected:
+            retrieved = {ref["page"] for ref in page_refs}
+            recalls.append(len(expected & retrieved) / len(expected))
+
+    return {
+        "questions": len(questions),
+        "latency": {stage: _summary(values) for stage, values in timings.items()},
+        f"recall_at_{top_k}": round(statistics.mean(recalls), 4) if recalls else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the rulebook RAG pipeline")
+    parser.add_argument("--pdf-dir", required=True, help="directory with the sample rulebook PDFs")
+    parser.add_argument("--questions", required=True, help="JSON file with questions and expected pages")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--embedding", choices=["hash", "env"], default="hash",
+                        help="'hash' for offline embeddings, 'env' to use EMBEDDING_TYPE like the backend")
+    parser.add_argument("--chunk-strategy", choices=CHUNK_STRATEGIES, help="defaults to RAG_CHUNK_STRATEGY")
+    parser.add_argument("--chunk-size", type=int, help="defaults to RAG_CHUNK_SIZE")
+    parser.add_argument("--chunk-overlap", type=int, help="defaults to RAG_CHUNK_OVERLAP")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    chunking = get_chunking_settings(args.chunk_strategy, args.chunk_size, args.chunk_overlap)
+    _use_in_memory_keyword_indexes()
+    index = InMemoryVectorIndex()
+    embedding_provider = HashEmbeddingProvider() if args.embedding == "hash" else rag.create_embedding_provider()
+
+    pdf_paths = sorted(
+        os.path.join(args.pdf_dir, name) for name in os.listdir(args.pdf_dir) if name.lower().endswith(".pdf")
+    )
+    with open(args.questions) as f:
+        questions = json.load(f)
+
+    indexing = run_indexing(pdf_paths, index, embedding_provider, chunking)
+    total_seconds = sum(item["seconds"] for item in indexing)
+    report = {
+        "settings": {"top_k": args.top_k, "embedding": args.embedding, "chunking": chunking},
+        "indexing": {
+            "files": indexing,
+            "pages_per_second": round(sum(item["pages"] for item in indexing) / total_seconds, 2) if total_seconds else 0.0,
+            "chunks_per_second": round(sum(item["chunks"] for item in indexing) / total_seconds, 2) if total_seconds else 0.0,
+        },
+        "queries": run_queries(questions, index, embedding_provider, StubLLMClient(), args.top_k),
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Synthetic data generator for the endpoint benchmarks.
+
+Creates N players, M games and K matches in the database of MONGO_URI / DB_NAME, with
+the embedded players.matches and games.matches arrays and the counters that /logmatch
+maintains (wins, winstreaks, record and average scores), so the statistic pipelines
+run against realistic documents.
+
+    cd backend
+    python -m benchmarks.synthetic_data --players 50 --games 200 --matches 20000 --reset
+
+Players are named bench_player_<i> and share the --password, the load driver logs in
+with the first one. --reset drops the players, games, matches and wishlists collections
+first: only point it at a benchmark database.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from werkzeug.security import generate_password_hash
+
+from app.services import db as db_service
+
+COLLECTIONS = ["players", "games", "matches", "wishlists"]
+
+
+def make_players(count, password):
+    # Hashing is slow on purpose, every player shares the same hash
+    password_hash = generate_password_hash(password)
+    return [{
+        "_id": ObjectId(),
+        "username": f"bench_player_{i}",
+        "password": password_hash,
+        "email": f"bench_player_{i}@example.com",
+        "image": "",
+        "created_at": datetime.now(),
+        "achievements": [],
+        "matches": [],
+        "wins": 0,
+        "winstreak": 0,
+        "longest_winstreak": 0,
+        "losses": 0,
+        "total_matches": 0,
+        "num_competitive_win": 0,
+    } for i in range(count)]
+
+def make_games(count, rng, coop_ratio=0.2):
+    games = []
+    for i in range(count):
+        bgg_id = str(900000 + i)
+        gifted = rng.random() < 0.1
+        games.append({
+            "bgg_id": bgg_id,
+            "name": f"Bench Game {i}",
+            "type": "base",
+            "min_players": "2",
+            "max_players": "5",
+            "average_duration": str(rng.choice([30, 45, 60, 90, 120])),
+            "image": {
+                "url": f"https://example.com/games/{bgg_id}.jpg",
+                "thumbnail": f"https://example.com/games/{bgg_id}_thumb.jpg"
+            },
+            "is_cooperative": rng.random() < coop_ratio,
+            "expansions": [],
+            "description": "Synthetic game generated for benchmarks.",
+            "matches": [],
+            "record_score_by_player": {"player_id": "", "score": 0},
+            "average_score": 0,
+            "isGifted": gifted,
+            "price": None if gifted else round(rng.uniform(15, 90), 2),
+            "location": "Shelf",
+        })
+    return games
+
+def make_matches(count, players, games, rng, days=3 * 365, team_ratio=0.1):
+    """Generate the matches and apply to the players and games what /logmatch would."""
+    start_date = datetime.now() - timedelta(days=days)
+    # Most groups play a handful of favourite games
+    game_weights = [1 / (rank + 1) for rank in range(len(games))]
+    matches = []
+
+    # Matches are generated in date order, like they are logged
+    dates = sorted(start_date + timedelta(days=rng.uniform(0, days)) for _ in range(count))
+    for date in dates:
+        game = rng.choices(games, weights=game_weights)[0]
+        date_str = date.strftime("%Y-%m-%d")
+        duration = str(max(10, int(rng.gauss(int(game["average_duration"]), 15))))
+        seated = rng.sample(players, rng.randint(2, min(5, len(players))))
+        match_players = [{
+            "id": str(player["_id"]),
+            "name": player["username"],
+            "score": rng.randint(20, 120),
+            "team": None,
+        } for player in seated]
+
+        is_team_match = not game["is_cooperative"] and len(match_players) >= 4 and rng.random() < team_ratio
+        is_win = rng.random() < 0.5
+        winning_team = None
+        if game["is_cooperative"]:
+            winner = list(match_players) if is_win else []
+            total_score = None
+            worst_score_player = None
+        elif is_team_match:
+            for index, player in enumerate(match_players):
+                player["team"] = str(index % 2 + 1)
+            winning_team = rng.choice(["1", "2"])
+            winner = [player for player in match_players if player["team"] == winning_team]
+            total_score = None
+            worst_score_player = None
+        else:
+            winner = max(match_players, key=lambda x: x["score"])
+            total_score = sum(player["score"] for player in match_players)
+            worst_score_player = min(match_players, key=lambda x: x["score"])
+
+        match_id = ObjectId()
+        matches.append({
+            "_id": match_id,
+            "game_id": game["bgg_id"],
+            "game_name": game["name"],
+            "game_image": game["image"]["url"],
+            "date": date_str,
+            "players": match_players,
+            "expansions_used": [],
+            "notes": "",
+            "game_duration": duration,
+            "winner": winner,
+            "worst_score_player": worst_score_player,
+            "is_cooperative": game["is_cooperative"],
+            "is_team_match": is_team_match,
+            "total_score": total_score,
+            "winning_team": winning_team,
+            "use_manual_winner": False,
+        })
+
+        by_id = {str(player["_id"]): player for player in seated}
+        for match_player in match_players:
+            player = by_id[match_player["id"]]
+            is_winner = (
+                (game["is_cooperative"] and is_win) or
+                (is_team_match and match_player["team"] == winning_team) or
+                (not game["is_cooperative"] and not is_team_match and match_player["id"] == winner["id"])
+            )
+            player["total_matches"] += 1
+            if is_winner:
+                player["wins"] += 1
+                player["winstreak"] += 1
+                if not game["is_cooperative"] and not is_team_match:
+                    player["num_competitive_win"] += 1
+            else:
+                player["losses"] += 1
+                player["winstreak"] = 0
+            player["longest_winstreak"] = max(player["longest_winstreak"], player["winstreak"])
+            player["matches"].append({
+                "match_id": str(match_id),
+                "game_id": game["bgg_id"],
+                "is_winner": is_winner,
+                "score": match_player["score"],
+                "date": date_str,
+            })
+            if match_player["score"] > game["record_score_by_player"]["score"]:
+                game["record_score_by_player"] = {
+                    "id": match_player["id"],
+                    "name": match_player["name"],
+                    "score": match_player["score"],
+                }
+
+        game["matches"].append({
+            "match_id": str(match_id),
+            "game_duration": duration,
+            "total_score": total_score,
+            "winner": winner,
+        })
+
+    for game in games:
+        if game["matches"]:
+            scored = sum(match["total_score"] for match in game["matches"] if match["total_score"] is not None)
+            game["average_score"] = scored / len(game["matches"])
+    return matches
+
+
+def _insert(collection, documents, batch_size=1000):
+    for i in range(0, len(documents), batch_size):
+        collection.insert_many(documents[i:i + batch_size], ordered=False)
+
+def generate(players, games, matches, password="benchmark", seed=42, reset=False):
+    rng = random.Random(seed)
+    database = db_service.get_db()
+    if reset:
+        for name in COLLECTIONS:
+            database.drop_collection(name)
+
+    start = time.perf_counter()
+    player_docs = make_players(players, password)
+    game_docs = make_games(games, rng)
+    match_docs = make_matches(matches, player_docs, game_docs, rng)
+    generated = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _insert(database["players"], player_docs)
+    _insert(database["games"], game_docs)
+    _insert(database["matches"], match_docs)
+    inserted = time.perf_counter() - start
+
+    largest = max(player_docs, key=lambda player: len(player["matches"]))
+    return {
+        "database": database.name,
+        "players": len(player_docs),
+        "games": len(game_docs),
+        "matches": len(match_docs),
+        "max_matches_per_player": len(largest["matches"]),
+        "max_matches_per_game": max((len(game["matches"]) for game in game_docs), default=0),
+        "login": {"username": player_docs[0]["username"], "password": password},
+        "generate_seconds": round(generated, 2),
+        "insert_seconds": round(inserted, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a MeepleStats database with synthetic players, games and matches")
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--matches", type=int, default=5000)
+    parser.add_argument("--password", default="benchmark", help="password of every generated player")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop the players, games, matches and wishlists collections first")
+    args = parser.parse_args(argv)
+
+    if args.players < 2:
+        parser.error("--players must be at least 2")
+    if args.games < 1:
+        parser.error("--games must be at least 1")
+
+    load_dotenv()
+    summary = generate(args.players, args.games, args.matches, args.password, args.seed, args.reset)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Production settings for gunicorn.
+
+    gunicorn -c gunicorn.conf.py run:app
+
+Every setting can be overridden with the environment variables below, or
+on the command line.
+"""
+import os
+import multiprocessing
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() in ['true', '1', 't']
+
+
+cores = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Threaded workers: most of the request time is spent waiting on MongoDB, S3, Pinecone
+# and the LLM, and chat answers are streamed, so each worker serves several requests at once
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+# One worker per core (plus one to cover blocking), capped since each worker
+# holds its own connection pools and, with EMBEDDING_TYPE=local, its own model
+workers = int(os.getenv('WEB_CONCURRENCY', min(cores + 1, int(os.getenv('GUNICORN_MAX_WORKERS', '8')))))
+
+# Import the app once in the master, the workers share the loaded modules copy-on-write
+preload_app = _env_bool('GUNICORN_PRELOAD', 'True')
+if preload_app:
+    # Background threads and models are not fork-safe: the RAG warm-up is
+    # started in each worker by post_fork instead of at import in the master
+    os.environ['RAG_WARMUP_AFTER_FORK'] = 'True'
+
+# Chat requests wait on retrieval plus an LLM call (LLM_TIMEOUT and retries)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers periodically to bound memory growth, with jitter so they don't restart together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        # The app is imported in the worker itself, nothing inherited to reset
+        return
+
+    # Drop the connections inherited from the master, each worker opens its own
+    from app.services.s3 import S3Client
+    from app.services.storage import get_storage
+    from app.services import rag
+
+    S3Client.reset()
+    get_storage().warm_up()
+    rag.reset_after_fork()
+
+    if os.getenv('ENABLE_RAG') == 'True' and _env_bool('RAG_EAGER_WARMUP', 'False'):
+        rag.start_rag_warmup()
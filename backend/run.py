@@ -1,6 +1,9 @@
+import os
+
 from app import create_app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only, production runs gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.getenv('FLASK_DEBUG', 'False').lower() in ['true', '1', 't'])
\ No newline at end of file
@@ -1,5 +1,6 @@
 import { API_URL, JWT_STORAGE } from "../model/Constants";
 import { RulebookInterface, RulebookChatResponse } from "../model/Interfaces";
+import { directUpload } from "./uploadsApi";
 
 // Get authentication headers or credentials based on JWT storage method
 const getAuthOptions = (): RequestInit => {
@@ -54,6 +55,35 @@ export const uploadRulebook = async (
   gameId: string,
   gameName: string
 ): Promise<{ message: string; file_url: string }> => {
+  // Upload the PDF straight to the bucket when the backend supports it, then let the backend index it
+  const key = await directUpload(file, "rulebook");
+  if (key) {
+    const confirmOptions: RequestInit = {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ key, game_id: gameId, game_name: gameName }),
+    };
+
+    if (JWT_STORAGE === "cookie") {
+      confirmOptions.credentials = "include";
+    } else if (JWT_STORAGE === "localstorage") {
+      confirmOptions.headers = {
+        ...confirmOptions.headers,
+        Authorization: `Bearer ${localStorage.getItem("jwt_token")}`,
+      };
+    }
+
+    const response = await fetch(`${API_URL}/confirm-rulebook-upload`, confirmOptions);
+
+    if (!response.ok) {
+      throw new Error(`Failed to upload rulebook: ${await response.text()}`);
+    }
+
+    return response.json();
+  }
+
   const formData = new FormData();
   formData.append("file", file);
   formData.append("game_id", gameId);
@@ -131,4 +161,72 @@ export const sendChatQuery = async (query: string, rulebookId: string, includeCo
   }
 
   return response.json();
-}; 
\ No newline at end of file
+}; 
+
+// Stream a chat answer from the backend over server-sent events
+export const streamChatQuery = async (
+  query: string,
+  rulebookId: string,
+  onPageRefs: (pageRefs: Array<{ page: string; file: string }>) => void,
+  onToken: (delta: string) => void
+): Promise<void> => {
+  const requestOptions: RequestInit = {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      Accept: "text/event-stream",
+    },
+    body: JSON.stringify({
+      query,
+      rulebook_id: rulebookId,
+      stream: true
+    }),
+  };
+
+  if (JWT_STORAGE === "cookie") {
+    requestOptions.credentials = "include";
+  } else if (JWT_STORAGE === "localstorage") {
+    requestOptions.headers = {
+      ...requestOptions.headers,
+      Authorization: `Bearer ${localStorage.getItem("jwt_token")}`,
+    };
+  }
+
+  const response = await fetch(`${API_URL}/rulebook-chat`, requestOptions);
+
+  if (!response.ok || !response.body) {
+    const errorData = await response.json();
+    throw new Error(errorData.message || "Failed to query rulebook");
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let separator = buffer.indexOf("\n\n");
+    while (separator !== -1) {
+      const rawEvent = buffer.slice(0, separator);
+      buffer = buffer.slice(separator + 2);
+      separator = buffer.indexOf("\n\n");
+
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === "page_refs") onPageRefs(payload);
+      else if (event === "token") onToken(payload.delta);
+      else if (event === "error") throw new Error(payload.error || "Failed to query rulebook");
+    }
+  }
+};
@@ -0,0 +1,50 @@
+import { API_URL, JWT_STORAGE } from "../model/Constants";
+
+// Add the authentication headers or credentials based on JWT storage method
+const withAuth = (requestOptions: RequestInit): RequestInit => {
+  if (JWT_STORAGE === "cookie") {
+    requestOptions.credentials = "include";
+  } else if (JWT_STORAGE === "localstorage") {
+    requestOptions.headers = {
+      ...requestOptions.headers,
+      Authorization: `Bearer ${localStorage.getItem("jwt_token")}`,
+    };
+  }
+  return requestOptions;
+};
+
+// Upload a file straight to the bucket with a presigned POST from /upload-url.
+// Returns the key to send to the backend instead of the file, or null when direct uploads
+// are not available (local storage, bucket without CORS for this origin...) and the file
+// has to go through the backend.
+export const directUpload = async (file: File, kind: "image" | "rulebook"): Promise<string | null> => {
+  try {
+    const response = await fetch(
+      `${API_URL}/upload-url`,
+      withAuth({
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ filename: file.name, content_type: file.type, kind }),
+      })
+    );
+    if (!response.ok) {
+      return null;
+    }
+    const { key, url, fields } = await response.json();
+
+    const formData = new FormData();
+    Object.entries(fields as Record<string, string>).forEach(([name, value]) => formData.append(name, value));
+    // The file must be the last field of the form
+    formData.append("file", file);
+
+    const upload = await fetch(url, { method: "POST", body: formData });
+    if (!upload.ok) {
+      console.warn("Direct upload rejected by the bucket:", upload.status);
+      return null;
+    }
+    return key;
+  } catch (error) {
+    console.warn("Direct upload failed, sending the file to the backend:", error);
+    return null;
+  }
+};
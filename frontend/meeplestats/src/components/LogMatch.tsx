@@ -6,6 +6,7 @@ import { useNavigate } from "react-router";
 import { PillsInput, Pill, Combobox, CheckIcon, useCombobox } from "@mantine/core";
 import { Game, Player } from "../model/Interfaces";
 import { API_URL, JWT_STORAGE } from "../model/Constants";
+import { directUpload } from "../api/uploadsApi";
 import { notifications } from "@mantine/notifications";
 import { useTranslation } from "react-i18next";
 
@@ -182,7 +183,13 @@ const LogMatch = () => {
     data.append("note", values.note);
     data.append("date", values.date);
     if (values.image) {
-      data.append("image", values.image);
+      // Upload the photo straight to the bucket when possible, otherwise send it with the form
+      const imageKey = await directUpload(values.image, "image");
+      if (imageKey) {
+        data.append("image_key", imageKey);
+      } else {
+        data.append("image", values.image);
+      }
     }
     data.append("duration", values.duration);
     data.append("isWin", values.isWin.toString());
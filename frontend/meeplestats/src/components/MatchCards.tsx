@@ -5,7 +5,7 @@ import { IconPhoto } from "@tabler/icons-react";
 import { API_URL } from "../model/Constants";
 import { useTranslation } from "react-i18next";
 
-const MatchCard = ({ game_name, date, game_duration, game_image, players, winner, notes, image_url, is_cooperative, is_team_match, winning_team, use_manual_winner }: MatchCardInterface) => {
+const MatchCard = ({ game_name, date, game_duration, game_image, players, winner, notes, image_url, thumbnail_url, is_cooperative, is_team_match, winning_team, use_manual_winner }: MatchCardInterface) => {
 
   const [opened, { open, close }] = useDisclosure(false);
 
@@ -14,6 +14,8 @@ const MatchCard = ({ game_name, date, game_duration, game_image, players, winner
 
   const { t } = useTranslation();
 
+  const resolveImageUrl = (url?: string) => url?.startsWith('/uploads') ? `${API_URL}${url}` : url;
+
   const isWinner = (playerId: string) => {
     if (is_cooperative) {
       // For coop games, check if winner array has players (win) or is empty (loss)
@@ -177,10 +179,7 @@ const MatchCard = ({ game_name, date, game_duration, game_image, players, winner
         >
           <Box className="!max-h-[70vh] !overflow-hidden">
             <Image
-              src={image_url?.startsWith('/uploads')
-                ? `${API_URL}${image_url}`
-                : image_url
-              }
+              src={resolveImageUrl(image_url)}
               alt={game_name || "Match photo"}
               fit="contain"
               height="auto"
@@ -199,9 +198,22 @@ const MatchCard = ({ game_name, date, game_duration, game_image, players, winner
               radius="md"
               size="sm"
               className={`!transition-colors ${isDarkMode ? "!bg-gray-700 !text-gray-200 hover:!bg-gray-600" : "!bg-blue-50 !text-blue-600 hover:!bg-blue-100"}`}
-              p={8}
+              p={thumbnail_url ? 4 : 8}
+              h={thumbnail_url ? "auto" : undefined}
             >
-              <IconPhoto size={18} stroke={1.5} />
+              {thumbnail_url ? (
+                <Image
+                  src={resolveImageUrl(thumbnail_url)}
+                  alt={game_name || "Match photo"}
+                  w={48}
+                  h={48}
+                  radius="sm"
+                  fit="cover"
+                  loading="lazy"
+                />
+              ) : (
+                <IconPhoto size={18} stroke={1.5} />
+              )}
             </Button>
           </Box>
         )}
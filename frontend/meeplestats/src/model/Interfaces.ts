@@ -46,6 +46,7 @@ export interface MatchCardInterface {
   game_image: string;
   notes: string;
   image_url: string;
+  thumbnail_url?: string;
   is_cooperative: boolean;
   is_team_match: boolean;
   winning_team: string;
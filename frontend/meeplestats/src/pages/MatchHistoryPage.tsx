@@ -87,6 +87,7 @@ const MatchHistoryPage = () => {
                 players={match.players}
                 notes={match.notes}
                 image_url={match.image_url}
+                thumbnail_url={match.thumbnail_url}
                 is_cooperative={match.is_cooperative}
                 is_team_match={match.is_team_match}
                 winning_team={match.winning_team}
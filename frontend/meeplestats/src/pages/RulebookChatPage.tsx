@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
 import { useParams, useNavigate } from "react-router";
-import { fetchRulebookById, fetchRulebooks, sendChatQuery } from "../api/rulebooksApi";
+import { fetchRulebookById, fetchRulebooks, streamChatQuery } from "../api/rulebooksApi";
 import { RulebookInterface } from "../model/Interfaces";
 import { API_URL } from "../model/Constants";
 import { Container, Title, Paper, Group, Text, Button, Select, LoadingOverlay, Box, Textarea, Stack, Avatar, Alert, Badge, ScrollArea, useMantineColorScheme } from "@mantine/core";
@@ -146,19 +146,23 @@ const RulebookChatPage = () => {
     setChatLoading(true);
 
     try {
-      // Send query to backend - always false for includeContext
-      const response = await sendChatQuery(message.trim(), selectedRulebookId, false);
-
-      // Update bot message with response
+      // Stream the answer from the backend, page references arrive before the first token
+      await streamChatQuery(
+        message.trim(),
+        selectedRulebookId,
+        (pageRefs) => setMessages(prev => prev.map(msg =>
+          msg.id === botMessageId ? { ...msg, page_refs: pageRefs } : msg
+        )),
+        (delta) => setMessages(prev => prev.map(msg =>
+          msg.id === botMessageId
+            ? { ...msg, content: msg.content + delta, isLoading: false }
+            : msg
+        ))
+      );
+
+      // Make sure the loader is gone even if the answer was empty
       setMessages(prev => prev.map(msg =>
-        msg.id === botMessageId
-          ? {
-            ...msg,
-            content: response.answer,
-            isLoading: false,
-            page_refs: response.page_refs
-          }
-          : msg
+        msg.id === botMessageId ? { ...msg, isLoading: false } : msg
       ));
     } catch (err) {
       // Update bot message with error